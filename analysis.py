@@ -0,0 +1,180 @@
+"""
+Detection of sequence replays in network activity.
+
+Activity is given as boolean activations of shape (n_steps x n_nodes), or
+(n_trials x n_steps x n_nodes) for a batch of trials, e.g., the rs returned by the
+discrete-time models; LIF spike events can be binned into the same format. A
+replay of a target sequence (a list of node indexes) with onset t is a set of
+activations of its nodes, in order, with the first at t and each subsequent one
+at most max_lag steps after the previous one. All trials, target sequences (in
+both directions), and onsets are checked at once.
+"""
+from __future__ import division, print_function
+import numpy as np
+
+
+# tolerance for times that fall on bin edges up to floating point error
+_EPS = 1e-9
+
+
+def _as_seq_list(seqs):
+    """
+    Return a list of sequences, given a single sequence or a list of sequences.
+    """
+    if len(seqs) and np.ndim(seqs[0]) == 0: return [list(seqs)]
+
+    return [list(seq) for seq in seqs]
+
+
+def match_onsets(rs, seqs, max_lag=1):
+    """
+    Find the onsets of all occurrences of a set of sequences in a batch of trials.
+    :param rs: boolean activations (n_trials x n_steps x n_nodes)
+    :param seqs: list of target sequences (can differ in length)
+    :param max_lag: maximum number of steps between consecutive elements
+    :return: boolean array (n_trials x n_seqs x n_steps), True at onsets
+    """
+    n_trials, n_steps, n_nodes = rs.shape
+    lengths = np.array([len(seq) for seq in seqs])
+
+    padded = np.zeros((len(seqs), lengths.max()), dtype=int)
+    for seq_ctr, seq in enumerate(seqs):
+        padded[seq_ctr, :len(seq)] = seq
+
+    # time windows in which the next element must occur
+    ts = np.arange(n_steps)
+    window_starts = np.minimum(ts + 1, n_steps)
+    window_ends = np.minimum(ts + 1 + max_lag, n_steps)
+
+    # working backwards from the last element, find the times at which each
+    # element can occur such that the rest of its sequence follows
+    feasible = np.ones((n_trials, len(seqs), n_steps), dtype=bool)
+
+    for k in reversed(range(lengths.max())):
+
+        active = rs[:, :, padded[:, k]].transpose(0, 2, 1)
+
+        n_feasible = np.concatenate(
+            [np.zeros(feasible.shape[:2] + (1,)), np.cumsum(feasible, axis=2)], axis=2)
+        followed = (n_feasible[:, :, window_ends] - n_feasible[:, :, window_starts]) > 0
+
+        is_last = (lengths == k + 1)[None, :, None]
+        has_k = (lengths > k)[None, :, None]
+
+        feasible = np.where(has_k, active & (is_last | followed), feasible)
+
+    return feasible
+
+
+def detect_replays(rs, seqs, directions=('forward', 'reverse'), max_lag=1, exclusive=True):
+    """
+    Detect forward and/or reverse replays of one or more target sequences.
+
+    :param rs: activations (n_steps x n_nodes), or (n_trials x n_steps x n_nodes)
+    :param seqs: target sequence or list of target sequences (lists of node indexes)
+    :param directions: replay directions to detect ('forward' and/or 'reverse')
+    :param max_lag: maximum number of steps between consecutive sequence elements
+    :param exclusive: if True, sequence elements only count when no other node is
+        active at the same time step
+    :return: dict with one entry per direction, each a dict with:
+        'matches': boolean array (n_trials x n_seqs x n_steps), True at onsets
+        'counts': number of replays (n_trials x n_seqs)
+        'onsets': list over trials of lists over sequences of onset time arrays
+        (the leading trial dimension is dropped if rs is a single trial)
+    """
+    rs = np.asarray(rs) > 0
+    single_trial = rs.ndim == 2
+    if single_trial: rs = rs[None]
+
+    if exclusive: rs = rs & (rs.sum(axis=2, keepdims=True) == 1)
+
+    seqs = _as_seq_list(seqs)
+
+    # stack targets of all directions so that they are matched in one pass
+    targets = [seq if direction == 'forward' else seq[::-1]
+               for direction in directions for seq in seqs]
+
+    matches = match_onsets(rs, targets, max_lag=max_lag)
+
+    replays = {}
+
+    for d_ctr, direction in enumerate(directions):
+
+        assert direction in ('forward', 'reverse')
+
+        matches_ = matches[:, d_ctr*len(seqs):(d_ctr + 1)*len(seqs)]
+        onsets = [[m.nonzero()[0] for m in matches_trial] for matches_trial in matches_]
+
+        if single_trial: matches_, onsets = matches_[0], onsets[0]
+
+        replays[direction] = {
+            'matches': matches_, 'counts': matches_.sum(axis=-1), 'onsets': onsets}
+
+    return replays
+
+
+def spike_raster(spike_times, spike_cells, n_cells, bin_size, duration):
+    """
+    Bin spike events into a boolean raster.
+    :param spike_times: spike times
+    :param spike_cells: index of cell that fired each spike
+    :param n_cells: number of cells
+    :param bin_size: bin width
+    :param duration: total duration (spikes at or after it are dropped)
+    :return: boolean array (n_bins x n_cells)
+    """
+    n_bins = int(np.ceil(duration / bin_size - _EPS))
+
+    spike_times = np.asarray(spike_times, dtype=float)
+    spike_cells = np.asarray(spike_cells, dtype=int)
+
+    bins = np.floor(spike_times / bin_size + _EPS).astype(int)
+    valid = (bins >= 0) & (bins < n_bins)
+
+    raster = np.zeros((n_bins, n_cells), dtype=bool)
+    raster[bins[valid], spike_cells[valid]] = True
+
+    return raster
+
+
+def detect_spike_replays(
+        spike_times, spike_cells, seqs, n_cells, bin_size, max_lag, duration,
+        directions=('forward', 'reverse')):
+    """
+    Detect replays of target sequences in spike events (e.g., of a LIF network),
+    allowing for jitter in spike timing: consecutive sequence elements may be up
+    to max_lag apart, and other cells may fire in between.
+
+    :param spike_times: list over trials of spike time arrays (or a single array)
+    :param spike_cells: list over trials of spiking cell arrays (or a single array)
+    :param seqs: target sequence or list of target sequences (lists of cell indexes)
+    :param n_cells: number of cells
+    :param bin_size: temporal resolution of detection
+    :param max_lag: maximum time between consecutive sequence elements
+    :param duration: duration of each trial
+    :param directions: replay directions to detect ('forward' and/or 'reverse')
+    :return: same as detect_replays, with onsets given as times (start of bin)
+    """
+    single_trial = np.ndim(spike_times[0]) == 0 if len(spike_times) else True
+    if single_trial: spike_times, spike_cells = [spike_times], [spike_cells]
+
+    rasters = np.array([
+        spike_raster(times, cells, n_cells, bin_size, duration)
+        for times, cells in zip(spike_times, spike_cells)])
+
+    if single_trial: rasters = rasters[0]
+
+    replays = detect_replays(
+        rasters, seqs, directions=directions,
+        max_lag=int(np.ceil(max_lag / bin_size - _EPS)), exclusive=False)
+
+    for replay in replays.values():
+
+        if single_trial:
+            replay['onsets'] = [onsets * bin_size for onsets in replay['onsets']]
+        else:
+            replay['onsets'] = [
+                [onsets * bin_size for onsets in onsets_trial]
+                for onsets_trial in replay['onsets']]
+
+    return replays
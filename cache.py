@@ -0,0 +1,345 @@
+"""
+Content-addressed caches for numpy arrays.
+
+On disk, each entry lives in its own directory (named by a hash of whatever
+produced it) and holds one uncompressed .npy file per array plus a small json
+metadata file, so that arrays can be reloaded lazily via memory mapping.
+Simulation outputs can additionally be kept in an in-memory LRU in front of the
+disk store.
+"""
+from __future__ import division, print_function
+from collections import OrderedDict
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import types
+import numpy as np
+from scipy import sparse
+
+
+DEFAULT_CACHE_DIR = os.getenv(
+    'NPR_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'neural_pattern_replay'))
+
+DEFAULT_MAX_BYTES = 2 ** 30
+
+
+def _update_hash(h, item):
+    """
+    Recursively feed an item into a hash object.
+    """
+    if isinstance(item, np.ndarray):
+        item = np.ascontiguousarray(item)
+        h.update('ndarray:{}:{}:'.format(item.dtype.str, item.shape).encode())
+        h.update(item.tobytes())
+
+    elif sparse.issparse(item):
+        item = sparse.csr_matrix(item)
+        h.update('sparse:{}:'.format(item.shape).encode())
+        for component in (item.data, item.indices, item.indptr):
+            _update_hash(h, component)
+
+    elif isinstance(item, dict):
+        h.update('dict:{}:'.format(len(item)).encode())
+        for key in sorted(item.keys(), key=repr):
+            _update_hash(h, key)
+            _update_hash(h, item[key])
+
+    elif isinstance(item, (list, tuple)):
+        h.update('{}:{}:'.format(type(item).__name__, len(item)).encode())
+        for element in item:
+            _update_hash(h, element)
+
+    elif isinstance(item, (set, frozenset)):
+        h.update('{}:{}:'.format(type(item).__name__, len(item)).encode())
+        for element in sorted(item, key=repr):
+            _update_hash(h, element)
+
+    elif isinstance(item, types.CodeType):
+        _update_hash_code(h, item)
+
+    elif isinstance(item, functools.partial):
+        h.update(b'partial:')
+        _update_hash(h, (item.func, item.args, item.keywords or {}))
+
+    elif callable(item):
+        _update_hash_function(h, item, set())
+
+    else:
+        h.update('{}:{!r}:'.format(type(item).__name__, item).encode())
+
+
+def _update_hash_code(h, code):
+    """
+    Feed the bytecode, constants (including nested code objects, e.g., of inner
+    functions) and referenced names of a code object into a hash object.
+    """
+    h.update('code:{}:'.format(code.co_name).encode())
+    h.update(code.co_code)
+    _update_hash(h, code.co_consts)
+    _update_hash(h, code.co_names)
+
+
+def _update_hash_function(h, func, seen):
+    """
+    Feed a function into a hash object: its qualified name and, for functions
+    defined in Python, its code, default arguments and closure values, so that
+    lambdas, local functions, and functions whose body has changed get different
+    keys. Global names are hashed by name only, not by value. seen holds ids of
+    functions being hashed, so that recursive closures terminate.
+    """
+    if not hasattr(func, '__qualname__'):
+        # callable object: identified by its type and repr
+        h.update('callable:{}.{}:{!r}:'.format(
+            type(func).__module__, type(func).__qualname__, func).encode())
+        return
+
+    h.update('callable:{}.{}:'.format(
+        getattr(func, '__module__', ''), func.__qualname__).encode())
+
+    code = getattr(func, '__code__', None)
+    if code is None or id(func) in seen: return
+
+    seen.add(id(func))
+
+    _update_hash_code(h, code)
+    _update_hash(h, getattr(func, '__defaults__', None))
+    _update_hash(h, getattr(func, '__kwdefaults__', None))
+
+    for cell in getattr(func, '__closure__', None) or ():
+
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            # cell of a variable not yet assigned
+            h.update(b'empty:')
+            continue
+
+        if callable(value) and hasattr(value, '__code__'):
+            _update_hash_function(h, value, seen)
+        else:
+            _update_hash(h, value)
+
+
+def make_key(*items):
+    """
+    Make a hex key that uniquely identifies a collection of items (numbers,
+    strings, lists, dicts, sets, numpy arrays, scipy sparse matrices, functions).
+    Functions are identified by their qualified name, code, defaults and closure
+    values (see _update_hash_function).
+    :param items: items to hash
+    :return: hex digest
+    """
+    h = hashlib.sha1()
+    _update_hash(h, items)
+
+    return h.hexdigest()
+
+
+class DiskCache(object):
+    """
+    Size-bounded on-disk store of named numpy arrays, keyed by content hash.
+    When the total size exceeds max_bytes, least recently used entries are evicted.
+
+    :param directory: root directory of cache
+    :param max_bytes: maximum total size of cache in bytes
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+
+        self.directory = directory or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+
+        # total size of entries as of the last scan plus those saved since, so that
+        # the directory is only scanned when the cache may be too large
+        self._total_bytes = None
+
+    def path(self, key):
+
+        return os.path.join(self.directory, key[:2], key)
+
+    def __contains__(self, key):
+
+        return os.path.isfile(os.path.join(self.path(key), 'meta.json'))
+
+    def load(self, key, mmap_mode='r'):
+        """
+        Load an entry.
+        :param key: entry key
+        :param mmap_mode: memory mapping mode passed to np.load
+        :return: (dict of arrays, metadata) or None if entry is not present
+        """
+        if key not in self: return None
+
+        path = self.path(key)
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        arrays = {
+            name: np.load(os.path.join(path, '{}.npy'.format(name)), mmap_mode=mmap_mode)
+            for name in meta['arrays']
+        }
+
+        # mark entry as recently used
+        os.utime(os.path.join(path, 'meta.json'), None)
+
+        return arrays, meta['meta']
+
+    def save(self, key, arrays, meta=None):
+        """
+        Save an entry, then evict old entries if the cache has grown too large.
+        :param key: entry key
+        :param arrays: dict of arrays to store
+        :param meta: json-serializable metadata
+        """
+        path = self.path(key)
+        if not os.path.exists(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+
+        # write to a temporary directory first so that readers never see partial entries
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(path))
+
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, '{}.npy'.format(name)), np.asarray(array))
+
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'arrays': sorted(arrays.keys()), 'meta': meta}, f)
+
+        size = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # another process saved the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        if self._total_bytes is not None: self._total_bytes += size
+
+        if self._total_bytes is None or self._total_bytes > self.max_bytes: self.evict()
+
+    def entries(self):
+        """
+        Return list of (last used time, size in bytes, path) for all entries.
+        """
+        entries = []
+
+        if not os.path.isdir(self.directory): return entries
+
+        for prefix in os.listdir(self.directory):
+
+            if not os.path.isdir(os.path.join(self.directory, prefix)): continue
+
+            for key in os.listdir(os.path.join(self.directory, prefix)):
+
+                path = os.path.join(self.directory, prefix, key)
+                meta_file = os.path.join(path, 'meta.json')
+                if not os.path.isfile(meta_file): continue
+
+                size = sum(
+                    os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(meta_file), size, path))
+
+        return entries
+
+    def evict(self):
+        """
+        Remove least recently used entries until cache is no larger than max_bytes.
+        """
+        entries = sorted(self.entries())
+        total = sum(entry[1] for entry in entries)
+
+        while entries and total > self.max_bytes:
+            _, size, path = entries.pop(0)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+        self._total_bytes = total
+
+    def clear(self):
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._total_bytes = None
+
+
+class SimulationCache(object):
+    """
+    Cache of simulation outputs (dicts of arrays) keyed by a hash of everything
+    that determines them: an in-memory LRU of up to max_items entries, optionally
+    backed by a DiskCache that persists entries across processes and sessions.
+
+    :param max_items: maximum number of entries kept in memory
+    :param disk_cache: DiskCache in which entries are also stored, or None
+    """
+
+    def __init__(self, max_items=256, disk_cache=None):
+
+        self.max_items = max_items
+        self.disk_cache = disk_cache
+
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return copies of the arrays stored under a key, or None if not present.
+        """
+        if key in self.entries:
+
+            # mark entry as recently used
+            arrays = self.entries.pop(key)
+            self.entries[key] = arrays
+
+        else:
+
+            entry = None if self.disk_cache is None else \
+                self.disk_cache.load(key, mmap_mode=None)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            arrays = entry[0]
+            self._remember(key, arrays)
+
+        self.hits += 1
+
+        return {name: array.copy() for name, array in arrays.items()}
+
+    def put(self, key, arrays):
+        """
+        Store copies of a dict of arrays under a key.
+        """
+        arrays = {name: np.array(array) for name, array in arrays.items()}
+
+        self._remember(key, arrays)
+        if self.disk_cache is not None: self.disk_cache.save(key, arrays)
+
+    def _remember(self, key, arrays):
+
+        self.entries[key] = arrays
+
+        while len(self.entries) > self.max_items:
+            self.entries.popitem(last=False)
+
+
+# simulation caches of this process, by (process id, directory)
+_SIMULATION_CACHES = {}
+
+
+def shared_simulation_cache(directory=None):
+    """
+    Return the SimulationCache shared by all networks of this process, backed by
+    a DiskCache in directory (default: DEFAULT_CACHE_DIR), so that stored outputs
+    are reused across networks, trials, and figure regenerations. Worker
+    processes each get their own in-memory tier and share the disk tier.
+    """
+    key = (os.getpid(), directory or DEFAULT_CACHE_DIR)
+
+    if key not in _SIMULATION_CACHES:
+        _SIMULATION_CACHES[key] = SimulationCache(disk_cache=DiskCache(directory))
+
+    return _SIMULATION_CACHES[key]
@@ -2,6 +2,8 @@ from __future__ import division, print_function
 import networkx as nx
 import numpy as np
 
+from cache import DiskCache, make_key
+
 
 def feed_forward_grid(shape, spread):
     """
@@ -77,12 +79,98 @@ def er_directed_nary(n_nodes, p_connect, strengths, p_strengths):
     w = (np.random.rand(n_nodes, n_nodes) < p_connect).astype(float)
     np.fill_diagonal(w, 0)
 
-    w[w > 0] = np.random.choice(strengths, size=(w.sum(),), p=p_strengths)
+    w[w > 0] = np.random.choice(strengths, size=(int(w.sum()),), p=p_strengths)
 
     return w
 
 
-def basic_adlib(principal_connectivity_mask, w_pp, w_mp, w_pm, w_mm):
+def random_mask(n_nodes, p_connect):
+    """
+    Construct a random binary weight matrix in which each entry (including
+    self-connections) is 1 with probability p_connect.
+
+    :param n_nodes: number of nodes
+    :param p_connect: connection probability
+    :return: weight matrix (rows are targs, cols are srcs)
+    """
+
+    return (np.random.rand(n_nodes, n_nodes) < p_connect).astype(float)
+
+
+def random_transition_mask(n_nodes, p_connect):
+    """
+    Construct a random binary transition mask without self-transitions, in which
+    every node has at least one outgoing transition (redrawing until it does).
+
+    :param n_nodes: number of nodes
+    :param p_connect: transition probability
+    :return: transition mask (rows are targs, cols are srcs)
+    """
+
+    while True:
+        w = random_mask(n_nodes, p_connect)
+        np.fill_diagonal(w, 0)
+        if np.all(w.sum(axis=0) > 0): return w
+
+
+def block_sparse(sizes, blocks, fmt='csr'):
+    """
+    Assemble a weight matrix for multiple populations from blocks of connections
+    between them. Missing blocks are left implicit (all zeros) and scalar blocks
+    are interpreted as scaled identity matrices, so no dense zero or diagonal blocks
+    are ever allocated.
+
+    :param sizes: list of (population name, population size) pairs, in the order
+        populations should appear in the weight matrix
+    :param blocks: dict mapping (targ population, src population) to a block, which is
+        either a scalar (scaled identity; populations must be same size), a 2D array,
+        or a scipy sparse matrix
+    :param fmt: scipy sparse format of returned matrix
+    :return: sparse weight matrix (rows are targs, cols are srcs)
+    """
+    from scipy import sparse
+
+    names = [name for name, _ in sizes]
+    n_cells = dict(sizes)
+
+    unknown = [pair for pair in blocks if pair[0] not in n_cells or pair[1] not in n_cells]
+    if unknown:
+        raise Exception('blocks refer to unknown populations: {}'.format(unknown))
+
+    rows = []
+
+    for targ in names:
+
+        row = []
+
+        for src in names:
+
+            block = blocks.get((targ, src))
+            shape = (n_cells[targ], n_cells[src])
+
+            if block is None:
+                row.append(sparse.coo_matrix(shape))
+                continue
+
+            if np.isscalar(block):
+                if shape[0] != shape[1]:
+                    raise Exception(
+                        'scalar block ({}, {}) requires populations of equal size'.format(
+                            targ, src))
+                block = block * sparse.identity(shape[0], format='coo')
+
+            if block.shape != shape:
+                raise Exception('block ({}, {}) has shape {} but expected {}'.format(
+                    targ, src, block.shape, shape))
+
+            row.append(sparse.coo_matrix(block))
+
+        rows.append(row)
+
+    return sparse.bmat(rows, format=fmt)
+
+
+def basic_adlib(principal_connectivity_mask, w_pp, w_mp, w_pm, w_mm, sparse=False):
     """
     Build the connectivity for a basic ADLIB (activation-dependent lingering increases in baseline) network.
 
@@ -91,6 +179,7 @@ def basic_adlib(principal_connectivity_mask, w_pp, w_mp, w_pm, w_mm):
     :param w_mp: connection strength from principal to memory nodes
     :param w_pm: connection strength from memory to principal nodes
     :param w_mm: self connection strength for memory nodes
+    :param sparse: if True, return a scipy sparse matrix instead of a dense array
     :return: weight matrix
     """
 
@@ -98,10 +187,58 @@ def basic_adlib(principal_connectivity_mask, w_pp, w_mp, w_pm, w_mm):
 
     w_principal = principal_connectivity_mask.astype(float) * w_pp
 
-    w_left = np.concatenate([w_principal, w_mp * np.eye(n_nodes)], axis=0)
-    w_right = np.concatenate([w_pm * np.eye(n_nodes), w_mm * np.eye(n_nodes)], axis=0)
+    w = block_sparse(
+        sizes=[('principal', n_nodes), ('memory', n_nodes)],
+        blocks={
+            ('principal', 'principal'): w_principal,
+            ('principal', 'memory'): float(w_pm),
+            ('memory', 'principal'): float(w_mp),
+            ('memory', 'memory'): float(w_mm),
+        })
+
+    return w if sparse else w.toarray()
+
+
+def adlib_lif(principal_connectivity_mask, w_pp, w_mp, w_pm, w_mm, w_pi, w_ip, sparse=False):
+    """
+    Build the synapse-type-specific weight matrices for a LIF ADLIB network composed of
+    principal neurons, one memory neuron per principal neuron, and a single inhibitory
+    neuron (in that order). Principal-principal, principal-memory, and memory-memory
+    connections are NMDA, memory-principal and principal-inhibitory connections are
+    AMPA, and inhibitory-principal connections are GABA.
+
+    :param principal_connectivity_mask: binary connections among principal neurons
+    :param w_pp: connection strength among principal neurons
+    :param w_mp: connection strength from principal to memory neurons
+    :param w_pm: connection strength from memory to principal neurons
+    :param w_mm: self connection strength for memory neurons
+    :param w_pi: connection strength from inhibitory to principal neurons
+    :param w_ip: connection strength from principal to inhibitory neuron
+    :param sparse: if True, return scipy sparse matrices instead of dense arrays
+    :return: dict of weight matrices keyed by synapse type ('ampa', 'nmda', 'gaba')
+    """
+
+    n = principal_connectivity_mask.shape[0]
+    sizes = [('principal', n), ('memory', n), ('inhibitory', 1)]
+
+    ws = {
+        'ampa': block_sparse(sizes, {
+            ('memory', 'principal'): float(w_mp),
+            ('inhibitory', 'principal'): w_ip * np.ones((1, n)),
+        }),
+        'nmda': block_sparse(sizes, {
+            ('principal', 'principal'): w_pp * principal_connectivity_mask.astype(float),
+            ('principal', 'memory'): float(w_pm),
+            ('memory', 'memory'): float(w_mm),
+        }),
+        'gaba': block_sparse(sizes, {
+            ('principal', 'inhibitory'): w_pi * np.ones((n, 1)),
+        }),
+    }
+
+    if not sparse: ws = {syn: w.toarray() for syn, w in ws.items()}
 
-    return np.concatenate([w_left, w_right], axis=1)
+    return ws
 
 
 def hexagonal_lattice(d):
@@ -175,3 +312,98 @@ def hexagonal_lattice(d):
         nodes[node_ctr] = (node[0] - d + 1, node[1] - 2*d + 2)
 
     return w, nodes
+
+
+def _encode_extras(item):
+    """
+    Convert extra builder outputs into json-serializable form, marking tuples.
+    """
+    if isinstance(item, tuple):
+        return {'__tuple__': [_encode_extras(element) for element in item]}
+    elif isinstance(item, list):
+        return [_encode_extras(element) for element in item]
+    elif isinstance(item, np.generic):
+        return item.item()
+    return item
+
+
+def _decode_extras(item):
+
+    if isinstance(item, dict) and '__tuple__' in item:
+        return tuple(_decode_extras(element) for element in item['__tuple__'])
+    elif isinstance(item, list):
+        return [_decode_extras(element) for element in item]
+    return item
+
+
+def cached(builder, *args, **kwargs):
+    """
+    Call a connectivity builder, storing its output in an on-disk cache so that
+    subsequent calls with the same builder, arguments, and seed skip construction.
+    Weight matrices are stored in compressed sparse row format and reloaded via
+    memory mapping.
+
+    Stochastic builders (e.g., er_directed_nary) are only cached when a seed is given;
+    the global random state is restored after building so that cache hits and
+    misses leave the caller's random stream identical.
+
+    Builders are identified by their code, defaults, and closure values (see
+    cache.make_key), but module-level functions they call only by name: after
+    editing such a helper, clear the cache (cache.DiskCache().clear()).
+
+    :param builder: connectivity function returning a weight matrix or a tuple whose
+        first element is a weight matrix and whose remaining elements are
+        json-serializable (e.g., hexagonal_lattice)
+    :param args: positional args to builder
+    :param kwargs: keyword args to builder, plus the following optional args:
+        :param seed: random seed set before calling builder
+        :param cache: cache.DiskCache instance
+        :param sparse: if True, return weight matrix as scipy.sparse.csr_matrix
+            over memory mapped arrays instead of a dense array
+    :return: same output as builder
+    """
+    from scipy import sparse as sp
+
+    seed = kwargs.pop('seed', None)
+    disk_cache = kwargs.pop('cache', None) or DiskCache()
+    return_sparse = kwargs.pop('sparse', False)
+
+    key = make_key('connectivity', builder, args, kwargs, seed)
+    entry = disk_cache.load(key)
+
+    if entry is None:
+
+        if seed is not None:
+            state = np.random.get_state()
+            np.random.seed(seed)
+
+        try:
+            output = builder(*args, **kwargs)
+        finally:
+            if seed is not None: np.random.set_state(state)
+
+        is_tuple = isinstance(output, tuple)
+        w, extras = (output[0], list(output[1:])) if is_tuple else (output, [])
+        w_csr = sp.csr_matrix(w)
+
+        arrays = {'data': w_csr.data, 'indices': w_csr.indices, 'indptr': w_csr.indptr}
+        meta = {
+            'shape': list(w_csr.shape), 'is_tuple': is_tuple,
+            'extras': _encode_extras(extras),
+        }
+
+        disk_cache.save(key, arrays, meta)
+
+        # fall back to in-memory arrays if entry was too large to be kept in cache
+        entry = disk_cache.load(key) or (arrays, meta)
+
+    arrays, meta = entry
+    w = sp.csr_matrix(
+        (arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(meta['shape']),
+        copy=False)
+
+    if not return_sparse: w = w.toarray()
+
+    if not meta['is_tuple']: return w
+
+    return tuple([w] + _decode_extras(meta['extras']))
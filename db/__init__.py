@@ -2,54 +2,360 @@
 Class for reading from and writing to database.
 """
 from __future__ import division, print_function
+from contextlib import contextmanager
 from datetime import datetime
 from getpass import getpass
-import inspect
+from importlib import reload
+import json
 import logging
 import os
 from pprint import pprint
 import threading
 
-from sqlalchemy import create_engine
+import numpy as np
+from sqlalchemy import LargeBinary, create_engine, event, func, inspect, or_, text
 from sqlalchemy.orm import sessionmaker
 
-from _models import Base
+from db._models import Base, NumpyArray
+from db.export import export_group, invalidate, load_group, select_rows
+from db.merge import merge_shards
+from db.writer import BackgroundWriter, ResultWriter
 
 
-def connect_and_make_session(database):
+BACKENDS = ('postgres', 'sqlite')
+
+# engines and session factories shared by all callers in this process, keyed by
+# database; each entry is (engine, session factory, id of process that made it)
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def _json_default(obj):
     """
-    Connect to a database, asking user for username and password, and return
-    a new session object for that database.
-    :param database: name of database to connect to
-    :return: session object
+    Make numpy scalars and arrays json-serializable.
+    """
+    if isinstance(obj, np.generic): return obj.item()
+    if isinstance(obj, np.ndarray): return obj.tolist()
+
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
+
+
+def _json_serializer(obj):
+
+    return json.dumps(obj, default=_json_default)
+
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    """
+    Use write-ahead logging, so that readers don't block the writer, and wait for
+    locks held by other processes instead of failing immediately.
     """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=60000')
+    cursor.close()
+
+
+def get_backend(backend=None):
+    """
+    Get the database backend to use: the one given, else the one specified by the
+    NPR_DB_BACKEND environment variable, else postgres.
+    """
+    backend = backend or os.getenv('NPR_DB_BACKEND', 'postgres')
+
+    if backend not in BACKENDS:
+        raise Exception('Backend must be one of {}, not "{}".'.format(BACKENDS, backend))
+
+    return backend
+
+
+def make_url(database, backend=None):
+    """
+    Build the connection url for a database. SQLite databases are stored as
+    <database>.db in the directory given by the NPR_SQLITE_DIR environment variable
+    (default: the current directory). For postgres, the username and password are
+    read from the environment or asked of the user.
+    :param database: name of database
+    :param backend: database backend (see get_backend)
+    :return: connection url
+    """
+    backend = get_backend(backend)
+
+    if backend == 'sqlite':
+
+        directory = os.getenv('NPR_SQLITE_DIR', '.')
+        if not os.path.exists(directory): os.makedirs(directory)
 
-    # build connection url from input
+        return 'sqlite:///{}'.format(
+            os.path.abspath(os.path.join(directory, '{}.db'.format(database))))
 
     user = os.getenv('MUSHROOM_MUSHROOM_USER')
     password = os.getenv('MUSHROOM_MUSHROOM_PASS')
 
     if not user:
 
-        user = raw_input('user:')
+        user = input('user:')
         password = getpass('password:')
 
-    url = 'postgres://{}:{}@/{}'.format(user, password, database)
+    return 'postgresql://{}:{}@/{}'.format(user, password, database)
+
+
+def make_engine(database, backend=None):
+    """
+    Make an engine for a database.
+    :param database: name of database
+    :param backend: database backend (see get_backend)
+    :return: engine
+    """
+    backend = get_backend(backend)
+
+    if backend == 'sqlite':
+
+        engine = create_engine(
+            make_url(database, backend), json_serializer=_json_serializer)
+        event.listen(engine, 'connect', _configure_sqlite_connection)
+
+    else:
+        engine = create_engine(make_url(database, backend), pool_pre_ping=True)
+
+    return engine
+
+
+def get_engine(database, backend=None):
+    """
+    Get the engine for a database, shared by all callers in this process. On first
+    use, the engine is created, connected, and all tables defined in _models.py
+    are created; afterwards, sessions draw on its connection pool.
+    :param database: name of database
+    :param backend: database backend (see get_backend)
+    :return: engine
+    """
+    return _get_engine_entry(database, backend)[0]
+
+
+def _get_engine_entry(database, backend=None):
+
+    backend = get_backend(backend)
+
+    # sqlite urls depend on the environment; don't build postgres urls, which may
+    # require asking for credentials
+    key = make_url(database, backend) if backend == 'sqlite' else (backend, database)
+
+    with _ENGINES_LOCK:
+
+        entry = _ENGINES.get(key)
+
+        if entry is not None and entry[2] != os.getpid():
+
+            # pooled connections inherited from a parent process must not be reused
+            entry[0].dispose(close=False)
+            entry = (entry[0], entry[1], os.getpid())
+            _ENGINES[key] = entry
+
+        if entry is None:
+
+            engine = make_engine(database, backend)
+            engine.connect().close()
+
+            # create all tables defined in _models.py
+            Base.metadata.create_all(engine)
+            _add_missing_columns(engine)
+            _create_missing_indexes(engine)
+
+            for table, column in _legacy_array_columns(engine):
+                logging.warning(
+                    'Column {}.{} has a legacy array type; convert it with '
+                    'db.migrate_arrays.'.format(table.name, column.name))
+
+            entry = (engine, sessionmaker(bind=engine), os.getpid())
+            _ENGINES[key] = entry
+
+    return entry
+
+
+def _add_missing_columns(engine):
+    """
+    Add columns defined in _models.py that are missing from existing tables
+    (create_all only creates columns along with new tables). Added columns are
+    NULL in existing rows; summary columns are computed by migrate.
+    """
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+
+    for table in Base.metadata.sorted_tables:
+
+        if not inspector.has_table(table.name): continue
+
+        columns = set(column['name'] for column in inspector.get_columns(table.name))
+        missing = [column for column in table.columns if column.name not in columns]
+
+        if not missing: continue
+
+        with engine.begin() as conn:
+            for column in missing:
+
+                logging.info('Adding column {}.{}.'.format(table.name, column.name))
+
+                conn.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    quote(table.name), quote(column.name),
+                    column.type.compile(dialect=engine.dialect))))
+
+
+def _create_missing_indexes(engine):
+    """
+    Create indexes defined in _models.py that are missing from existing tables
+    (create_all only creates indexes along with new tables). Indexes on columns
+    that don't exist in the database are skipped.
+    """
+    inspector = inspect(engine)
+
+    for table in Base.metadata.sorted_tables:
+
+        columns = set(column['name'] for column in inspector.get_columns(table.name))
+        indexes = set(index['name'] for index in inspector.get_indexes(table.name))
+
+        for index in table.indexes:
+
+            if index.name in indexes: continue
+
+            if all(column.name in columns for column in index.columns):
+                index.create(engine)
+            else:
+                logging.warning(
+                    'Index {} not created: table {} lacks some of its columns.'.format(
+                        index.name, table.name))
+
+
+def _legacy_array_columns(engine):
+    """
+    Return (table, column) for each NumpyArray column that is stored with another
+    type in the database, i.e., as a native array or json list, as all array
+    columns were before the NumpyArray type was introduced.
+    """
+    inspector = inspect(engine)
+    legacy = []
+
+    for table in Base.metadata.sorted_tables:
+
+        if not inspector.has_table(table.name): continue
+
+        types = {
+            column['name']: column['type'] for column in inspector.get_columns(table.name)}
+
+        for column in table.columns:
+            if isinstance(column.type, NumpyArray) and column.name in types \
+                    and not isinstance(types[column.name], LargeBinary):
+                legacy.append((table, column))
+
+    return legacy
+
+
+def migrate_arrays(engine, batch_size=1000):
+    """
+    Convert legacy array columns (see _legacy_array_columns) to the binary format
+    of NumpyArray, keeping their values. Each column is copied into a new binary
+    column that then replaces it, in one transaction per column.
+    :param engine: engine of database to migrate (e.g., from get_engine)
+    :param batch_size: number of rows converted per query
+    :return: list of (table name, column name) of converted columns
+    """
+    dialect = engine.dialect
+    quote = dialect.identifier_preparer.quote
+    converted = []
+
+    for table, column in _legacy_array_columns(engine):
+
+        logging.info('Converting column {}.{}.'.format(table.name, column.name))
+
+        name, tmp = quote(column.name), quote(column.name + '_migrated')
+        table_name = quote(table.name)
+
+        with engine.begin() as conn:
+
+            conn.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                table_name, tmp, LargeBinary().compile(dialect=dialect))))
+
+            last_id = None
+
+            while True:
+
+                query = 'SELECT id, {} FROM {}'.format(name, table_name)
+                if last_id is not None: query += ' WHERE id > :last_id'
+                query += ' ORDER BY id LIMIT :batch_size'
+
+                rows = conn.execute(
+                    text(query), {'last_id': last_id, 'batch_size': batch_size}).all()
+
+                if not rows: break
+
+                values = [{
+                    'id': id_,
+                    'value': column.type.process_bind_param(
+                        column.type.process_result_value(value, dialect), dialect),
+                } for id_, value in rows]
+
+                conn.execute(text('UPDATE {} SET {} = :value WHERE id = :id'.format(
+                    table_name, tmp)), values)
+
+                last_id = rows[-1][0]
+
+            conn.execute(text('ALTER TABLE {} DROP COLUMN {}'.format(table_name, name)))
+            conn.execute(text('ALTER TABLE {} RENAME COLUMN {} TO {}'.format(
+                table_name, tmp, name)))
+
+        converted.append((table.name, column.name))
+
+    return converted
 
-    # make and connect an engine
 
-    engine = create_engine(url)
-    engine.connect()
+def dispose_engines():
+    """
+    Close all pooled connections and forget all engines of this process.
+    """
+    with _ENGINES_LOCK:
 
-    # create all tables defined in _models.py
+        for engine, _, _ in _ENGINES.values():
+            engine.dispose()
 
-    Base.metadata.create_all(engine)
+        _ENGINES.clear()
 
-    # get a new session
 
-    session = sessionmaker(bind=engine)()
+def connect_and_make_session(database, backend=None):
+    """
+    Return a new session object for a database, using the process-wide engine for
+    that database (see get_engine).
+    :param database: name of database to connect to
+    :param backend: database backend, "postgres" or "sqlite" (default: value of the
+        NPR_DB_BACKEND environment variable, else "postgres")
+    :return: session object
+    """
+
+    return _get_engine_entry(database, backend)[1]()
 
-    return session
+
+@contextmanager
+def session_scope(database, backend=None):
+    """
+    Context manager providing a session for a database that is committed if the
+    block completes, rolled back if it raises, and closed in either case, e.g.:
+
+        with db.session_scope('nothing_but_reruns') as session:
+            session.add(row)
+
+    :param database: name of database
+    :param backend: database backend (see get_backend)
+    """
+    session = connect_and_make_session(database, backend)
+
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
 
 def check_tables_not_empty(session, *models):
@@ -104,6 +410,217 @@ def delete_record_group(session, group_field, group_name):
     session.query(group_field.class_).filter(group_field == group_name).delete()
     session.commit()
 
+    invalidate(session, group_field.class_, group_name)
+
+
+def get_param_keys(session, group_field, group_name):
+    """
+    Get the parameter keys of all records in a group, e.g., to skip parameter
+    points that have already been completed when resuming a sweep.
+    :param session: session instance
+    :param group_field: model field corresponding to group
+    :param group_name: name of group
+    :return: set of parameter keys
+    """
+
+    model = group_field.class_
+    rows = session.query(model.param_key).filter(group_field == group_name).all()
+
+    return set(row[0] for row in rows)
+
+
+def get_record(session, group_field, group_name, key):
+    """
+    Get the record of a group with a given parameter key. Use this instead of
+    filtering on float parameters with approximate ranges.
+    :param session: session instance
+    :param group_field: model field corresponding to group
+    :param group_name: name of group
+    :param key: parameter key (see shortcuts.param_key)
+    :return: record, or None if the group has no record with that key
+    """
+
+    model = group_field.class_
+
+    return session.query(model).filter(
+        group_field == group_name, model.param_key == key).first()
+
+
+def get_records(session, group_field, group_name, keys, chunk_size=500):
+    """
+    Get the records of a group with any of a set of parameter keys.
+    :param session: session instance
+    :param group_field: model field corresponding to group
+    :param group_name: name of group
+    :param keys: parameter keys (see shortcuts.param_key)
+    :param chunk_size: maximum number of keys per query
+    :return: dict mapping keys to records (keys without records are left out)
+    """
+
+    model = group_field.class_
+    keys = list(keys)
+    records = {}
+
+    for start in range(0, len(keys), chunk_size):
+
+        rows = session.query(model).filter(
+            group_field == group_name,
+            model.param_key.in_(keys[start:start + chunk_size])).all()
+
+        records.update((row.param_key, row) for row in rows)
+
+    return records
+
+
+def summarize(session, group_field, group_name, by, columns):
+    """
+    Compute the number of records, mean, and standard error of the mean of scalar
+    columns for each combination of parameter values in a group, using SQL
+    aggregates so that only the summaries are transferred, e.g.:
+
+        summarize(session, m.group, 'group', ['g_x', 'noise_std'], ['alpha'])
+
+    :param session: session instance
+    :param group_field: model field corresponding to group
+    :param group_name: name of group
+    :param by: names of columns whose values define the combinations
+    :param columns: names of columns to summarize
+    :return: dict of arrays (one element per combination, sorted by the values of
+        the by columns): one per by column, and "<column>_n", "<column>_mean", and
+        "<column>_sem" for each summarized column
+    """
+
+    model = group_field.class_
+    by_columns = [getattr(model, name) for name in by]
+
+    aggregates = []
+    for name in columns:
+        column = getattr(model, name)
+        aggregates.extend([func.count(column), func.avg(column), func.avg(column * column)])
+
+    rows = session.query(*(by_columns + aggregates)).filter(
+        group_field == group_name).group_by(*by_columns).order_by(*by_columns).all()
+
+    rows = np.array(rows, dtype=float).reshape(len(rows), len(by) + 3*len(columns))
+
+    summaries = {name: rows[:, ctr] for ctr, name in enumerate(by)}
+
+    for ctr, name in enumerate(columns):
+
+        n, mean, mean_sq = rows[:, len(by) + 3*ctr:len(by) + 3*(ctr + 1)].T
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var = np.maximum(mean_sq - mean**2, 0) * n / (n - 1)
+            sem = np.where(n > 1, np.sqrt(var / n), np.nan)
+
+        summaries['{}_n'.format(name)] = n.astype(int)
+        summaries['{}_mean'.format(name)] = mean
+        summaries['{}_sem'.format(name)] = sem
+
+    return summaries
+
+
+def _missing_summaries(model):
+    """
+    Return list of (summary column key, (column, stat)) of a model's summary
+    columns, and a filter selecting records lacking any of them (None if the
+    model has no summary columns).
+    """
+    summaries = [
+        (column.key, column.info['summary_of'])
+        for column in model.__table__.columns if 'summary_of' in column.info]
+
+    if not summaries: return summaries, None
+
+    missing = or_(*[
+        getattr(model, key).is_(None) & getattr(model, column).isnot(None)
+        for key, (column, _) in summaries])
+
+    return summaries, missing
+
+
+def check_summaries_complete(session, group_field, group_name):
+    """
+    Check that no records of a group lack summary columns (see _models.Summary),
+    as records stored before the columns were added do until migrate (or
+    update_summaries) is run.
+    :param session: session instance
+    :param group_field: model field corresponding to group
+    :param group_name: name of group
+    """
+
+    model = group_field.class_
+    summaries, missing = _missing_summaries(model)
+
+    if not summaries: return
+
+    n = session.query(model).filter(group_field == group_name, missing).count()
+
+    if n:
+        raise Exception(
+            '{} records of group "{}" of {} lack summaries; run db.migrate first.'.format(
+                n, group_name, model.__tablename__))
+
+
+def update_summaries(session, group_field, group_name=None):
+    """
+    Compute summary columns (see _models.Summary) of records that were stored
+    without them, e.g., before the columns were added, and remove the export
+    files of the updated groups.
+    :param session: session instance
+    :param group_field: model field corresponding to group
+    :param group_name: name of group (default: all groups)
+    :return: number of records updated
+    """
+
+    model = group_field.class_
+    summaries, missing = _missing_summaries(model)
+
+    if not summaries: return 0
+
+    query = session.query(model).filter(missing)
+    if group_name is not None: query = query.filter(group_field == group_name)
+
+    rows = query.all()
+
+    for row in rows:
+        for key, (column, stat) in summaries:
+            values = getattr(row, column)
+            if getattr(row, key) is None and values is not None:
+                setattr(row, key, stat(values))
+
+    groups = set(row.group for row in rows)
+
+    session.commit()
+
+    for group in groups:
+        invalidate(session, model, group)
+
+    return len(rows)
+
+
+def migrate(database, backend=None):
+    """
+    Update a database made by an earlier version of this code: convert legacy
+    array columns (see migrate_arrays) and compute the summary columns of all
+    records lacking them (see update_summaries). Missing tables, columns and
+    indexes are added whenever an engine is made (see get_engine).
+    :param database: name of database
+    :param backend: database backend (see get_backend)
+    :return: dict mapping table names to numbers of records whose summaries were
+        computed
+    """
+    migrate_arrays(get_engine(database, backend))
+
+    updated = {}
+
+    with session_scope(database, backend) as session:
+        for mapper in Base.registry.mappers:
+            model = mapper.class_
+            updated[model.__tablename__] = update_summaries(session, model.group)
+
+    return updated
+
 
 def prepare_logging(log_file):
     """
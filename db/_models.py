@@ -1,20 +1,190 @@
 from __future__ import division
-from sqlalchemy import Column
-from sqlalchemy import Integer, Float, String
-from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+import json
+import random
+import struct
+import zlib
+
+import numpy as np
+from sqlalchemy import Column, Index
+from sqlalchemy import Integer, Float, JSON, LargeBinary, String
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.dialects.postgresql import ARRAY as PG_ARRAY, JSONB as PG_JSONB
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 
+def ARRAY(item_type):
+    """
+    Array column type: native array on PostgreSQL, json list on other backends
+    (e.g., SQLite).
+    """
+    return PG_ARRAY(item_type).with_variant(JSON(), 'sqlite')
+
+
+# json column type: binary json on PostgreSQL, plain json elsewhere
+JSONB = PG_JSONB().with_variant(JSON(), 'sqlite')
+
+
+class NumpyArray(TypeDecorator):
+    """
+    Column type for n-dimensional numpy arrays, stored as raw bytes preceded by a
+    header giving dtype and shape, and optionally compressed with zlib. Values
+    can be set as arrays or (nested) lists; they are loaded as read-only arrays
+    that view the stored bytes (unless compressed).
+
+    Header layout: flags (1 byte, 1 = compressed), number of dimensions (1 byte),
+    length of dtype string (1 byte), dtype string (e.g., "<f8"), and the shape as
+    little-endian 8-byte integers.
+
+    Columns stored before this type was used hold native arrays (PostgreSQL) or
+    json lists (SQLite); their values are loaded as arrays too, until the columns
+    are converted with db.migrate_arrays.
+
+    :param dtype: dtype to convert values to (default: keep dtype of value)
+    :param compress: whether to compress the array data
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    COMPRESSED = 1
+
+    def __init__(self, dtype=None, compress=False):
+
+        super(NumpyArray, self).__init__()
+        self.dtype = dtype
+        self.compress = compress
+
+    def process_bind_param(self, value, dialect):
+
+        if value is None: return None
+
+        array = np.asarray(value, dtype=self.dtype)
+        assert array.dtype != object, 'Object arrays cannot be stored.'
+
+        dtype = array.dtype.str.encode('ascii')
+        data = array.tobytes()
+
+        flags = 0
+        if self.compress:
+            flags |= self.COMPRESSED
+            data = zlib.compress(data)
+
+        header = struct.pack('<BBB', flags, array.ndim, len(dtype)) + dtype + \
+            struct.pack('<{}q'.format(array.ndim), *array.shape)
+
+        return header + data
+
+    def result_processor(self, dialect, coltype):
+
+        # the binary result processor of some dialects (bytes(value)) would reject or
+        # garble the lists of legacy columns; bytes-like values are handled directly
+        def process(value):
+            return self.process_result_value(value, dialect)
+
+        return process
+
+    def process_result_value(self, value, dialect):
+
+        if value is None: return None
+
+        if not isinstance(value, (bytes, bytearray, memoryview)):
+
+            # value of a legacy column (see class docstring)
+            if isinstance(value, str): value = json.loads(value)
+
+            array = np.array(value, dtype=self.dtype)
+            array.flags.writeable = False
+
+            return array
+
+        flags, ndim, dtype_len = struct.unpack_from('<BBB', value)
+        dtype = bytes(value[3:3 + dtype_len]).decode('ascii')
+        shape = struct.unpack_from('<{}q'.format(ndim), value, 3 + dtype_len)
+        offset = 3 + dtype_len + 8*ndim
+
+        if flags & self.COMPRESSED:
+            value, offset = zlib.decompress(value[offset:]), 0
+
+        array = np.frombuffer(value, dtype=dtype, offset=offset).reshape(shape)
+        array.flags.writeable = False
+
+        return array
+
+    def compare_values(self, x, y):
+
+        if x is None or y is None: return x is y
+
+        return np.array_equal(np.asarray(x), np.asarray(y))
+
+
+def new_revision():
+    """
+    Random revision number for a row that is inserted or updated.
+    """
+    return random.getrandbits(31)
+
+
+def Revision():
+    """
+    Column holding a random number that is replaced whenever the row is inserted
+    or updated through SQLAlchemy, so that changes to a group of rows, including
+    updates, can be detected from the sum over the group (see export.load_group).
+    """
+    return Column(Integer, default=new_revision, onupdate=new_revision)
+
+
+def trial_mean(values):
+    """
+    Mean over trials (first axis) of an array of trial results.
+    """
+    return np.mean(np.asarray(values, dtype=float), axis=0)
+
+
+def trial_sem(values):
+    """
+    Standard error of the mean over trials (first axis) of an array of trial
+    results (nan for fewer than two trials).
+    """
+    values = np.asarray(values, dtype=float)
+
+    if len(values) < 2: return np.nan * np.zeros(values.shape[1:])
+
+    return np.std(values, axis=0, ddof=1) / np.sqrt(len(values))
+
+
+def Summary(column, stat):
+    """
+    Column holding a summary statistic of an array column of trial results, e.g.,
+    its mean over trials. Unless set explicitly, it is computed when a row is
+    inserted (also by bulk inserts), so that figures can load the summaries
+    without the trial results.
+    :param column: name of column of trial results
+    :param stat: function computing the statistic from the trial results
+    """
+    def default(context):
+        values = context.get_current_parameters().get(column)
+        return None if values is None else stat(values)
+
+    return Column(
+        NumpyArray(dtype=float), default=default, info={'summary_of': (column, stat)})
+
+
 class ConnectivityAnalysisResult(Base):
 
     __tablename__ = 'connectivity_analysis_result'
+    __table_args__ = (
+        Index('ix_connectivity_analysis_result_group_param_key', 'group', 'param_key'),
+        Index('ix_connectivity_analysis_result_group_l_q', 'group', 'l', 'q'),
+    )
 
     id = Column(Integer, primary_key=True)
 
     group = Column(String)
+    param_key = Column(String)
+    revision = Revision()
 
     n = Column(Integer)
     l = Column(Integer)
@@ -29,16 +199,26 @@ class ConnectivityAnalysisResult(Base):
     g_x = Column(Float)
     rp = Column(Float)
 
-    replay_probs = Column(ARRAY(Float))
+    replay_probs = Column(NumpyArray(dtype=float))
+    replay_prob_means = Summary('replay_probs', trial_mean)
+    replay_prob_sems = Summary('replay_probs', trial_sem)
 
 
 class SpontaneousReplayExtensionResult(Base):
 
     __tablename__ = 'spontaneous_replay_extension_result'
+    __table_args__ = (
+        Index(
+            'ix_spontaneous_replay_extension_result_group_param_key', 'group', 'param_key'),
+        Index(
+            'ix_spontaneous_replay_extension_result_group_g_x_g_w', 'group', 'g_x', 'g_w'),
+    )
 
     id = Column(Integer, primary_key=True)
 
     group = Column(String)
+    param_key = Column(String)
+    revision = Revision()
     network_size = Column(Integer)
     v_th = Column(Float)
     rp = Column(Float)
@@ -49,22 +229,32 @@ class SpontaneousReplayExtensionResult(Base):
     n_trials_attempted = Column(Integer)
     low_probability_threshold = Column(Float)
     low_probability_min_trials = Column(Integer)
+    ci_width = Column(Float)
+    confidence = Column(Float)
 
     alpha = Column(Float)
     g_x = Column(Float)
     g_w = Column(Float)
     noise_stds = Column(ARRAY(Float))
-    probed_replay_probs = Column(ARRAY(Float))
-    n_trials_completed = Column(ARRAY(Float))
+    probed_replay_probs = Column(NumpyArray(dtype=float))
+    replay_prob_lower_bounds = Column(NumpyArray(dtype=float))
+    replay_prob_upper_bounds = Column(NumpyArray(dtype=float))
+    n_trials_completed = Column(NumpyArray(dtype=int))
 
 
 class ReplayPlusStdpResult(Base):
 
     __tablename__ = 'replay_plus_stdp_result'
+    __table_args__ = (
+        Index('ix_replay_plus_stdp_result_group_param_key', 'group', 'param_key'),
+        Index('ix_replay_plus_stdp_result_group_g_x_beta_1', 'group', 'g_x', 'beta_1'),
+    )
 
     id = Column(Integer, primary_key=True)
 
     group = Column(String)
+    param_key = Column(String)
+    revision = Revision()
     network_size = Column(Integer)
     v_th = Column(Float)
     rp = Column(Float)
@@ -90,4 +280,25 @@ class ReplayPlusStdpResult(Base):
     w_measurement_time = Column(Integer)
 
     n_trials_completed = Column(Integer)
-    w_scores = Column(ARRAY(Float))
+    w_scores = Column(NumpyArray(dtype=float))
+    w_score_means = Summary('w_scores', trial_mean)
+    w_score_sems = Summary('w_scores', trial_sem)
+
+
+class ReplayPlusStdpTrial(Base):
+
+    __tablename__ = 'replay_plus_stdp_trial'
+    __table_args__ = (
+        Index(
+            'ix_replay_plus_stdp_trial_group_param_key_trial',
+            'group', 'param_key', 'trial', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    group = Column(String)
+    param_key = Column(String)
+    revision = Revision()
+    trial = Column(Integer)
+
+    w_score = Column(NumpyArray(dtype=float))
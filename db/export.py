@@ -0,0 +1,294 @@
+"""
+Columnar export of result tables.
+
+All rows of a record group are exported to one .npz file holding an array per
+column (rows ordered by id): scalar columns become 1D arrays, array columns are
+stacked along a leading row axis when all rows have the same shape, and anything
+else becomes an object array. load_group returns these columns, rewriting the
+file only when the group has changed in the database, so figure code reads a
+single file instead of querying once per plotted curve.
+
+Files are kept in a directory per database, so that groups of the same name in
+different databases (e.g., shards and the central database) don't share files.
+Object columns are stored as flat data with the shapes of their values (or as
+json), so that files are loaded without unpickling anything.
+"""
+from __future__ import division, print_function
+import hashlib
+import json
+import os
+import re
+import tempfile
+from urllib.parse import quote
+
+import numpy as np
+from sqlalchemy import func
+
+
+DEFAULT_EXPORT_DIR = os.getenv(
+    'NPR_EXPORT_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'neural_pattern_replay', 'export'))
+
+# key under which the state of the group at export time is stored in each file
+_FINGERPRINT = '__fingerprint__'
+
+# columns loaded by this process, by file path: (fingerprint, columns)
+_LOADED = {}
+
+
+def group_path(session, model, group, directory=None, columns=None):
+    """
+    Return path of the export file of a record group (or of some of its columns)
+    in the database of a session.
+    """
+    directory = DEFAULT_EXPORT_DIR if directory is None else directory
+
+    url = session.get_bind().url.render_as_string(hide_password=True)
+    database = hashlib.sha1(url.encode()).hexdigest()[:12]
+
+    name = quote(str(group), safe='')
+    if columns is not None:
+        name += '.' + hashlib.sha1(','.join(sorted(columns)).encode()).hexdigest()[:12]
+
+    return os.path.join(directory, database, model.__tablename__, '{}.npz'.format(name))
+
+
+def _fingerprint(session, model, group):
+    """
+    Return number of rows, smallest and largest id, and sum of revisions (see
+    _models.Revision) of a record group; the sum changes when a row is updated.
+    """
+    n, min_id, max_id, revisions = session.query(
+        func.count(model.id), func.min(model.id), func.max(model.id),
+        func.sum(model.revision)).filter(model.group == group).one()
+
+    return np.array([n, min_id or 0, max_id or 0, revisions or 0], dtype=np.int64)
+
+
+def _column_array(values):
+    """
+    Return array of a column's values, stacked along the first axis if possible.
+    """
+    if all(value is not None for value in values) \
+            and len(set(np.shape(value) for value in values)) <= 1:
+
+        array = np.array(values)
+        if array.dtype != object and len(array) == len(values): return array
+
+    array = np.empty(len(values), dtype=object)
+    for ctr, value in enumerate(values):
+        array[ctr] = value
+
+    return array
+
+
+def _to_list(obj):
+
+    return obj.tolist()
+
+
+def _encode_objects(name, column):
+    """
+    Return dict of arrays from which an object column can be rebuilt without
+    pickling: if its values are None or arrays of numbers (or of strings), their
+    flattened data, numbers of dimensions (-1 for None), and shapes; else their
+    json representations.
+    """
+    arrays = [None if value is None else np.asarray(value) for value in column]
+    present = [array for array in arrays if array is not None]
+    kinds = set(array.dtype.kind for array in present)
+
+    if kinds <= set('biuf') or kinds == {'U'}:
+
+        data = np.concatenate([array.ravel() for array in present]) if present \
+            else np.zeros(0)
+
+        return {
+            name + '.data': data,
+            name + '.ndims': np.array(
+                [-1 if array is None else array.ndim for array in arrays], dtype=int),
+            name + '.shapes': np.array(
+                [dim for array in present for dim in array.shape], dtype=int),
+        }
+
+    return {name + '.json': np.array(
+        [json.dumps(value, default=_to_list) for value in column], dtype=str)}
+
+
+def _decode_objects(name, f):
+    """
+    Rebuild an object column from the arrays made by _encode_objects.
+    """
+    if name + '.json' in f:
+        values = [json.loads(value) for value in f[name + '.json']]
+
+    else:
+        data, ndims, shapes = [f[name + suffix] for suffix in ('.data', '.ndims', '.shapes')]
+        values = []
+        data_ctr = shape_ctr = 0
+
+        for ndim in ndims:
+
+            if ndim < 0:
+                values.append(None)
+                continue
+
+            shape = tuple(shapes[shape_ctr:shape_ctr + ndim])
+            size = int(np.prod(shape))
+
+            value = data[data_ctr:data_ctr + size].reshape(shape)
+            values.append(value[()] if ndim == 0 else value)
+
+            shape_ctr += ndim
+            data_ctr += size
+
+    column = np.empty(len(values), dtype=object)
+    for ctr, value in enumerate(values):
+        column[ctr] = value
+
+    return column
+
+
+def read_file(path):
+    """
+    Read an export file.
+    :param path: path of file written by export_group
+    :return: (dict of column arrays, fingerprint of group at export time)
+    """
+    with np.load(path) as f:
+
+        columns = {}
+
+        for key in f.files:
+
+            name, _, suffix = key.partition('.')
+
+            if not suffix:
+                columns[name] = f[key]
+            elif name not in columns:
+                columns[name] = _decode_objects(name, f)
+
+    return columns, columns.pop(_FINGERPRINT)
+
+
+def export_group(session, model, group, path=None, columns=None):
+    """
+    Export all rows of a record group to a .npz file with one array per column.
+    :param session: database session
+    :param model: ORM model with group and id columns
+    :param group: name of record group
+    :param path: path of file to write (default: given by group_path)
+    :param columns: names of columns to export (default: all)
+    :return: dict of column arrays
+    """
+    path = group_path(session, model, group, columns=columns) if path is None else path
+
+    fingerprint = _fingerprint(session, model, group)
+
+    if columns is None:
+        columns = list(model.__table__.columns)
+    else:
+        columns = [model.__table__.columns[column] for column in columns]
+
+    rows = session.query(*columns).filter(model.group == group).order_by(model.id).all()
+
+    arrays = {
+        column.key: _column_array([row[ctr] for row in rows])
+        for ctr, column in enumerate(columns)}
+
+    stored = {_FINGERPRINT: fingerprint}
+    for name, array in arrays.items():
+        if array.dtype == object:
+            stored.update(_encode_objects(name, array))
+        else:
+            stored[name] = array
+
+    # write to a temporary file first so that readers never see a partial file
+    directory = os.path.dirname(path) or '.'
+    if not os.path.isdir(directory): os.makedirs(directory)
+
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.npz', delete=False) as f:
+        np.savez(f, **stored)
+
+    os.replace(f.name, path)
+    _LOADED[path] = (fingerprint, arrays)
+
+    return arrays
+
+
+def load_group(session, model, group, directory=None, refresh=False, columns=None):
+    """
+    Load all rows of a record group as column arrays (see export_group), from its
+    export file if the group hasn't changed since the file was written, and
+    exporting it otherwise. Changes are detected from the number of rows, the
+    range of their ids, and the sum of their revisions (see _models.Revision).
+    :param session: database session
+    :param model: ORM model with group and id columns
+    :param group: name of record group
+    :param directory: export directory (default: NPR_EXPORT_DIR environment
+        variable, else ~/.cache/neural_pattern_replay/export)
+    :param refresh: if True, export the group even if the file is up to date
+    :param columns: names of columns to load (default: all); loading only the
+        columns needed, e.g., summaries instead of trial results, keeps both the
+        query and the file small
+    :return: dict of column arrays, with rows ordered by id
+    """
+    path = group_path(session, model, group, directory, columns)
+    fingerprint = _fingerprint(session, model, group)
+
+    if not refresh:
+
+        if path in _LOADED and np.array_equal(_LOADED[path][0], fingerprint):
+            return _LOADED[path][1]
+
+        if os.path.exists(path):
+
+            arrays, file_fingerprint = read_file(path)
+
+            if np.array_equal(file_fingerprint, fingerprint):
+                _LOADED[path] = (fingerprint, arrays)
+                return arrays
+
+    return export_group(session, model, group, path, columns)
+
+
+def invalidate(session, model, group, directory=None):
+    """
+    Remove the export files of a record group in the database of a session (of
+    all its columns or some), if any.
+    """
+    directory = os.path.dirname(group_path(session, model, group, directory))
+    pattern = re.compile(re.escape(quote(str(group), safe='')) + r'(\.[0-9a-f]{12})?\.npz$')
+
+    for path in list(_LOADED):
+        if os.path.dirname(path) == directory and pattern.match(os.path.basename(path)):
+            _LOADED.pop(path)
+
+    if not os.path.isdir(directory): return
+
+    for file_name in os.listdir(directory):
+        if pattern.match(file_name): os.remove(os.path.join(directory, file_name))
+
+
+def select_rows(columns, order_by=None, rtol=0, **values):
+    """
+    Return indexes of rows of exported columns whose values match, e.g.,
+    select_rows(columns, order_by='g_w', g_x=.5, rtol=.01).
+    :param columns: dict of column arrays (as returned by load_group)
+    :param order_by: name of column by which to sort the rows
+    :param rtol: relative tolerance for matching float values
+    :param values: column values to match
+    :return: array of row indexes
+    """
+    n_rows = len(next(iter(columns.values()))) if columns else 0
+    mask = np.ones(n_rows, dtype=bool)
+
+    for key, value in values.items():
+        mask &= np.isclose(columns[key].astype(float), value, rtol=rtol, atol=0)
+
+    idxs = mask.nonzero()[0]
+
+    if order_by is not None:
+        idxs = idxs[np.argsort(columns[order_by][idxs], kind='stable')]
+
+    return idxs
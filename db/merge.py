@@ -0,0 +1,225 @@
+"""
+Merging of result shards into a central database.
+
+A sweep can be split across machines (e.g., with ParameterGrid.shard) that each
+store their results in a local SQLite database (NPR_DB_BACKEND=sqlite), or export
+them with export_group. merge_shards reads any number of such shards and inserts
+their records into the database of a session in batches, skipping records that
+are already stored there or that appear in an earlier shard. Records are
+identified by group and parameter key (plus trial number for trial tables), or,
+if they were stored without a parameter key, by the values of their columns, so
+merging the same shard twice has no effect.
+"""
+from __future__ import division, print_function
+import logging
+import os
+
+import numpy as np
+from sqlalchemy import create_engine, inspect, or_, select
+
+from db._models import Base, NumpyArray
+from db.export import invalidate, read_file
+from db.writer import ResultWriter
+from shortcuts import param_key
+
+
+# columns that don't describe a record's content
+_BOOKKEEPING_COLUMNS = ('id', 'group', 'param_key', 'revision')
+
+
+def _models_by_table():
+
+    return {mapper.class_.__tablename__: mapper.class_ for mapper in Base.registry.mappers}
+
+
+def _key_columns(model):
+    """
+    Return names of columns that identify a record within its group: those of a
+    unique index on the group, else the parameter key.
+    """
+    for index in model.__table__.indexes:
+        names = [column.name for column in index.columns]
+        if index.unique and names[0] == 'group': return names[1:]
+
+    return ['param_key']
+
+
+def _content_key(model, row):
+    """
+    Return key of a record stored without a parameter key (e.g., before keys were
+    added), computed with param_key from the values of all its columns except
+    bookkeeping and summary columns, so that only identical records are taken to
+    be duplicates.
+    """
+    values = {
+        column.name: row.get(column.name) for column in model.__table__.columns
+        if column.name not in _BOOKKEEPING_COLUMNS and 'summary_of' not in column.info}
+
+    return 'content:' + param_key(values)
+
+
+def _sqlite_shard(path, models):
+    """
+    Yield (model, rows) for each table of a SQLite shard.
+    """
+    engine = create_engine('sqlite:///{}'.format(os.path.abspath(path)))
+
+    try:
+        inspector = inspect(engine)
+
+        with engine.connect() as conn:
+            for model in models:
+
+                if not inspector.has_table(model.__tablename__): continue
+
+                existing = set(
+                    column['name'] for column in inspector.get_columns(model.__tablename__))
+                columns = [
+                    column for column in model.__table__.columns if column.name in existing]
+
+                rows = conn.execute(select(*columns)).mappings().all()
+                yield model, [dict(row) for row in rows]
+
+    finally:
+        engine.dispose()
+
+
+def _npz_shard(path, models):
+    """
+    Yield (model, rows) for a group exported by export_group (all columns), the
+    model being given by the name of the directory the file is in.
+    """
+    model = _models_by_table().get(os.path.basename(os.path.dirname(os.path.abspath(path))))
+
+    if model not in models: return
+
+    columns = {
+        key: values for key, values in read_file(path)[0].items()
+        if key in model.__table__.columns}
+
+    n_rows = len(columns['group'])
+
+    yield model, [
+        {key: values[ctr] for key, values in columns.items()} for ctr in range(n_rows)]
+
+
+def _to_column_value(column, value):
+    """
+    Convert a value read from a shard to one that can be stored in a column.
+    """
+    if isinstance(column.type, NumpyArray) or value is None:
+        return value
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def merge_shards(session, shards, models=None, groups=None, batch_size=1000):
+    """
+    Insert the records of result shards into the database of a session, skipping
+    records already stored there or in an earlier shard.
+
+    :param session: session of central database
+    :param shards: paths of shards: SQLite database files, or .npz files written
+        by export_group (with all columns, in a directory named after the table)
+    :param models: ORM models to merge (default: all)
+    :param groups: names of record groups to merge (default: all)
+    :param batch_size: number of records per insert
+    :return: dict mapping table names to dicts with numbers of records 'inserted',
+        'duplicate' (already stored), and 'unkeyed' (those of the inserted and
+        duplicate records that lack a parameter key and were identified by the
+        values of their columns)
+    """
+    models = list(_models_by_table().values()) if models is None else list(models)
+
+    counts = {
+        model.__tablename__: {'inserted': 0, 'duplicate': 0, 'unkeyed': 0}
+        for model in models}
+
+    # keys of records stored or to be stored, and groups whose stored keys are known
+    keys = {model: set() for model in models}
+    checked_groups = {model: set() for model in models}
+    inserted_groups = {model: set() for model in models}
+
+    writer = ResultWriter(session, batch_size=batch_size, flush_interval=float('inf'))
+
+    with writer:
+
+        for path in shards:
+
+            logging.info('Merging shard {}.'.format(path))
+
+            shard = _npz_shard if path.endswith('.npz') else _sqlite_shard
+
+            for model, rows in shard(path, models):
+
+                key_columns = _key_columns(model)
+                table = model.__table__
+                count = counts[model.__tablename__]
+
+                if groups is not None:
+                    rows = [row for row in rows if row['group'] in groups]
+
+                # get keys of records of new groups already in the central database
+                new_groups = set(row['group'] for row in rows) - checked_groups[model]
+
+                if new_groups:
+
+                    key_fields = [getattr(model, name) for name in key_columns]
+                    in_new_groups = model.group.in_(sorted(new_groups))
+
+                    stored = session.query(model.group, *key_fields).filter(
+                        in_new_groups).all()
+                    keys[model].update(
+                        tuple(row) for row in stored if None not in row[1:])
+
+                    unkeyed = session.execute(select(*table.columns).where(
+                        in_new_groups, or_(*[field.is_(None) for field in key_fields])))
+                    keys[model].update(
+                        (row['group'], _content_key(model, row))
+                        for row in unkeyed.mappings())
+
+                    checked_groups[model].update(new_groups)
+
+                for row in rows:
+
+                    key = tuple(
+                        _to_column_value(table.columns[name], row.get(name))
+                        for name in ['group'] + key_columns)
+
+                    if any(value is None for value in key[1:]):
+                        key = (key[0], _content_key(model, row))
+                        count['unkeyed'] += 1
+
+                    if key in keys[model]:
+                        count['duplicate'] += 1
+                        continue
+
+                    keys[model].add(key)
+
+                    # leave out ids, revisions, and unset columns with defaults (e.g.,
+                    # summaries), which are set on insert
+                    values = {
+                        name: _to_column_value(table.columns[name], value)
+                        for name, value in row.items()
+                        if not table.columns[name].primary_key and name != 'revision'
+                        and not (value is None and table.columns[name].default is not None)}
+
+                    writer.add(values, model=model)
+                    count['inserted'] += 1
+                    inserted_groups[model].add(row['group'])
+
+    # remove exports of groups that have changed
+    for model, merged in inserted_groups.items():
+        for group in merged:
+            invalidate(session, model, group)
+
+    for table_name, count in counts.items():
+        if count['unkeyed']:
+            logging.info(
+                '{} records of {} without parameter keys were identified by their '
+                'values.'.format(count['unkeyed'], table_name))
+
+    return counts
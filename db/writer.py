@@ -0,0 +1,239 @@
+"""
+Buffered writing of result rows.
+
+Committing each result row on its own costs a transaction round trip per row,
+which dominates sweeps over many cheap parameter points. A ResultWriter collects
+rows and inserts them in batches, with one multi-row insert per model and a
+single commit per batch. A BackgroundWriter does the same on a separate thread,
+so that simulations continue while results are written.
+"""
+from __future__ import division, print_function
+import queue
+import threading
+import time
+
+from sqlalchemy import insert, inspect
+from sqlalchemy.orm import Session
+
+
+def row_to_dict(row):
+    """
+    Return dict of column values of an ORM object, leaving out unset values of the
+    primary key and of columns with defaults (so that the defaults are applied).
+    """
+    values = {}
+
+    for attr in inspect(row).mapper.column_attrs:
+
+        value = getattr(row, attr.key)
+        column = attr.columns[0]
+
+        if value is None and (column.primary_key or column.default is not None): continue
+
+        values[attr.key] = value
+
+    return values
+
+
+class ResultWriter(object):
+    """
+    Buffer of result rows that are inserted into the database in batches. Rows
+    are flushed when batch_size of them are buffered, when flush_interval seconds
+    have passed since the last flush (checked when rows are added), and on close.
+    Use as a context manager (or call close) so that no buffered rows are lost;
+    rows buffered when the process dies are, so at most one batch of results
+    needs to be recomputed when resuming.
+
+    :param session: database session
+    :param batch_size: maximum number of buffered rows
+    :param flush_interval: maximum number of seconds between flushes
+    """
+
+    def __init__(self, session, batch_size=100, flush_interval=30.):
+
+        self.session = session
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.buffer = []
+        self.n_written = 0
+        self.last_flush = time.time()
+
+    def add(self, row, model=None):
+        """
+        Buffer a row.
+        :param row: ORM object, or dict of column values
+        :param model: ORM model (required if row is a dict)
+        """
+        if model is None:
+            model = type(row)
+            row = row_to_dict(row)
+        else:
+            row = dict(row)
+
+        self.buffer.append((model, row))
+
+        if len(self.buffer) >= self.batch_size \
+                or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Insert all buffered rows and commit.
+        """
+        if self.buffer:
+
+            # one executemany per model and set of columns
+            batches = {}
+            for model, row in self.buffer:
+                batches.setdefault((model, tuple(sorted(row))), []).append(row)
+
+            try:
+                for (model, _), rows in batches.items():
+                    self.session.execute(insert(model), rows)
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                raise
+
+            self.n_written += len(self.buffer)
+            self.buffer = []
+
+        self.last_flush = time.time()
+
+    def close(self):
+        """
+        Flush remaining rows.
+        """
+        self.flush()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
+
+
+class BackgroundWriter(object):
+    """
+    Result writer that inserts rows on a background thread with its own session
+    (on the same engine as session), so that simulation and database writes
+    overlap. Rows are handed to the thread through a queue holding at most
+    max_queue rows; add blocks while the queue is full. Rows are written in
+    batches as by a ResultWriter. Use as a context manager (or call close) to
+    write all remaining rows and stop the thread; an error raised while writing
+    is re-raised by the next call to add or close.
+
+    In-memory SQLite databases can't be shared between connections, so rows for
+    them are written by the calling thread, with session.
+
+    :param session: database session whose engine to use
+    :param batch_size: maximum number of buffered rows
+    :param flush_interval: maximum number of seconds between flushes
+    :param max_queue: maximum number of rows waiting to be buffered
+    """
+
+    _STOP = object()
+
+    def __init__(self, session, batch_size=100, flush_interval=30., max_queue=1000):
+
+        bind = session.get_bind()
+        in_memory = \
+            bind.dialect.name == 'sqlite' and bind.url.database in (None, '', ':memory:')
+
+        self.writer = ResultWriter(
+            session if in_memory else Session(bind=bind), batch_size=batch_size,
+            flush_interval=flush_interval)
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error = None
+
+        if in_memory:
+            self.thread = None
+            return
+
+        self.thread = threading.Thread(target=self._run, name='BackgroundWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def n_written(self):
+
+        return self.writer.n_written
+
+    def _run(self):
+
+        while True:
+
+            try:
+                item = self.queue.get(timeout=self.writer.flush_interval)
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP: break
+
+            # after an error keep emptying the queue so that add doesn't block
+            if self.error is not None: continue
+
+            try:
+                if item is None:
+                    self.writer.flush()
+                else:
+                    self.writer.add(*item)
+            except Exception as e:
+                self.error = e
+
+        try:
+            if self.error is None: self.writer.close()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.writer.session.close()
+
+    def _raise_error(self):
+
+        if self.error is not None: raise self.error
+
+    def add(self, row, model=None):
+        """
+        Hand a row to the writer thread.
+        :param row: ORM object, or dict of column values
+        :param model: ORM model (required if row is a dict)
+        """
+        self._raise_error()
+
+        if self.thread is None:
+            self.writer.add(row, model)
+            return
+
+        # rows are converted here so that no ORM objects are shared between threads
+        if model is None:
+            model = type(row)
+            row = row_to_dict(row)
+        else:
+            row = dict(row)
+
+        self.queue.put((row, model))
+
+    def close(self):
+        """
+        Write all remaining rows and stop the writer thread.
+        """
+        if self.thread is None:
+            self.writer.close()
+
+        elif self.thread.is_alive():
+            self.queue.put(self._STOP)
+            self.thread.join()
+
+        self._raise_error()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
@@ -7,7 +7,8 @@ import numpy as np
 import os
 from scipy import stats
 
-from connectivity import hexagonal_lattice
+from cache import shared_simulation_cache
+from connectivity import adlib_lif, cached, hexagonal_lattice
 from network import BasicWithAthAndTwoLevelStdp
 from network import LIFExponentialSynapsesModel
 from plot import get_n_colors, set_fontsize
@@ -115,27 +116,8 @@ def toy_network_lif(
         [0, 0, 0, 0, 0, 1, 0],
     ], dtype=float)
 
-    w_pp = W_PP * w_base
-    w_pm = W_PM * np.eye(7)
-    w_mm = W_MM * np.eye(7)
-    w_mp = W_MP * np.eye(7)
-    w_pi = W_PI * np.ones((7,))
-    w_ip = W_IP * np.ones((7,))
-
-    w_ampa = np.zeros((15, 15))
-    w_nmda = np.zeros((15, 15))
-    w_gaba = np.zeros((15, 15))
-
-    w_ampa[7:14, :7] = w_mp
-    w_ampa[-1, :7] = w_ip
-
-    w_nmda[:7, :7] = w_pp
-    w_nmda[:7, 7:14] = w_pm
-    w_nmda[7:14, 7:14] = w_mm
-
-    w_gaba[:7, -1] = w_pi
-
-    ws = {'ampa': w_ampa, 'nmda': w_nmda, 'gaba': w_gaba}
+    ws = adlib_lif(
+        w_base, w_pp=W_PP, w_mp=W_MP, w_pm=W_PM, w_mm=W_MM, w_pi=W_PI, w_ip=W_IP)
 
     # build network
     cc = np.concatenate
@@ -306,16 +288,21 @@ def replay_statistics(
         SEED,
         LS, N, N_TRIALS, N_STIM_SEQS, Q_REPLAY_PROB,
         G_W, G_X, RP, TH,
-        QS, QS_MEMORY_CONTENT, NS_MEMORY_CONTENT):
+        QS, QS_MEMORY_CONTENT, NS_MEMORY_CONTENT, MEMOIZE=False):
     """
     Show replay statistics:
         Relative capacity vs. density for ER networks.
         Optimal density vs. L.
         Replay probability vs. percent stimulus-matched transitions.
         Guaranteed replay probability and memory content vs. sparsity.
+
+    If MEMOIZE is True, simulations are stored in the process' shared cache (in
+    memory and on disk), so repeated stimuli are only simulated once across
+    networks, trials, and reruns.
     """
 
     np.random.seed(SEED)
+    cache = shared_simulation_cache() if MEMOIZE else None
 
     fig = plt.figure(figsize=(10, 4), tight_layout=True)
     axs = [fig.add_subplot(1, 3, 1)]
@@ -362,7 +349,8 @@ def replay_statistics(
 
                     # make network
                     ntwk = BasicWithAthAndTwoLevelStdp(
-                        th=TH, w=w, g_x=G_X, t_x=2 * l, rp=RP, stdp_params=None
+                        th=TH, w=w, g_x=G_X, t_x=2 * l, rp=RP, stdp_params=None,
+                        cache=cache
                     )
 
                     correct_ctr = 0
@@ -444,7 +432,7 @@ def reverse_replay_simplified(TH, G_W, G_X, T_X, RP):
     """
 
     # build weight matrix and network
-    w, nodes = hexagonal_lattice(4)
+    w, nodes = cached(hexagonal_lattice, 4)
     w *= G_W
 
     n_nodes = len(nodes)
@@ -1,18 +1,26 @@
 from __future__ import division, print_function
 from itertools import product as cproduct
 import logging
+import multiprocessing
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt; plt.style.use('ggplot')
 import numpy as np
 from scipy import stats
 
+from analysis import detect_replays
+from cache import shared_simulation_cache
 import connectivity
 from db import _models
 import db
+import metrics
+from metrics import ProgressMonitor
 import network
 import plot
-from shortcuts import make_drive_seq, zip_cproduct, reorder_idxs
-from shortcuts import get_stationary_distribution, sample_markov_chain
+from sweep import current_key, Sweep
+from shortcuts import make_drive_seq, ParameterGrid, reorder_idxs
+from shortcuts import stationary_distribution, MarkovChainSampler
+from shortcuts import run_trials_adaptively, wilson_interval
+from shortcuts import CommonNoise, param_key, point_seed
 
 
 def replay_demo_simplified_and_lif(
@@ -31,10 +39,13 @@ def replay_demo_simplified_and_lif(
         REPLAY_START, REPLAY_DUR, REPLAY_FREQ, REPLAY_AMP,
         RESET_START, RESET_DUR, RESET_AMP, RESET_FREQ,
         BKGD_GABA_AMP, BKGD_GABA_FREQ,
-        BKGD_GABA_AMP_MEM, BKGD_GABA_FREQ_MEM):
+        BKGD_GABA_AMP_MEM, BKGD_GABA_FREQ_MEM, MEMOIZE=False):
     """
     Demonstrate activation-triggered-hyperexcitability-mediated sequence
     replay in simplified and LIF network.
+
+    If MEMOIZE is True, the LIF simulation is stored in the on-disk cache, so
+    regenerating the figure with the same parameters does not rerun it.
     """
     fig = plt.figure(figsize=(15, 15), tight_layout=True)
     gs = gridspec.GridSpec(6, 3)
@@ -122,27 +133,8 @@ def replay_demo_simplified_and_lif(
         [0, 0, 0, 0, 0, 1, 0],
     ], dtype=float)
 
-    w_pp = W_PP * w_base
-    w_pm = W_PM * np.eye(7)
-    w_mm = W_MM * np.eye(7)
-    w_mp = W_MP * np.eye(7)
-    w_pi = W_PI * np.ones((7,))
-    w_ip = W_IP * np.ones((7,))
-
-    w_ampa = np.zeros((15, 15))
-    w_nmda = np.zeros((15, 15))
-    w_gaba = np.zeros((15, 15))
-
-    w_ampa[7:14, :7] = w_mp
-    w_ampa[-1, :7] = w_ip
-
-    w_nmda[:7, :7] = w_pp
-    w_nmda[:7, 7:14] = w_pm
-    w_nmda[7:14, 7:14] = w_mm
-
-    w_gaba[:7, -1] = w_pi
-
-    ws = {'ampa': w_ampa, 'nmda': w_nmda, 'gaba': w_gaba}
+    ws = connectivity.adlib_lif(
+        w_base, w_pp=W_PP, w_mp=W_MP, w_pm=W_PM, w_mm=W_MM, w_pi=W_PI, w_ip=W_IP)
 
     # build network
     cc = np.concatenate
@@ -154,7 +146,8 @@ def replay_demo_simplified_and_lif(
 
     ntwk = network.LIFExponentialSynapsesModel(
         taus_m=taus_m, v_rests=v_rests, v_ths=v_ths, v_resets=v_resets,
-        refrac_pers=refrac_pers, taus_syn=TAUS_SYN, v_revs_syn=V_REVS_SYN, ws=ws)
+        refrac_pers=refrac_pers, taus_syn=TAUS_SYN, v_revs_syn=V_REVS_SYN, ws=ws,
+        cache=shared_simulation_cache() if MEMOIZE else None)
 
     # build stimulus
     dt = DT
@@ -304,87 +297,208 @@ def replay_demo_simplified_and_lif(
     return fig
 
 
+def _connectivity_analysis_trial(args):
+    """
+    Run a single trial of the connectivity analysis (one random stimulus transition
+    matrix, tested at every match percentage) and return the replay probabilities
+    along with the trial's phase times and counts.
+    All randomness comes from the trial's own seed sequence, so results do not
+    depend on which process runs the trial or in what order. The stimulus
+    transition mask and random connectivity are built by connectivity.cached,
+    seeded from that sequence, so that rerunning the analysis loads them from disk.
+
+    If FAST_REPLAY_CHECK is True, the network's response to each stimulus is first
+    checked against the ideal one (sequence, pause, replayed sequence) directly from
+    the connectivity; only stimuli whose outcome this leaves undecided (because the
+    network deviates from the ideal response before replay starts) are simulated.
+    If MEMOIZE is True, simulations are stored in the process' shared cache (in
+    memory and on disk), so repeated stimuli are only simulated once across
+    networks, trials, worker processes, and reruns.
+    """
+    (seed_seq, l, q, V_TH, G_W, G_X, RP, N, MATCH_PERCENTS, N_STIM_SEQS,
+        FAST_REPLAY_CHECK, MEMOIZE) = args
+    stim_seq, rand_seq, rng_seq = seed_seq.spawn(3)
+    rng = np.random.default_rng(rng_seq)
+    cache = shared_simulation_cache() if MEMOIZE else None
+    metrics.TIMER.reset()
+
+    replay_probs = np.nan * np.zeros((len(MATCH_PERCENTS),))
+
+    with metrics.phase('network'):
+
+        # generate random stimulus transition matrix
+        w_stim = connectivity.cached(
+            connectivity.random_transition_mask, N, q,
+            seed=int(stim_seq.generate_state(1)[0]))
+
+        trs = w_stim.copy()
+
+        # normalize all columns to 1 to make it probabilistic
+        for col_ctr in range(N):
+            trs[:, col_ctr] /= trs[:, col_ctr].sum()
+
+        # each trial draws its own matrix, so memoizing wouldn't pay off
+        p_0 = stationary_distribution(trs, cache=False)
+        sampler = MarkovChainSampler(p_0, trs)
+
+        w_rand = connectivity.cached(
+            connectivity.random_mask, N, q, seed=int(rand_seq.generate_state(1)[0]))
+
+    # loop over match percentages
+    for mp_ctr, mp in enumerate(MATCH_PERCENTS):
+
+        with metrics.phase('network'):
+
+            w = w_rand.copy()
+            mask = rng.random(w.shape) < mp
+            w[mask] = w_stim[mask]
+            w *= G_W
+
+            # make network
+            ntwk = network.BasicWithAthAndTwoLevelStdp(
+                th=V_TH, w=w, g_x=G_X, t_x=2 * l, rp=RP, stdp_params=None,
+                cache=cache)
+
+        with metrics.phase('drives'):
+
+            seqs = sampler.sample(N_STIM_SEQS, l, rng=rng)
+
+            # drive each sequence, then its first node again as a trigger
+            drives = np.zeros((N_STIM_SEQS, 2 * l + 2, N))
+            drives[np.arange(N_STIM_SEQS)[:, None], 1 + np.arange(l), seqs] = 1
+            drives[np.arange(N_STIM_SEQS), l + 2, seqs[:, 0]] = 1
+
+        with metrics.phase('replay_check'):
+
+            if FAST_REPLAY_CHECK:
+
+                # ideal response: sequence, pause, replayed sequence
+                rs_ideal = np.zeros(drives.shape)
+                rs_ideal[:, 1:l+1] = drives[:, 1:l+1]
+                rs_ideal[:, l+2:2*l+2] = drives[:, 1:l+1]
+
+                first_inconsistent = ntwk.first_inconsistent_steps(rs_ideal, 5*drives)
+
+                # replay is correct if the network follows the ideal response
+                # throughout and incorrect if it first deviates during replay
+                correct = first_inconsistent == 2 * l + 2
+                undecided = first_inconsistent < l + 2
+
+            else:
+                correct = np.zeros((N_STIM_SEQS,), dtype=bool)
+                undecided = np.ones((N_STIM_SEQS,), dtype=bool)
+
+        r_0 = np.zeros((N,))
+        xc_0 = np.zeros((N,))
+
+        for seq_ctr in undecided.nonzero()[0]:
+
+            with metrics.phase('simulation'):
+                rs, _ = ntwk.run(r_0, xc_0, 5*drives[seq_ctr])
+
+            with metrics.phase('replay_check'):
+                correct[seq_ctr] = np.all(rs[l+2:2*l+2, :] == drives[seq_ctr, 1:l+1, :])
+
+            if ntwk.run_stats['cached']:
+                metrics.count('cached_trials')
+            else:
+                metrics.count('simulated_trials')
+                metrics.count('steps', ntwk.run_stats['n_steps'])
+
+        metrics.count('trials', N_STIM_SEQS)
+
+        replay_probs[mp_ctr] = correct.sum() / N_STIM_SEQS
+
+    return replay_probs, metrics.TIMER.as_dict()
+
+
 def record_connectivity_analysis(
         SEED, GROUP, LOG_FILE,
         V_TH, G_W, G_X, RP,
-        N, LS, QS, MATCH_PERCENTS, N_TRIALS, N_STIM_SEQS):
+        N, LS, QS, MATCH_PERCENTS, N_TRIALS, N_STIM_SEQS, N_WORKERS=1,
+        METRICS_FILE=None, FAST_REPLAY_CHECK=True, MEMOIZE=False):
     """
     Analyze the dependence of replay probability on the percent match between
     the stimulus transition matrix and network connectivity.
+
+    Each (L, Q, trial) unit gets an independent random stream spawned from SEED and
+    keyed by L, Q, and trial number, so results are identical for any N_WORKERS.
+
+    If FAST_REPLAY_CHECK is True, replay correctness is decided from the
+    connectivity wherever possible and stimuli are only simulated when it cannot
+    be (see _connectivity_analysis_trial); results are the same either way.
+    If MEMOIZE is True, simulations are memoized in each worker's shared cache,
+    whose on-disk tier is shared by all workers and reruns.
+
+    Progress, throughput, and phase times are logged periodically and, if
+    METRICS_FILE is given, appended to it as json lines.
     """
     # preliminaries
     session = db.connect_and_make_session('nothing_but_reruns')
     db.prepare_logging(LOG_FILE)
-    np.random.seed(SEED)
-
-    for l, q in cproduct(LS, QS):
-
-        logging.info('Running sim. for L = {}, Q = {}'.format(l, q))
-        replay_probs = np.nan * np.zeros((N_TRIALS, len(MATCH_PERCENTS)))
-
-        for trial_ctr in range(N_TRIALS):
-
-            logging.info('Trial {} started.'.format(trial_ctr + 1))
 
-            # generate random stimulus transition matrix
-            while True:
-                trs = (np.random.rand(N, N) < q).astype(float)
-                np.fill_diagonal(trs, 0)
-                if np.all(trs.sum(axis=0) > 0): break
-
-            w_stim = trs.copy()
-
-            # normalize all columns to 1 to make it probabilistic
-            for col_ctr in range(N):
-                trs[:, col_ctr] /= trs[:, col_ctr].sum()
-
-            p_0 = get_stationary_distribution(trs)
+    fixed_params = {
+        'seed': SEED, 'v_th': V_TH, 'g_w': G_W, 'g_x': G_X, 'rp': RP, 'n': N,
+        'match_percents': MATCH_PERCENTS, 'n_trials': N_TRIALS, 'n_stim_seqs': N_STIM_SEQS,
+    }
 
-            # loop over match percentages
-            w_rand = (np.random.rand(N, N) < q).astype(float)
+    lqs = list(cproduct(LS, QS))
+    units = [
+        (
+            np.random.SeedSequence(SEED, spawn_key=(l, int(round(q * 1e9)), trial_ctr)),
+            l, q, V_TH, G_W, G_X, RP, N, MATCH_PERCENTS, N_STIM_SEQS,
+            FAST_REPLAY_CHECK, MEMOIZE,
+        )
+        for l, q in lqs for trial_ctr in range(N_TRIALS)
+    ]
 
-            for mp_ctr, mp in enumerate(MATCH_PERCENTS):
+    if N_WORKERS > 1:
+        pool = multiprocessing.Pool(N_WORKERS)
+        results = pool.imap(_connectivity_analysis_trial, units)
+    else:
+        pool = None
+        results = (_connectivity_analysis_trial(unit) for unit in units)
 
-                w = w_rand.copy()
-                mask = np.random.rand(*w.shape) < mp
-                w[mask] = w_stim[mask]
-                w *= G_W
+    logging.info('Running {} trials on {} worker(s).'.format(len(units), N_WORKERS))
 
-                # make network
-                ntwk = network.BasicWithAthAndTwoLevelStdp(
-                    th=V_TH, w=w, g_x=G_X, t_x=2 * l, rp=RP, stdp_params=None)
+    progress = ProgressMonitor(len(units), name=GROUP, metrics_file=METRICS_FILE)
+    writer = db.BackgroundWriter(session)
 
-                correct_ctr = 0
+    try:
+        for l, q in lqs:
 
-                for _ in range(N_STIM_SEQS):
+            logging.info('Running sim. for L = {}, Q = {}'.format(l, q))
+            replay_probs = np.nan * np.zeros((N_TRIALS, len(MATCH_PERCENTS)))
 
-                    drives = np.zeros((2 * l + 2, N))
-                    seq = sample_markov_chain(p_0, trs, l)
-                    for ctr, node in enumerate(seq):
+            for trial_ctr in range(N_TRIALS):
 
-                        drives[ctr + 1, node] = 1
+                replay_probs[trial_ctr], stats = next(results)
+                progress.update(stats=stats)
+                logging.info('Trial {} completed.'.format(trial_ctr + 1))
 
-                    drives[l + 2, seq[0]] = 1
+            with progress.timer.phase('db_write'):
 
-                    r_0 = np.zeros((N,))
-                    xc_0 = np.zeros((N,))
+                car = _models.ConnectivityAnalysisResult(
+                    group=GROUP,
+                    param_key=param_key(dict(fixed_params, l=l, q=q)),
+                    n=N, l=l, q=q,
+                    match_percents=MATCH_PERCENTS,
+                    n_trials=N_TRIALS, n_stim_seqs=N_STIM_SEQS,
+                    v_th=V_TH, g_w=G_W, g_x=G_X, rp=RP,
+                    replay_probs=replay_probs)
 
-                    rs, _ = ntwk.run(r_0, xc_0, 5*drives)
+                writer.add(car)
 
-                    if np.all(rs[l+2:2*l+2, :] == drives[1:l+1, :]): correct_ctr += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
-                replay_probs[trial_ctr, mp_ctr] = correct_ctr / N_STIM_SEQS
+        with progress.timer.phase('db_write'):
+            writer.close()
 
-        car = _models.ConnectivityAnalysisResult(
-            group=GROUP,
-            n=N, l=l, q=q,
-            match_percents=MATCH_PERCENTS,
-            n_trials=N_TRIALS, n_stim_seqs=N_STIM_SEQS,
-            v_th=V_TH, g_w=G_W, g_x=G_X, rp=RP,
-            replay_probs=replay_probs.tolist())
+    progress.report()
 
-        session.add(car)
-        session.commit()
     session.close()
 
 
@@ -407,29 +521,33 @@ def capacity_and_connectivity_analysis(
 
     styles = ['-', '--', '-.']
 
+    m = _models.ConnectivityAnalysisResult
+    db.check_summaries_complete(session, m.group, GROUP)
+    cars = db.load_group(
+        session, m, GROUP,
+        columns=['l', 'q', 'match_percents', 'replay_prob_means', 'replay_prob_sems'])
+
     # plot replay probability vs. stimulus-matched connectivity percentage
     handles = []
     for q, style in zip(QS_MATCH_ANALYSIS, styles):
 
-        cars = session.query(_models.ConnectivityAnalysisResult).filter(
-            _models.ConnectivityAnalysisResult.group == GROUP,
-            _models.ConnectivityAnalysisResult.q.between(.99 * q, 1.01*q))
+        idxs_q = db.select_rows(cars, q=q, rtol=.01)
 
-        ls = sorted(np.unique([car.l for car in cars.all()]))
+        ls = sorted(np.unique(cars['l'][idxs_q]))
         colors = plot.get_n_colors(len(ls) + 1, 'hsv')[:-1]
 
         for l, color in zip(ls, colors):
 
-            car = cars.filter(_models.ConnectivityAnalysisResult.l == l).first()
-            replay_probs = np.array(car.replay_probs)
+            idx = idxs_q[cars['l'][idxs_q] == l][0]
+            match_percents = cars['match_percents'][idx]
 
-            mean = np.mean(replay_probs, axis=0)
-            sem = stats.sem(replay_probs, axis=0)
+            mean = cars['replay_prob_means'][idx]
+            sem = cars['replay_prob_sems'][idx]
             handles.append(axs[0].plot(
-                car.match_percents, mean, color=color, lw=2, ls=style,
+                match_percents, mean, color=color, lw=2, ls=style,
                 label='L = {}'.format(l), zorder=1)[0])
             axs[0].fill_between(
-                car.match_percents, mean-sem, mean+sem,
+                match_percents, mean-sem, mean+sem,
                 color=color, zorder=0, alpha=0.2)
 
             axs[0].set_xticks([0, .2, .4, .6, .8, 1])
@@ -492,7 +610,7 @@ def multiple_and_reverse_replay(
     np.random.seed(SEED)
 
     # build simplified network
-    w, nodes = connectivity.hexagonal_lattice(NETWORK_SIZE)
+    w, nodes = connectivity.cached(connectivity.hexagonal_lattice, NETWORK_SIZE)
     nodes, idxs = reorder_idxs(nodes, NODE_ORDER_MULTIPLE)
     w = w[idxs, :][:, idxs]
     ntwk = network.LocalWtaWithAthAndStdp(
@@ -549,7 +667,7 @@ def multiple_and_reverse_replay(
         plot.set_fontsize(ax, 14)
 
     # reverse replay
-    w, nodes = connectivity.hexagonal_lattice(NETWORK_SIZE)
+    w, nodes = connectivity.cached(connectivity.hexagonal_lattice, NETWORK_SIZE)
     nodes, idxs = reorder_idxs(nodes, NODE_ORDER_REVERSE)
     w = w[idxs, :][:, idxs]
     ntwk = network.LocalWtaWithAthAndStdp(
@@ -603,22 +721,57 @@ def record_extension_by_spontaneous_replay(
         NETWORK_SIZE, V_TH, RP, T_X,
         NODE_SEQ, DRIVE_AMP, PROBE_TIME,
         ALPHA, G_XS, G_WS, NOISE_STDS,
-        N_TRIALS, LOW_PROB_THRESHOLD, LOW_PROB_MIN_TRIALS,):
+        N_TRIALS, LOW_PROB_THRESHOLD, LOW_PROB_MIN_TRIALS,
+        CI_WIDTH=None, CONFIDENCE=0.95, BLOCK_SIZE=10, RESUME=False,
+        COMMON_NOISE=False, METRICS_FILE=None):
     """
     Perform a parameter sweep over varying influences of the hyperexcitability
     and the connection weight term and save the results to the database.
+
+    Each (g_x, g_w) point is stored with a key derived from all of its parameters
+    and is seeded from SEED and that key. If RESUME is True, existing records in
+    the group are kept and points whose key is already present are skipped, so an
+    interrupted or extended sweep only computes missing points; otherwise the group
+    is deleted first.
+
+    If CI_WIDTH is given, trials for each noise level are run in blocks of
+    BLOCK_SIZE until the Wilson confidence interval on the replay probability is
+    narrower than CI_WIDTH or lies below LOW_PROB_THRESHOLD (after at least
+    LOW_PROB_MIN_TRIALS trials), with at most N_TRIALS trials per noise level.
+
+    If COMMON_NOISE is True, the same N_TRIALS standardized noise realizations
+    (each generated from its own stream spawned from SEED) are scaled by each
+    noise level and reused for every parameter point, so that differences between
+    points are estimated with less trial-to-trial variance.
+
+    Progress, throughput, and phase times are logged periodically and, if
+    METRICS_FILE is given, appended to it as json lines.
     """
 
     # preliminaries
-    np.random.seed(SEED)
     session = db.connect_and_make_session('nothing_but_reruns')
     m = _models.SpontaneousReplayExtensionResult
-    db.delete_record_group(session, m.group, GROUP_NAME)
+
+    if RESUME:
+        completed = db.get_param_keys(session, m.group, GROUP_NAME)
+    else:
+        db.delete_record_group(session, m.group, GROUP_NAME)
+        completed = set()
 
     db.prepare_logging(LOG_FILE)
 
+    fixed_params = {
+        'seed': SEED, 'network_size': NETWORK_SIZE, 'v_th': V_TH, 'rp': RP, 't_x': T_X,
+        'sequence': NODE_SEQ, 'drive_amplitude': DRIVE_AMP, 'probe_time': PROBE_TIME,
+        'alpha': ALPHA, 'n_trials': N_TRIALS,
+        'low_probability_threshold': LOW_PROB_THRESHOLD,
+        'low_probability_min_trials': LOW_PROB_MIN_TRIALS,
+        'ci_width': CI_WIDTH, 'confidence': CONFIDENCE, 'block_size': BLOCK_SIZE,
+        'common_noise': COMMON_NOISE,
+    }
+
     # make weight matrix
-    w_base, nodes = connectivity.hexagonal_lattice(NETWORK_SIZE)
+    w_base, nodes = connectivity.cached(connectivity.hexagonal_lattice, NETWORK_SIZE)
 
     # make pre-noise drives
     l = len(NODE_SEQ)
@@ -629,14 +782,20 @@ def record_extension_by_spontaneous_replay(
 
     drives_base[PROBE_TIME + 1, nodes.index(NODE_SEQ[0])] = DRIVE_AMP
 
-    node_seq_logical = (drives_base[1:1+l] > 0).astype(int)
+    node_seq_idxs = [nodes.index(node) for node in NODE_SEQ]
+
+    if COMMON_NOISE:
+        common_noise = CommonNoise(SEED, N_TRIALS, drives_base.shape)
+    else:
+        common_noise = None
 
     r_0 = np.zeros((len(nodes),))
     xc_0 = np.zeros((len(nodes),))
 
-    for g_x in G_XS:
+    # find parameter points that remain to be run
+    points = []
 
-        logging.info('Starting sweep set with g_x = {0:.3f}.'.format(g_x))
+    for g_x in G_XS:
 
         # the max noise we'll consider is one in which there is a
         # 20% chance that a hyperexcitable node activates spontaneously
@@ -650,17 +809,38 @@ def record_extension_by_spontaneous_replay(
         g_ws = [g_w for g_w in G_WS if V_TH-g_x <= g_w < V_TH]
         for g_w in g_ws:
 
+            key = param_key(dict(fixed_params, g_x=g_x, g_w=g_w, noise_stds=noise_stds))
+
+            if key in completed:
+                logging.info(
+                    'Skipping completed sweep with g_x = {0:.3f}, g_w = {1:.3f}.'.format(
+                        g_x, g_w))
+                continue
+
+            points.append((g_x, g_w, noise_stds, key))
+
+    progress = ProgressMonitor(len(points), name=GROUP_NAME, metrics_file=METRICS_FILE)
+    writer = db.BackgroundWriter(session)
+
+    try:
+        for g_x, g_w, noise_stds, key in points:
+
+            metrics.TIMER.reset()
+            np.random.seed(point_seed(SEED, key))
+
             logging.info(
                 'Starting sweep with g_x = {0:.3f}, g_w = {1:.3f}.'.format(g_x, g_w))
             logging.info('Sweeping over {} noise levels...'.format(len(noise_stds)))
 
-            ntwk = network.LocalWtaWithAthAndStdp(
-                th=V_TH, w=g_w*w_base, g_x=g_x, t_x=T_X, rp=RP,
-                stdp_params=None, wta_dist=2, wta_factor=ALPHA)
+            with metrics.phase('network'):
+                ntwk = network.LocalWtaWithAthAndStdp(
+                    th=V_TH, w=g_w*w_base, g_x=g_x, t_x=T_X, rp=RP,
+                    stdp_params=None, wta_dist=2, wta_factor=ALPHA)
 
             # set up our data structure
             sper = _models.SpontaneousReplayExtensionResult(
                 group=GROUP_NAME,
+                param_key=key,
                 network_size=NETWORK_SIZE,
                 v_th=V_TH, rp=RP, t_x=T_X,
                 sequence=NODE_SEQ,
@@ -670,51 +850,104 @@ def record_extension_by_spontaneous_replay(
                 low_probability_threshold=LOW_PROB_THRESHOLD,
                 low_probability_min_trials=LOW_PROB_MIN_TRIALS,
 
+                ci_width=CI_WIDTH,
+                confidence=CONFIDENCE,
+
                 alpha=ALPHA,
                 g_x=g_x,
                 g_w=g_w,
                 noise_stds=noise_stds,
                 probed_replay_probs=[],
+                replay_prob_lower_bounds=[],
+                replay_prob_upper_bounds=[],
                 n_trials_completed=[])
 
             for ns_ctr, noise_std in enumerate(noise_stds):
 
-                broken = False
+                trials_run = [0]
 
-                replay_successes = []
-                for tr_ctr in range(N_TRIALS):
+                def run_block(n_trials):
 
-                    # make noisy drives and run network
-                    drives = drives_base + noise_std * \
-                        np.random.randn(*drives_base.shape)
-                    rs = ntwk.run(r_0, xc_0, drives)[0].astype(int)
+                    # make noisy drives for all trials in block at once
+                    with metrics.phase('drives'):
 
-                    # compare initial and probed replay sequence to true sequence
-                    rs_initial = rs[1:1+l]
-                    rs_replay = rs[PROBE_TIME+1:PROBE_TIME+1+l]
-                    initial_match = np.all(rs_initial == node_seq_logical)
-                    replay_match = np.all(rs_replay == node_seq_logical)
+                        if common_noise is None:
+                            noise = noise_std * np.random.randn(
+                                n_trials, *drives_base.shape)
+                        else:
+                            start = trials_run[0]
+                            noise = noise_std * common_noise[start:start + n_trials]
 
-                    replay_successes.append(initial_match and replay_match)
+                        drives_block = drives_base + noise
 
-                    # skip remaining trials if estimated probability is small
-                    if tr_ctr + 1 >= LOW_PROB_MIN_TRIALS:
-                        if np.mean(replay_successes) < LOW_PROB_THRESHOLD:
-                            broken = True
-                            break
+                    trials_run[0] += n_trials
+                    rs_block = []
 
-                replay_prob = np.mean(replay_successes) if not broken else -1
-                sper.probed_replay_probs.append(replay_prob)
+                    for drives in drives_block:
+
+                        with metrics.phase('simulation'):
+                            rs_block.append(ntwk.run(r_0, xc_0, drives)[0])
+
+                        metrics.count('trials')
+                        metrics.count('steps', ntwk.run_stats['n_steps'])
+
+                    # check that sequence is played initially and replayed after probe
+                    with metrics.phase('replay_check'):
+                        onsets = detect_replays(
+                            rs_block, node_seq_idxs, directions=('forward',)
+                        )['forward']['matches'][:, 0]
+
+                    return list(onsets[:, 1] & onsets[:, PROBE_TIME + 1])
+
+                if CI_WIDTH is None:
+
+                    broken = False
+
+                    replay_successes = []
+                    for tr_ctr in range(N_TRIALS):
+
+                        replay_successes.extend(run_block(1))
+
+                        # skip remaining trials if estimated probability is small
+                        if tr_ctr + 1 >= LOW_PROB_MIN_TRIALS:
+                            if np.mean(replay_successes) < LOW_PROB_THRESHOLD:
+                                broken = True
+                                break
+
+                    replay_prob = np.mean(replay_successes) if not broken else -1
+                    n_trials = tr_ctr + 1
+                    lower, upper = wilson_interval(
+                        np.sum(replay_successes), n_trials, CONFIDENCE)
 
-                sper.n_trials_completed.append(tr_ctr + 1)
+                else:
+
+                    replay_prob, n_trials, lower, upper = run_trials_adaptively(
+                        run_block, block_size=BLOCK_SIZE, max_trials=N_TRIALS,
+                        ci_width=CI_WIDTH, low_threshold=LOW_PROB_THRESHOLD,
+                        confidence=CONFIDENCE, min_trials=LOW_PROB_MIN_TRIALS)
+
+                    if upper < LOW_PROB_THRESHOLD: replay_prob = -1
+
+                sper.probed_replay_probs.append(replay_prob)
+                sper.replay_prob_lower_bounds.append(lower)
+                sper.replay_prob_upper_bounds.append(upper)
+                sper.n_trials_completed.append(n_trials)
 
                 if (ns_ctr + 1) % 5 == 0:
                     logging.info('{} noise levels completed.'.format(ns_ctr + 1))
 
-            session.add(sper)
-            session.commit()
+            with metrics.phase('db_write'):
+                writer.add(sper)
+
+            progress.update(stats=metrics.TIMER.as_dict())
+
+    finally:
+        with progress.timer.phase('db_write'):
+            writer.close()
+
+    logging.info('All sweeps completed.')
+    progress.report()
 
-        logging.info('All sweeps completed.')
     session.close()
 
 
@@ -737,23 +970,20 @@ def extension_by_spontaneous_replay(
 
     # plot statistics
 
-    max_prob = np.max([
-        np.max(srer.probed_replay_probs)
-        for srer in session.query(m).filter(m.group == GROUP_NAME).all()
-    ])
+    srers = db.load_group(session, m, GROUP_NAME)
+
+    max_prob = np.max([np.max(probs) for probs in srers['probed_replay_probs']])
 
     for ctr, g_x in enumerate(G_XS):
 
-        srers = session.query(m).filter(
-            m.group == GROUP_NAME,
-            m.g_x.between(0.999*g_x, 1.001*g_x)).order_by(m.g_w).all()
+        idxs = db.select_rows(srers, order_by='g_w', g_x=g_x, rtol=.001)
 
         axs.append(fig.add_subplot(gs[-1, ctr]))
 
-        results = np.array([srer.probed_replay_probs for srer in srers]).T
+        results = np.array([srers['probed_replay_probs'][idx] for idx in idxs]).T
 
-        g_ws = [srer.g_w for srer in srers]
-        noise_stds = srers[0].noise_stds
+        g_ws = srers['g_w'][idxs]
+        noise_stds = srers['noise_stds'][idxs[0]]
         d_gw = g_ws[1] - g_ws[0]
         d_noise_std = noise_stds[1] - noise_stds[0]
         extent = [
@@ -794,7 +1024,7 @@ def extension_by_spontaneous_replay(
     alpha = srer.alpha
 
     # run examples
-    w_base, nodes = connectivity.hexagonal_lattice(d)
+    w_base, nodes = connectivity.cached(connectivity.hexagonal_lattice, d)
 
     r_0 = np.zeros((len(nodes),))
     xc_0 = np.zeros((len(nodes),))
@@ -856,6 +1086,136 @@ def extension_by_spontaneous_replay(
     return fig
 
 
+def _replay_plus_stdp_point(params, context):
+    """
+    Run all trials of the replay plus stdp simulation for a single parameter point
+    and return the final weight scores (distances to forward and bidirectional
+    target weights) of each trial.
+
+    Each trial's weight scores are stored in the trial table as soon as the trial
+    completes, and trials already stored for the point (e.g., by an interrupted
+    run) are not rerun. Each trial is seeded separately (from seeds drawn once
+    per point), so results do not depend on where a run was interrupted.
+    """
+    alpha, beta_0, beta_1 = params['ALPHAS'], params['BETA_0S'], params['BETA_1S']
+    t_x, g_x, w_0, w_1 = params['T_XS'], params['G_XS'], params['W_0S'], params['W_1S']
+    noise_std, trigger_interval = params['NOISE_STDS'], params['TRIGGER_INTERVALS']
+
+    c = context
+    nodes = c['nodes']
+    w_base = c['w_base']
+
+    logging.info('Running {} trials for parameters: {}'.format(
+        c['n_trials'], {
+            'alpha': alpha, 'beta_0': beta_0, 'beta_1': beta_1,
+            't_x': t_x, 'g_x': g_x, 'w_0': w_0, 'w_1': w_1,
+            'noise_std': noise_std, 'trigger_interval': trigger_interval
+        }))
+
+    # make initial weight matrix
+    w = w_0 * w_base
+    w[c['mask_w_strong']] = w_1
+
+    # make target weight matrices
+    w_targ_for = w_0 * w_base
+    w_targ_bi = w_0 * w_base
+    w_targ_for[c['mask_w_targ_for']] = w_1
+    w_targ_bi[c['mask_w_targ_bi']] = w_1
+
+    # make measurement function
+    def measure_w(w_):
+        dist_for = np.mean((w_ - w_targ_for) ** 2)
+        dist_bi = np.mean((w_ - w_targ_bi) ** 2)
+        return [dist_for, dist_bi]
+
+    # set stdp params
+    stdp_params = {
+        'w_0': w_0, 'w_1': w_1, 'beta_0': beta_0, 'beta_1': beta_1
+    }
+
+    # make network
+    with metrics.phase('network'):
+        ntwk = network.LocalWtaWithAthAndStdp(
+            th=c['v_th'], w=w, g_x=g_x, t_x=t_x, rp=c['rp'],
+            stdp_params=stdp_params, wta_dist=2, wta_factor=alpha)
+
+    # add triggers to base drives
+    drives = c['drives_base'].copy()
+
+    if trigger_interval:
+        trigger_times = np.arange(
+            1, 1 + c['w_measurement_time'], trigger_interval)[1:]
+
+        for ctr, trigger_time in enumerate(trigger_times):
+            if trigger_time in c['interruption_epoch']: continue
+
+            node = c['trigger_seq'][ctr % len(c['trigger_seq'])]
+            node_idx = nodes.index(node)
+            drives[trigger_time, node_idx] = c['drive_amp']
+
+    r_0 = np.zeros((len(nodes),))
+    xc_0 = np.zeros((len(nodes),))
+
+    trial_seeds = np.random.randint(2**31, size=c['n_trials'])
+
+    m = _models.ReplayPlusStdpTrial
+    key = current_key()
+
+    with db.session_scope(c['database']) as session:
+
+        completed = set(
+            row[0] for row in session.query(m.trial).filter(
+                m.group == c['group'], m.param_key == key).all())
+
+        if completed:
+            logging.info('Resuming after {} stored trials.'.format(len(completed)))
+
+        # loop over trials
+        writer = db.ResultWriter(session, batch_size=10, flush_interval=10.)
+
+        try:
+            for tr_ctr in range(c['n_trials']):
+
+                if tr_ctr in completed: continue
+
+                np.random.seed(trial_seeds[tr_ctr])
+
+                # add noise
+                with metrics.phase('drives'):
+                    if c['common_noise'] is None:
+                        drives_ = drives + (noise_std * np.random.randn(*drives.shape))
+                    else:
+                        drives_ = drives + (noise_std * c['common_noise'][tr_ctr])
+
+                # run network
+                with metrics.phase('simulation'):
+                    rs, _, w_measurements = ntwk.run(
+                        r_0, xc_0, drives_, measure_w=measure_w)
+
+                with metrics.phase('db_write'):
+                    writer.add(m(
+                        group=c['group'], param_key=key, trial=tr_ctr,
+                        w_score=w_measurements[-1]))
+
+                metrics.count('trials')
+                metrics.count('steps', ntwk.run_stats['n_steps'])
+
+                if (tr_ctr + 1) % 25 == 0:
+                    logging.info('{} trials completed.'.format(tr_ctr + 1))
+
+        finally:
+            # store the trials completed so far, even if one failed
+            with metrics.phase('db_write'):
+                writer.close()
+
+        # the point's results are all of its stored trials
+        w_scores = [
+            row[0] for row in session.query(m.w_score).filter(
+                m.group == c['group'], m.param_key == key).order_by(m.trial).all()]
+
+    return np.array(w_scores)
+
+
 def record_replay_plus_stdp(
         SEED, GROUP, LOG_FILE,
         NETWORK_SIZE, V_TH, RP,
@@ -864,18 +1224,45 @@ def record_replay_plus_stdp(
         T_XS, G_XS, W_0S, W_1S, NOISE_STDS,
         TRIGGER_INTERVALS, ZIP, CPRODUCT,
         TRIGGER_SEQ, INTERRUPTION_SEQ, INTERRUPTION_TIME,
-        N_TRIALS, W_MEASUREMENT_TIME):
+        N_TRIALS, W_MEASUREMENT_TIME, RESUME=False, N_WORKERS=1, MAX_RETRIES=0,
+        COMMON_NOISE=False, METRICS_FILE=None):
     """
     Record results of replay plus stdp.
+
+    Each parameter point is stored with a key derived from all of its parameters
+    and is seeded from SEED and that key. If RESUME is True, existing records in
+    the group are kept and points whose key is already present are skipped;
+    otherwise the group is deleted first. Points are run on N_WORKERS processes.
+
+    Trials are stored in the trial table (ReplayPlusStdpTrial) as they complete,
+    and each point's record is made from its stored trials once all have been run;
+    with RESUME, a point that was interrupted continues from its stored trials.
+
+    If COMMON_NOISE is True, the same N_TRIALS standardized noise realizations
+    (each generated from its own stream spawned from SEED, when its trial is run)
+    are scaled by each point's noise level and reused for every parameter point.
+
+    Progress, throughput, and phase times are logged periodically and, if
+    METRICS_FILE is given, appended to it as json lines.
     """
     # preliminaries
     session = db.connect_and_make_session('nothing_but_reruns')
-    db.delete_record_group(session, _models.ReplayPlusStdpResult.group, GROUP)
     db.prepare_logging(LOG_FILE)
-    np.random.seed(SEED)
+
+    if not RESUME:
+        db.delete_record_group(session, _models.ReplayPlusStdpTrial.group, GROUP)
+
+    fixed_params = {
+        'seed': SEED, 'network_size': NETWORK_SIZE, 'v_th': V_TH, 'rp': RP,
+        'sequences_strong': SEQS_STRONG, 'sequence_novel': SEQ_NOVEL,
+        'drive_amplitude': DRIVE_AMP, 'trigger_sequence': TRIGGER_SEQ,
+        'interruption_time': INTERRUPTION_TIME, 'interruption_sequence': INTERRUPTION_SEQ,
+        'n_trials': N_TRIALS, 'w_measurement_time': W_MEASUREMENT_TIME,
+        'common_noise': COMMON_NOISE,
+    }
 
     # make base weight matrix
-    w_base, nodes = connectivity.hexagonal_lattice(NETWORK_SIZE)
+    w_base, nodes = connectivity.cached(connectivity.hexagonal_lattice, NETWORK_SIZE)
 
     # make mask for strong connections
     mask_w_strong = np.zeros(w_base.shape, dtype=bool)
@@ -909,77 +1296,27 @@ def record_replay_plus_stdp(
             drives_base[t, node_idx] = DRIVE_AMP
             interruption_epoch.append(t)
 
-    r_0 = np.zeros((len(nodes),))
-    xc_0 = np.zeros((len(nodes),))
+    context = {
+        'nodes': nodes, 'w_base': w_base, 'mask_w_strong': mask_w_strong,
+        'mask_w_targ_for': mask_w_targ_for, 'mask_w_targ_bi': mask_w_targ_bi,
+        'drives_base': drives_base, 'interruption_epoch': interruption_epoch,
+        'v_th': V_TH, 'rp': RP, 'drive_amp': DRIVE_AMP, 'trigger_seq': TRIGGER_SEQ,
+        'w_measurement_time': W_MEASUREMENT_TIME, 'n_trials': N_TRIALS,
+        'common_noise':
+            CommonNoise(SEED, N_TRIALS, drives_base.shape) if COMMON_NOISE else None,
+        'database': 'nothing_but_reruns', 'group': GROUP,
+    }
 
     # loop over desired param combinations
     order = [
         'ALPHAS', 'BETA_0S', 'BETA_1S', 'T_XS', 'G_XS', 'W_0S', 'W_1S',
         'NOISE_STDS', 'TRIGGER_INTERVALS'
     ]
-    parameters = zip_cproduct(ZIP, CPRODUCT, order=order, kwargs=locals())
-
-    logging.info(
-        'Beginning loop over {} parameter combinations.'.format(len(parameters)))
-
-    for alpha, beta_0, beta_1, t_x, g_x, w_0, w_1, noise_std, trigger_interval \
-            in parameters:
-
-        # make sure variables have been assigned correctly
-        assert alpha in ALPHAS and beta_0 in BETA_0S and beta_1 in BETA_1S
-        assert t_x in T_XS and g_x in G_XS and w_0 in W_0S and w_1 in W_1S
-        assert noise_std in NOISE_STDS and trigger_interval in TRIGGER_INTERVALS
-
-        logging.info('Running {} trials for parameters: {}'.format(
-            N_TRIALS, {
-                'alpha': alpha, 'beta_0': beta_0, 'beta_1': beta_1,
-                't_x': t_x, 'g_x': g_x, 'w_0': w_0, 'w_1': w_1,
-                'noise_std': noise_std, 'trigger_interval': trigger_interval
-            }))
-
-        # make initial weight matrix
-        w = w_0 * w_base
-        w[mask_w_strong] = w_1
-
-        # make target weight matrices
-        w_targ_for = w_0 * w_base
-        w_targ_bi = w_0 * w_base
-        w_targ_for[mask_w_targ_for] = w_1
-        w_targ_bi[mask_w_targ_bi] = w_1
-
-        # make measurement function
-        def measure_w(w_):
-            dist_for = np.mean((w_ - w_targ_for) ** 2)
-            dist_bi = np.mean((w_ - w_targ_bi) ** 2)
-            return [dist_for, dist_bi]
-
-        # set stdp params
-        stdp_params = {
-            'w_0': w_0, 'w_1': w_1, 'beta_0': beta_0, 'beta_1': beta_1
-        }
-
-        # make network
-        ntwk = network.LocalWtaWithAthAndStdp(
-            th=V_TH, w=w, g_x=g_x, t_x=t_x, rp=RP,
-            stdp_params=stdp_params, wta_dist=2, wta_factor=alpha)
-
-        # add triggers to base drives
-        drives = drives_base.copy()
-
-        if trigger_interval:
-            trigger_times = np.arange(
-                1, 1 + W_MEASUREMENT_TIME, trigger_interval)[1:]
-
-            for ctr, trigger_time in enumerate(trigger_times):
-                if trigger_time in interruption_epoch: continue
+    parameters = ParameterGrid(ZIP, CPRODUCT, order=order, kwargs=locals())
 
-                node = TRIGGER_SEQ[ctr % len(TRIGGER_SEQ)]
-                node_idx = nodes.index(node)
-                drives[trigger_time, node_idx] = DRIVE_AMP
+    def make_row(params, w_scores):
 
-        # create data structure
-        rpsr = _models.ReplayPlusStdpResult(
-            group=GROUP,
+        return _models.ReplayPlusStdpResult(
             network_size=NETWORK_SIZE,
             v_th=V_TH,
             rp=RP,
@@ -987,43 +1324,35 @@ def record_replay_plus_stdp(
             sequence_novel=SEQ_NOVEL,
             drive_amplitude=DRIVE_AMP,
 
-            alpha=alpha,
-            t_x=t_x,
-            g_x=g_x,
-            w_0=w_0,
-            w_1=w_1,
-            noise_std=noise_std,
-            beta_0=beta_0,
-            beta_1=beta_1,
+            alpha=params['ALPHAS'],
+            t_x=params['T_XS'],
+            g_x=params['G_XS'],
+            w_0=params['W_0S'],
+            w_1=params['W_1S'],
+            noise_std=params['NOISE_STDS'],
+            beta_0=params['BETA_0S'],
+            beta_1=params['BETA_1S'],
 
-            trigger_interval=trigger_interval,
+            trigger_interval=params['TRIGGER_INTERVALS'],
             trigger_sequence=TRIGGER_SEQ,
             interruption_time=INTERRUPTION_TIME,
             interruption_sequence=INTERRUPTION_SEQ,
 
             w_measurement_time=W_MEASUREMENT_TIME,
 
-            n_trials_completed=0,
-            w_scores=[])
+            n_trials_completed=len(w_scores),
+            w_scores=w_scores)
 
-        # loop over trials
-        for tr_ctr in range(N_TRIALS):
-
-            # add noise
-            drives_ = drives + (noise_std * np.random.randn(*drives.shape))
-
-            # run network
-            rs, _, w_measurements = ntwk.run(
-                r_0, xc_0, drives_, measure_w=measure_w)
+    failed = Sweep(
+        grid=parameters, simulate=_replay_plus_stdp_point, make_row=make_row,
+        model=_models.ReplayPlusStdpResult, group=GROUP, seed=SEED,
+        context=context, fixed_params=fixed_params,
+        n_workers=N_WORKERS, max_retries=MAX_RETRIES,
+        metrics_file=METRICS_FILE).run(session, resume=RESUME)
 
-            rpsr.w_scores.append(w_measurements[-1])
-            rpsr.n_trials_completed += 1
+    if failed:
+        logging.warning('{} parameter points failed: {}'.format(len(failed), failed))
 
-            if (tr_ctr + 1) % 25 == 0:
-                logging.info('{} trials completed.'.format(tr_ctr + 1))
-
-        session.add(rpsr)
-        session.commit()
     session.close()
 
 
@@ -1036,7 +1365,7 @@ def _replay_plus_stdp_example(
     Run a single simulation and plot the results on a set of three axes.
     """
     # make base weight matrix
-    w_base, nodes = connectivity.hexagonal_lattice(network_size)
+    w_base, nodes = connectivity.cached(connectivity.hexagonal_lattice, network_size)
     nodes, idxs = reorder_idxs(nodes, node_order)
     w_base = w_base[idxs, :][:, idxs]
 
@@ -1193,20 +1522,18 @@ def replay_plus_stdp_periodic_stim(
     ax_legend = fig.add_subplot(gs[-1, -2:])
     hs = []  # legend handles
 
+    m = _models.ReplayPlusStdpResult
+    db.check_summaries_complete(session, m.group, GROUP)
+    rpsrs = db.load_group(
+        session, m, GROUP, columns=['g_x', 'beta_1', 'trigger_interval', 'w_score_means'])
+
     # loop over g_x's
     for g_x, ls in zip(G_XS_STATS, ['-', '--']):
         # get all results for this g_x
-        rpsrs_all = session.query(_models.ReplayPlusStdpResult).filter(
-            _models.ReplayPlusStdpResult.group == GROUP,
-            _models.ReplayPlusStdpResult.g_x.between(.99*g_x, 1.01*g_x))
+        idxs_g_x = db.select_rows(rpsrs, g_x=g_x, rtol=.01)
 
         # get all beta_1's that were tested
-        beta_1s = session.query(_models.ReplayPlusStdpResult.beta_1).filter(
-            _models.ReplayPlusStdpResult.group == GROUP,
-            _models.ReplayPlusStdpResult.g_x.between(.99*g_x, 1.01*g_x)
-        ).order_by(_models.ReplayPlusStdpResult.beta_1).distinct().all()
-
-        beta_1s = [i[0] for i in beta_1s]
+        beta_1s = list(np.unique(rpsrs['beta_1'][idxs_g_x]))
         print(beta_1s)
         # get colors for forward and reverse weights
         cs_f = plot.get_n_colors(2 * len(beta_1s), 'hsv')[len(beta_1s):]
@@ -1215,17 +1542,12 @@ def replay_plus_stdp_periodic_stim(
         for beta_1, c_f in zip(beta_1s, cs_f):
 
             # get all results with this beta_1
-            rpsrs = rpsrs_all.filter(
-                _models.ReplayPlusStdpResult.beta_1.between(.99*beta_1, 1.01*beta_1)
-            ).order_by(
-                _models.ReplayPlusStdpResult.trigger_interval).all()
-
-            # get trigger intervals and final measured weights
-            tis = [rpsr.trigger_interval for rpsr in rpsrs]
-            ws = [np.array(rpsr.w_scores) for rpsr in rpsrs]
+            idxs = db.select_rows(
+                rpsrs, order_by='trigger_interval', g_x=g_x, beta_1=beta_1, rtol=.01)
 
-            w_scores = [w[:, 0] for w in ws]
-            means = [w_score.mean() for w_score in w_scores]
+            # get trigger intervals and mean final measured weights
+            tis = rpsrs['trigger_interval'][idxs]
+            means = [rpsrs['w_score_means'][idx][0] for idx in idxs]
             hs.append(ax.plot(
                 tis, means, color=c_f, lw=2,
                 label='beta = {0:.2f} (for)'.format(beta_1))[0])
@@ -1276,23 +1598,21 @@ def replay_plus_stdp_spontaneous(
     ax = fig.add_subplot(gs[:, -2:])
     hs = []  # legend handles
 
+    m = _models.ReplayPlusStdpResult
+    db.check_summaries_complete(session, m.group, GROUP)
+    rpsrs = db.load_group(session, m, GROUP, columns=['g_x', 'noise_std', 'w_score_means'])
+
     for g_x, ls in zip(G_XS_STATS, ['-', '--']):
-        rpsrs = session.query(_models.ReplayPlusStdpResult).filter(
-            _models.ReplayPlusStdpResult.group == GROUP,
-            _models.ReplayPlusStdpResult.g_x.between(.99*g_x, 1.01*g_x)).order_by(
-            _models.ReplayPlusStdpResult.noise_std).all()
+        idxs = db.select_rows(rpsrs, order_by='noise_std', g_x=g_x, rtol=.01)
 
-        noise_stds = [rpsr.noise_std for rpsr in rpsrs]
-        ws = [np.array(rpsr.w_scores) for rpsr in rpsrs]
+        noise_stds = rpsrs['noise_std'][idxs]
 
         for fr_label, c in zip(['for', 'bi'], ['r', 'c']):
 
             if fr_label == 'for':
-                w_scores = [w[:, 0] for w in ws]
+                means = [rpsrs['w_score_means'][idx][0] for idx in idxs]
             elif fr_label == 'bi':
-                w_scores = [w[:, 1] for w in ws]
-
-            means = [w_score.mean() for w_score in w_scores]
+                means = [rpsrs['w_score_means'][idx][1] for idx in idxs]
 
             h = ax.plot(
                 noise_stds, means, lw=2, color=c, ls=ls,
@@ -1343,29 +1663,22 @@ def replay_plus_stdp_interrupted(NETWORK_SIZE, V_TH, RP,
     hs = []  # legend handles
 
     # get all results for this group
-    rpsrs_all = session.query(_models.ReplayPlusStdpResult).filter(
-        _models.ReplayPlusStdpResult.group == GROUP,
-        _models.ReplayPlusStdpResult.g_x.between(.99*G_X, 1.01*G_X))
+    m = _models.ReplayPlusStdpResult
+    db.check_summaries_complete(session, m.group, GROUP)
+    rpsrs = db.load_group(
+        session, m, GROUP, columns=['g_x', 'beta_1', 'alpha', 'w_score_means'])
 
     # get all beta_1s
-    beta_1s = session.query(_models.ReplayPlusStdpResult.beta_1).filter(
-        _models.ReplayPlusStdpResult.group == GROUP,
-        _models.ReplayPlusStdpResult.g_x.between(.99*G_X, 1.01*G_X)).order_by(
-        _models.ReplayPlusStdpResult.beta_1).distinct().all()
-    beta_1s = [i[0] for i in beta_1s]
+    beta_1s = list(np.unique(rpsrs['beta_1'][db.select_rows(rpsrs, g_x=G_X, rtol=.01)]))
 
     colors = plot.get_n_colors(2*len(beta_1s), 'hsv')[len(beta_1s):]
 
     # loop over beta_1 and plot mean w vs. alpha for each
     for beta_1, c in zip(beta_1s, colors):
-        rpsrs = rpsrs_all.filter(
-            _models.ReplayPlusStdpResult.beta_1.between(.99*beta_1, 1.01*beta_1)
-        ).order_by(_models.ReplayPlusStdpResult.alpha).all()
-
-        alphas = [rpsr.alpha for rpsr in rpsrs]
-        ws = [np.array(rpsr.w_scores) for rpsr in rpsrs]
+        idxs = db.select_rows(rpsrs, order_by='alpha', g_x=G_X, beta_1=beta_1, rtol=.01)
 
-        w_scores = [w[:, 0].mean() for w in ws]
+        alphas = rpsrs['alpha'][idxs]
+        w_scores = [rpsrs['w_score_means'][idx][0] for idx in idxs]
 
         h = ax.plot(
             alphas, w_scores, color=c, lw=2,
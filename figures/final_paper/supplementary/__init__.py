@@ -34,34 +34,15 @@ def reverse_replay_lif_demo(
     np.random.seed(SEED)
 
     # build weight matrices
-    w_base, nodes = connectivity.hexagonal_lattice(NETWORK_SIZE_LIF)
+    w_base, nodes = connectivity.cached(connectivity.hexagonal_lattice, NETWORK_SIZE_LIF)
     # reorder nodes for nicer graphical presentation
     nodes, idxs = reorder_idxs(nodes, NODE_ORDER)
     w_base = w_base[idxs, :][:, idxs]
 
     n = len(nodes)
 
-    w_pp = W_PP * w_base
-    w_pm = W_PM * np.eye(n)
-    w_mm = W_MM * np.eye(n)
-    w_mp = W_MP * np.eye(n)
-    w_pi = W_PI * np.ones((n,))
-    w_ip = W_IP * np.ones((n,))
-
-    w_ampa = np.zeros((2*n+1, 2*n+1))
-    w_nmda = np.zeros((2*n+1, 2*n+1))
-    w_gaba = np.zeros((2*n+1, 2*n+1))
-
-    w_ampa[n:2*n, :n] = w_mp
-    w_ampa[-1, :n] = w_ip
-
-    w_nmda[:n, :n] = w_pp
-    w_nmda[:n, n:2*n] = w_pm
-    w_nmda[n:2*n, n:2*n] = w_mm
-
-    w_gaba[:n, -1] = w_pi
-
-    ws = {'ampa': w_ampa, 'nmda': w_nmda, 'gaba': w_gaba}
+    ws = connectivity.adlib_lif(
+        w_base, w_pp=W_PP, w_mp=W_MP, w_pm=W_PM, w_mm=W_MM, w_pi=W_PI, w_ip=W_IP)
 
     # build network
     cc = np.concatenate
@@ -0,0 +1,180 @@
+"""
+Instrumentation for long-running sweeps.
+
+Work is timed in named phases (e.g., network construction, drive generation,
+simulation, replay check, database write) and counted in trials and simulation
+steps. A ProgressMonitor periodically logs throughput and an estimated time to
+completion, and appends the same numbers as a json line to a metrics file so that
+runs can be compared after the fact.
+"""
+from __future__ import division, print_function
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+import json
+import logging
+import time
+
+
+class PhaseTimer(object):
+    """
+    Accumulator of wall time spent in named phases and of counts of work done.
+    """
+
+    def __init__(self):
+
+        self.times = OrderedDict()
+        self.counts = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager that adds the time spent inside it to a phase.
+        """
+        start = time.time()
+
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def add_time(self, name, seconds):
+
+        self.times[name] = self.times.get(name, 0) + seconds
+
+    def count(self, name, n=1):
+
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def merge(self, stats):
+        """
+        Add times and counts of another timer (as returned by its as_dict method).
+        """
+        for name, seconds in stats['times'].items():
+            self.add_time(name, seconds)
+
+        for name, n in stats['counts'].items():
+            self.count(name, n)
+
+    def as_dict(self):
+
+        return {'times': dict(self.times), 'counts': dict(self.counts)}
+
+    def reset(self):
+
+        self.times.clear()
+        self.counts.clear()
+
+
+# timer used by simulation code, one per process; code that runs work units
+# resets it before each unit and collects it afterwards
+TIMER = PhaseTimer()
+
+
+def phase(name):
+    """
+    Time a block of code as a phase of the process-wide timer.
+    """
+    return TIMER.phase(name)
+
+
+def count(name, n=1):
+    """
+    Add to a count of the process-wide timer.
+    """
+    TIMER.count(name, n)
+
+
+class ProgressMonitor(object):
+    """
+    Tracks completion of a fixed number of work units, reporting progress,
+    throughput, per-phase times, and ETA to the log and (optionally) to a metrics
+    file at most once every interval seconds. Call report once more when all work
+    (including writing results) is done.
+
+    Throughputs are per second of wall time; phase times are summed over all
+    workers, so with several workers they can exceed the elapsed time.
+
+    :param total: number of work units (e.g., parameter points or trials)
+    :param name: name used in reports
+    :param metrics_file: path of file to append a json line to at every report
+    :param interval: minimum number of seconds between reports
+    """
+
+    def __init__(self, total, name='sweep', metrics_file=None, interval=60.):
+
+        self.total = total
+        self.name = name
+        self.metrics_file = metrics_file
+        self.interval = interval
+
+        self.completed = 0
+        self.timer = PhaseTimer()
+
+        self.start = time.time()
+        self.last_report = self.start
+
+    def update(self, n=1, stats=None):
+        """
+        Mark work units as completed.
+        :param n: number of units completed
+        :param stats: times and counts of the completed units (as returned by
+            PhaseTimer.as_dict)
+        """
+        self.completed += n
+        if stats is not None: self.timer.merge(stats)
+
+        now = time.time()
+
+        if now - self.last_report >= self.interval: self.report(now)
+
+    def summary(self, now=None):
+        """
+        Return dict of progress and throughput metrics.
+        """
+        now = time.time() if now is None else now
+        elapsed = now - self.start
+
+        rate = self.completed / elapsed if elapsed > 0 else 0.
+        eta = (self.total - self.completed) / rate if rate > 0 else None
+
+        summary = OrderedDict([
+            ('name', self.name),
+            ('time', now),
+            ('elapsed', elapsed),
+            ('completed', self.completed),
+            ('total', self.total),
+            ('units_per_sec', rate),
+            ('eta', eta),
+        ])
+
+        for name, n in self.timer.counts.items():
+            summary['{}_per_sec'.format(name)] = n / elapsed if elapsed > 0 else 0.
+
+        summary['counts'] = dict(self.timer.counts)
+        summary['phase_times'] = dict(self.timer.times)
+
+        return summary
+
+    def report(self, now=None):
+        """
+        Log a progress summary and append it to the metrics file.
+        """
+        summary = self.summary(now)
+
+        rates = ', '.join(
+            '{:.1f} {}/s'.format(summary['{}_per_sec'.format(name)], name)
+            for name in ['units'] + list(self.timer.counts))
+        eta = 'unknown' if summary['eta'] is None else \
+            str(timedelta(seconds=int(round(summary['eta']))))
+        phases = ', '.join(
+            '{} {:.1f}s'.format(name, seconds) for name, seconds in self.timer.times.items())
+
+        logging.info('{}: {} of {} completed ({}); ETA {}; phase times: {}.'.format(
+            self.name, self.completed, self.total, rates, eta, phases or 'none'))
+
+        if self.metrics_file is not None:
+            with open(self.metrics_file, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
+
+        self.last_report = summary['time']
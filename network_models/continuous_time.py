@@ -1,7 +1,10 @@
 from __future__ import division, print_function
 from copy import copy
+import time
 import numpy as np
 
+from cache import make_key
+
 
 def sigmoid(x):
 
@@ -76,7 +79,12 @@ class LIFExponentialSynapsesModel(object):
     :param v_reset: reset potential
     :param refrac_per: refractory period or list of refractory periods for individual cells
 
-    :param ws: dict of weight matrices for different synapse types
+    :param ws: dict of weight matrices for different synapse types (dense arrays or
+        scipy sparse matrices, e.g., as built by connectivity.adlib_lif); weights
+        and drives are never modified, so they may be read-only views
+
+    :param cache: cache.SimulationCache in which to memoize the outputs of runs, or
+        None (parameters must not be modified after construction if given)
     """
 
     @staticmethod
@@ -137,7 +145,7 @@ class LIFExponentialSynapsesModel(object):
 
     def __init__(
             self, v_rests, taus_m, taus_syn, v_revs_syn,
-            v_ths, v_resets, refrac_pers, ws):
+            v_ths, v_resets, refrac_pers, ws, cache=None):
 
         self.v_rests = v_rests
         self.taus_m = taus_m
@@ -149,18 +157,33 @@ class LIFExponentialSynapsesModel(object):
 
         self.ws = ws
 
-        # extract some basic metadata
-        self.n_cells = len(self.ws.values()[0])
+        # extract some basic metadata (weights may be dense arrays or scipy sparse matrices)
+        self.n_cells = list(self.ws.values())[0].shape[0]
         self.syns = self.taus_syn.keys()
 
         # allow refractory period to be specified for individual cells or not
         self.refrac_pers = np.array(refrac_pers)
 
         self.v_mins = np.array([
-            np.min([v_rest, v_reset, np.min(v_revs_syn.values())])
+            np.min([v_rest, v_reset, np.min(list(v_revs_syn.values()))])
             for v_rest, v_reset in zip(v_rests, v_resets)
         ])
 
+        self.cache = cache
+        self._params_key = None
+
+    def cache_key(self, *inputs):
+        """
+        Return key identifying a run of this network with the given inputs.
+        """
+        # weights can be large, so hash parameters only once
+        if self._params_key is None:
+            self._params_key = make_key(
+                type(self).__name__, self.v_rests, self.taus_m, self.taus_syn,
+                self.v_revs_syn, self.v_ths, self.v_resets, self.refrac_pers, self.ws)
+
+        return make_key(self._params_key, *inputs)
+
     def run(self, initial_conditions, drives, dt, record=('spikes')):
         """
         Run a simulation
@@ -172,7 +195,38 @@ class LIFExponentialSynapsesModel(object):
         :param record: tuple of variables to record, options are:
             spikes, voltages, refrac_ctrs, conductances
         :return: dictionary of measured variables at each time step
+
+        After running, self.run_stats holds the number of time steps simulated, the
+        wall time taken, and whether the outputs were taken from the cache.
+
+        If the network has a cache, outputs are memoized and repeated runs with the
+        same inputs return the stored outputs.
         """
+        start_time = time.time()
+
+        key = None
+
+        if self.cache is not None:
+
+            key = self.cache_key(initial_conditions, drives, dt, record)
+            cached = self.cache.get(key)
+
+            if cached is not None:
+
+                # unflatten conductances stored as "conductances.<syn>"
+                measurements = {}
+                for name, array in cached.items():
+                    if '.' in name:
+                        variable, syn = name.split('.', 1)
+                        measurements.setdefault(variable, {})[syn] = array
+                    else:
+                        measurements[name] = array
+
+                self.run_stats = {
+                    'n_steps': len(measurements['time']) - 1,
+                    'wall_time': time.time() - start_time, 'cached': True}
+
+                return measurements
 
         n_steps = np.max([drive.shape[0] for drive in drives.values()])
 
@@ -233,4 +287,19 @@ class LIFExponentialSynapsesModel(object):
 
         measurements['time'] = np.arange(n_steps + 1) * dt
 
+        if key is not None:
+
+            arrays = {}
+            for name, value in measurements.items():
+                if isinstance(value, dict):
+                    for syn, array in value.items():
+                        arrays['{}.{}'.format(name, syn)] = array
+                else:
+                    arrays[name] = value
+
+            self.cache.put(key, arrays)
+
+        self.run_stats = {
+            'n_steps': n_steps, 'wall_time': time.time() - start_time, 'cached': False}
+
         return measurements
\ No newline at end of file
@@ -2,8 +2,12 @@ from __future__ import division, print_function
 from copy import copy
 from itertools import combinations
 from itertools import product as cproduct
+import time
 import networkx as nx
 import numpy as np
+from scipy import sparse
+
+from cache import make_key
 
 
 def _calculate_softmax_probability(inputs):
@@ -22,10 +26,11 @@ class BasicWithAthAndTwoLevelStdp(object):
     Most basic model with activation-triggered lingering hyperexcitability.
     """
 
-    def __init__(self, th, w, g_x, t_x, rp, stdp_params):
+    def __init__(self, th, w, g_x, t_x, rp, stdp_params, cache=None):
         """
         :param th: input threshold above which node activates
-        :param w: weight matrix
+        :param w: weight matrix (dense array, or scipy sparse matrix if stdp_params is None);
+            it is never modified, so it may be a read-only view
         :param g_x: hyperexcitability level
         :param t_x: hyperexcitability timescale
         :param rp: refractory period
@@ -34,6 +39,8 @@ class BasicWithAthAndTwoLevelStdp(object):
             :param 'w_1': strong synaptic strength
             :param 'beta_0': learning rate towards w_0
             :param 'beta_1': learning rate towards w_1
+        :param cache: cache.SimulationCache in which to memoize the outputs of runs,
+            or None (parameters must not be modified after construction if given)
         """
 
         self.th = th
@@ -45,11 +52,35 @@ class BasicWithAthAndTwoLevelStdp(object):
 
         self.n_nodes = w.shape[0]
 
+        assert stdp_params is None or not sparse.issparse(w), \
+            'STDP requires a dense weight matrix'
+
         self.w_0 = 0 if stdp_params is None else stdp_params['w_0']
         self.w_1 = 0 if stdp_params is None else stdp_params['w_1']
         self.beta_0 = 0 if stdp_params is None else stdp_params['beta_0']
         self.beta_1 = 0 if stdp_params is None else stdp_params['beta_1']
 
+        self.cache = cache
+        self._params_key = None
+        self._rng_used = False
+
+    def model_params(self):
+        """
+        Return list of all parameters that determine the network's dynamics.
+        """
+        return [
+            type(self).__name__, self.th, self.w, self.g_x, self.t_x, self.rp,
+            self.w_0, self.w_1, self.beta_0, self.beta_1]
+
+    def cache_key(self, *inputs):
+        """
+        Return key identifying a run of this network with the given inputs.
+        """
+        # weights can be large, so hash parameters only once
+        if self._params_key is None: self._params_key = make_key(*self.model_params())
+
+        return make_key(self._params_key, *inputs)
+
     def update_weights(self, w, r_prev, r):
         """
         Update a weight matrix according to the STDP learning rate.
@@ -87,7 +118,32 @@ class BasicWithAthAndTwoLevelStdp(object):
         :param drives: stimuli for all nodes
         :param measure_w: function that takes in weight matrix as a single argument
             and outputs a quantity that will be stored in a list of measurements
+
+        After running, self.run_stats holds the number of time steps simulated, the
+        wall time taken, and whether the outputs were taken from the cache.
+
+        If the network has a cache and no measure_w is given, outputs of runs that
+        did not involve random draws are memoized, and repeated runs with the same
+        inputs return the stored outputs.
         """
+        start_time = time.time()
+
+        key = None
+
+        if self.cache is not None and measure_w is None:
+
+            key = self.cache_key(r_0, xc_0, drives)
+            cached = self.cache.get(key)
+
+            if cached is not None:
+
+                self.run_stats = {
+                    'n_steps': len(drives), 'wall_time': time.time() - start_time,
+                    'cached': True}
+
+                return cached['rs'], cached['xcs']
+
+        self._rng_used = False
 
         rs = np.nan * np.zeros((self.n_nodes, len(drives)))
         xcs = np.nan * np.zeros((self.n_nodes, len(drives)))
@@ -97,7 +153,9 @@ class BasicWithAthAndTwoLevelStdp(object):
         xc = xc_0.copy()
         rpc = np.zeros((self.n_nodes,))
 
-        w = self.w.copy()
+        # weights only change (in a copy) under STDP, so that networks can be run
+        # over read-only weights, e.g., in shared memory
+        w = self.w if self.beta_0 == self.beta_1 == 0 else self.w.copy()
         w_measurements = []
 
         for t, drive in enumerate(drives):
@@ -136,17 +194,85 @@ class BasicWithAthAndTwoLevelStdp(object):
             if measure_w is not None:
                 w_measurements.append(measure_w(w))
 
+        if key is not None and not self._rng_used:
+            self.cache.put(key, {'rs': rs.T, 'xcs': xcs.T})
+
+        self.run_stats = {
+            'n_steps': len(drives), 'wall_time': time.time() - start_time, 'cached': False}
+
         if measure_w is None:
             return rs.T, xcs.T
         else:
             return rs.T, xcs.T, w_measurements
 
+    def first_inconsistent_steps(self, rs, drives, xc_0=None):
+        """
+        Check, without running the network, whether hypothesized activation
+        trajectories are the ones the network produces in response to a set of
+        drives (starting from r_0 = rs[:, 0] and no refractoriness).
+
+        Given a trajectory, every node's hyperexcitability and refractory state at
+        each time step is determined by when it was last active, so the activations
+        the network would produce at all time steps can be computed at once and
+        compared to the hypothesized ones. Since the network is deterministic, a
+        trajectory consistent at every step is the network's actual trajectory;
+        otherwise the actual trajectory agrees with the hypothesized one up to, but
+        not including, the first inconsistent step.
+
+        Only valid for fixed weights (no STDP).
+
+        :param rs: hypothesized activations (n_trajectories x n_steps x n_nodes)
+        :param drives: stimuli for all nodes (n_trajectories x n_steps x n_nodes)
+        :param xc_0: initial hyperexcitability states (for all or for each trajectory)
+        :return: index of first inconsistent step of each trajectory (n_steps if
+            trajectory is consistent at all steps)
+        """
+
+        assert self.beta_0 == self.beta_1 == 0, 'trajectory checks require fixed weights'
+
+        rs = np.asarray(rs, dtype=float)
+        drives = np.asarray(drives, dtype=float)
+        n_trajs, n_steps, n_nodes = rs.shape
+
+        # number of activations of each node before each time step
+        n_prev = np.concatenate(
+            [np.zeros((n_trajs, 1, n_nodes)), np.cumsum(rs, axis=1)], axis=1)
+        ts = np.arange(1, n_steps)
+
+        def active_within(n_steps_back):
+            # whether each node was active in the n_steps_back steps before each step
+            starts = np.maximum(ts - int(np.ceil(n_steps_back)), 0)
+            return (n_prev[:, ts] - n_prev[:, starts]) > 0
+
+        x = active_within(self.t_x)
+
+        if xc_0 is not None:
+            # initial hyperexcitabilities are overwritten if node is initially active
+            xc_0 = np.broadcast_to(xc_0, (n_trajs, n_nodes))
+            x |= (xc_0[:, None, :] > ts[None, :, None]) & (rs[:, :1] == 0)
+
+        refractory = active_within(self.rp)
+
+        # calculate inputs (few nodes are active at once, so treat activations as
+        # sparse) and compare them to threshold
+        inputs = sparse.csr_matrix(rs[:, :-1].reshape(-1, n_nodes)).dot(self.w.T)
+        if sparse.issparse(inputs): inputs = inputs.toarray()
+        inputs = np.asarray(inputs).reshape(n_trajs, n_steps - 1, n_nodes)
+
+        v = inputs + drives[:, 1:] + self.g_x*x
+        r = (v > self.th) & ~refractory
+
+        inconsistent = np.any(r != (rs[:, 1:] > 0), axis=2)
+
+        return np.where(inconsistent.any(axis=1), inconsistent.argmax(axis=1) + 1, n_steps)
+
 
 class LocalWtaWithAthAndStdp(BasicWithAthAndTwoLevelStdp):
 
-    def __init__(self, th, w, g_x, t_x, rp, stdp_params, wta_dist, wta_factor):
+    def __init__(
+            self, th, w, g_x, t_x, rp, stdp_params, wta_dist, wta_factor, cache=None):
 
-        super(self.__class__, self).__init__(th, w, g_x, t_x, rp, stdp_params)
+        super(self.__class__, self).__init__(th, w, g_x, t_x, rp, stdp_params, cache)
 
         self.wta_dist = wta_dist
         self.wta_factor = wta_factor
@@ -155,7 +281,10 @@ class LocalWtaWithAthAndStdp(BasicWithAthAndTwoLevelStdp):
         # use networkx to get shortest path length dict
         # and fill in shortest paths in the node distances matrix
 
-        g = nx.Graph((self.w + self.w.T > 0).astype(int))
+        adjacency = (self.w + self.w.T > 0).astype(int)
+        if sparse.issparse(adjacency): adjacency = adjacency.toarray()
+
+        g = nx.Graph(adjacency)
 
         for node_0, spls in nx.shortest_path_length(g).items():
             for node_1, spl in spls.items():
@@ -163,6 +292,11 @@ class LocalWtaWithAthAndStdp(BasicWithAthAndTwoLevelStdp):
                 self.node_distances[node_0, node_1] = spl
                 self.node_distances[node_1, node_0] = spl
 
+    def model_params(self):
+
+        return super(LocalWtaWithAthAndStdp, self).model_params() + [
+            self.wta_dist, self.wta_factor]
+
     def adjust_for_local_wta(self, v, r):
         """
         Ensure that no two nodes are active if they are <= self.wta_distance from
@@ -192,6 +326,8 @@ class LocalWtaWithAthAndStdp(BasicWithAthAndTwoLevelStdp):
         # of their potentially active neighbors until there are no more invalid pairs
         while invalid_pairs:
 
+            self._rng_used = True
+
             # loop through list of all unique nodes
             input_sums = np.nan * np.zeros((len(active),))
 
@@ -221,3 +357,12 @@ class LocalWtaWithAthAndStdp(BasicWithAthAndTwoLevelStdp):
         r_adjusted[active] = 1
 
         return r_adjusted
+
+    def first_inconsistent_steps(self, rs, drives, xc_0=None):
+        """
+        Stochastic WTA corrections make the network's trajectory random, so no
+        hypothesized trajectory can be confirmed without running the network: each
+        is reported inconsistent from its first step (0), leaving its outcome
+        undecided so that callers fall back to simulating it.
+        """
+        return np.zeros((len(rs),), dtype=int)
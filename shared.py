@@ -0,0 +1,99 @@
+"""
+Numpy arrays in shared memory, for handing large read-only inputs (weight
+matrices, masks, drives) to worker processes without pickling or copying them.
+
+The parent process places arrays in shared memory with SharedArrays and passes its
+(small, picklable) handles to the workers, which map them with attach. Attached
+arrays are read-only; code that needs to modify one (e.g., STDP updating weights)
+must work on a copy.
+"""
+from __future__ import division, print_function
+from multiprocessing import shared_memory
+import numpy as np
+
+
+# shared memory blocks attached by this process, kept open for as long as the
+# arrays that view them may be in use
+_ATTACHED = {}
+
+
+class SharedArrays(object):
+    """
+    Copies of a dict of numpy arrays placed in shared memory. Use as a context
+    manager (or call close) to release the memory once workers are done.
+
+    :param arrays: dict of numpy arrays (object arrays cannot be shared)
+    """
+
+    def __init__(self, arrays):
+
+        self.blocks = {}
+        self.handles = {}
+
+        try:
+            for name, array in arrays.items():
+
+                array = np.ascontiguousarray(array)
+                assert array.dtype != object, 'Object arrays cannot be shared.'
+
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+
+                self.blocks[name] = block
+                self.handles[name] = (block.name, array.shape, array.dtype.str)
+
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Release shared memory (arrays attached to it must no longer be used).
+        """
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+
+        self.blocks = {}
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
+
+
+def attach(handles):
+    """
+    Map arrays placed in shared memory by another process.
+    :param handles: handles attribute of a SharedArrays object
+    :return: dict of read-only arrays
+    """
+    arrays = {}
+
+    for name, (block_name, shape, dtype) in handles.items():
+
+        if block_name not in _ATTACHED:
+            _ATTACHED[block_name] = shared_memory.SharedMemory(name=block_name)
+
+        array = np.ndarray(shape, dtype=dtype, buffer=_ATTACHED[block_name].buf)
+        array.flags.writeable = False
+
+        arrays[name] = array
+
+    return arrays
+
+
+def split_arrays(context):
+    """
+    Split a dict into the numpy arrays that can be shared and everything else.
+    :return: (dict of shareable arrays, dict of other items)
+    """
+    arrays = {
+        key: value for key, value in context.items()
+        if isinstance(value, np.ndarray) and value.dtype != object}
+    others = {key: value for key, value in context.items() if key not in arrays}
+
+    return arrays, others
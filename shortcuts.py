@@ -1,6 +1,12 @@
 from __future__ import division, print_function
+from collections import OrderedDict
 from itertools import product as cproduct
+import warnings
 import numpy as np
+from scipy import sparse, stats
+from scipy.sparse import linalg as sparse_linalg
+
+from cache import make_key
 
 
 def make_drive_seq(seq, nodes, start, shape):
@@ -38,18 +44,169 @@ def reorder_idxs(original, first):
     return reordered, idxs_reordered
 
 
-def zip_cproduct(z, c, order, kwargs):
-    zipped = zip(*[kwargs[k] for k in z])
-    temp_0 = list(cproduct(*([zipped] + list([kwargs[k] for k in c]))))
-    temp_1 = [ii[0] + ii[1:] for ii in temp_0]
+def _canonical(value):
+    """
+    Convert a parameter value into a canonical form for hashing, so that e.g.
+    numpy and python scalars, lists and tuples, and floats differing only by
+    rounding error map to the same key.
+    """
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    elif isinstance(value, np.generic):
+        value = value.item()
+
+    if isinstance(value, bool) or value is None:
+        return value
+    elif isinstance(value, (int, float)):
+        return float('{:.12g}'.format(value))
+    elif isinstance(value, (list, tuple)):
+        return [_canonical(element) for element in value]
+    elif isinstance(value, dict):
+        return sorted((k, _canonical(v)) for k, v in value.items())
+    return value
+
+
+def param_key(params):
+    """
+    Return a stable hex key identifying a set of parameter values.
+    :param params: dict mapping parameter names to values
+    :return: hex digest
+    """
+    return make_key(_canonical(params))
+
+
+def point_seed(seed, key):
+    """
+    Derive a 32-bit random seed for a parameter point from a base seed and the
+    point's key, so that each point's random stream does not depend on which
+    other points have been run before it.
+    :param seed: base seed
+    :param key: hex key of parameter point (e.g., from param_key)
+    :return: integer seed
+    """
+    return int(np.random.SeedSequence([seed, int(key[:16], 16)]).generate_state(1)[0])
+
+
+class ParameterGrid(object):
+    """
+    Lazy grid of parameter combinations in which some parameters are zipped together
+    and the zipped tuples are combined with the cartesian product of the others.
+    Points are never materialized: the grid has a known length, supports random
+    access by index, can be split deterministically into shards, and gives each
+    point an ID that depends only on its parameter values.
+
+    :param z: names of parameters to zip together
+    :param c: names of parameters to take the cartesian product over
+    :param order: order in which parameters should appear in each point
+    :param kwargs: dict mapping parameter names to lists of values
+    """
 
-    current_order = z + c
-    temp_2 = [
-        tuple([ii[current_order.index(jj)] for jj in order])
-        for ii in temp_1
-        ]
+    def __init__(self, z, c, order, kwargs):
 
-    return temp_2
+        self.z = list(z)
+        self.c = list(c)
+        self.order = list(order)
+        self.values = {k: list(kwargs[k]) for k in self.z + self.c}
+
+        n_zipped = min(len(self.values[k]) for k in self.z) if self.z else 1
+        self.shape = [n_zipped] + [len(self.values[k]) for k in self.c]
+
+        current_order = self.z + self.c
+        self._positions = [current_order.index(k) for k in self.order]
+
+    def __len__(self):
+
+        return int(np.prod(self.shape))
+
+    def __getitem__(self, idx):
+
+        if idx < 0: idx += len(self)
+        if not 0 <= idx < len(self): raise IndexError('grid index out of range')
+
+        # convert flat index to one index per grid dimension (last dimension fastest)
+        multi_idx = []
+        for size in reversed(self.shape):
+            multi_idx.append(idx % size)
+            idx //= size
+        multi_idx = multi_idx[::-1]
+
+        point = [self.values[k][multi_idx[0]] for k in self.z]
+        point += [self.values[k][i] for k, i in zip(self.c, multi_idx[1:])]
+
+        return tuple(point[position] for position in self._positions)
+
+    def __iter__(self):
+
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def params(self, idx):
+        """
+        Return dict mapping parameter names to values for a grid point.
+        """
+        return dict(zip(self.order, self[idx]))
+
+    def point_id(self, idx):
+        """
+        Return ID of a grid point that depends only on its parameter values (and
+        not on its index, so it is stable when other values are added to the grid).
+        """
+        return param_key(self.params(idx))
+
+    def shard(self, i, n):
+        """
+        Return the i-th of n disjoint shards that together cover the grid.
+        """
+        return ParameterGridShard(self, i, n)
+
+
+class ParameterGridShard(object):
+    """
+    Lazy view of every n-th point of a parameter grid, starting at point i.
+    """
+
+    def __init__(self, grid, i, n):
+
+        if not 0 <= i < n: raise IndexError('shard index must be in [0, n)')
+
+        self.grid = grid
+        self.i = i
+        self.n = n
+
+    def __len__(self):
+
+        return max(0, (len(self.grid) - self.i + self.n - 1) // self.n)
+
+    def grid_idx(self, idx):
+        """
+        Return index into full grid of a point in this shard.
+        """
+        if idx < 0: idx += len(self)
+        if not 0 <= idx < len(self): raise IndexError('shard index out of range')
+
+        return self.i + idx * self.n
+
+    def __getitem__(self, idx):
+
+        return self.grid[self.grid_idx(idx)]
+
+    def __iter__(self):
+
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def params(self, idx):
+
+        return self.grid.params(self.grid_idx(idx))
+
+    def point_id(self, idx):
+
+        return self.grid.point_id(self.grid_idx(idx))
+
+
+def zip_cproduct(z, c, order, kwargs):
+
+    return list(ParameterGrid(z, c, order, kwargs))
 
 
 def get_stationary_distribution(trs):
@@ -70,6 +227,99 @@ def get_stationary_distribution(trs):
     return p_0
 
 
+_STATIONARY_DISTRIBUTIONS = OrderedDict()
+STATIONARY_DISTRIBUTION_CACHE_SIZE = 256
+
+
+def stationary_distribution(trs, method='solve', tol=1e-12, max_iter=100000, cache=True):
+    """
+    Return stationary distribution given a transition matrix, without a full
+    eigendecomposition. Results are memoized per matrix contents, which only pays
+    off when the same matrix recurs; pass cache=False for matrices drawn anew each
+    time (e.g., one per trial).
+
+    If the chain has several closed classes, its stationary distribution is not
+    unique and the linear system of 'solve' is singular; 'solve' then falls back
+    to 'eig', which returns one of the stationary distributions.
+
+    :param trs: transition matrix (dense array or scipy sparse matrix) whose columns
+        are the transition probabilities from each state
+    :param method: one of:
+        'solve': linear solve of (trs - I) p = 0 subject to sum(p) = 1 (sparse solve
+            if trs is sparse)
+        'power': power iteration on the lazy chain (I + trs) / 2 (same stationary
+            distribution but aperiodic), stopping when the L1 change is below tol
+        'eig': dense eigendecomposition (see get_stationary_distribution)
+    :param tol: convergence tolerance for power iteration
+    :param max_iter: max number of power iterations
+    :param cache: whether to look up and store the result in the memoization cache
+    :return: stationary distribution
+    """
+    if cache:
+        key = make_key(trs, method, tol)
+        if key in _STATIONARY_DISTRIBUTIONS:
+            _STATIONARY_DISTRIBUTIONS[key] = _STATIONARY_DISTRIBUTIONS.pop(key)
+            return _STATIONARY_DISTRIBUTIONS[key].copy()
+
+    n_states = trs.shape[0]
+
+    if method == 'solve':
+
+        # replace last (redundant) equation with normalization constraint
+        b = np.zeros((n_states,))
+        b[-1] = 1
+
+        try:
+            if sparse.issparse(trs):
+                a = sparse.lil_matrix(trs - sparse.identity(n_states))
+                a[-1, :] = 1
+                with warnings.catch_warnings():
+                    # singular systems are detected from the result below
+                    warnings.simplefilter('ignore', sparse_linalg.MatrixRankWarning)
+                    p_0 = sparse_linalg.spsolve(sparse.csc_matrix(a), b)
+            else:
+                a = trs - np.eye(n_states)
+                a[-1, :] = 1
+                p_0 = np.linalg.solve(a, b)
+        except np.linalg.LinAlgError:
+            p_0 = None
+
+        if p_0 is None or not np.all(np.isfinite(p_0)):
+            trs_dense = trs.toarray() if sparse.issparse(trs) else trs
+            p_0 = get_stationary_distribution(trs_dense)
+
+    elif method == 'power':
+
+        p_0 = np.ones((n_states,)) / n_states
+
+        for _ in range(max_iter):
+            p_next = .5 * (p_0 + trs.dot(p_0))
+            converged = np.abs(p_next - p_0).sum() < tol
+            p_0 = p_next
+            if converged: break
+
+        else:
+            raise Exception('power iteration did not converge in {} steps'.format(max_iter))
+
+    elif method == 'eig':
+
+        trs_dense = trs.toarray() if sparse.issparse(trs) else trs
+        p_0 = get_stationary_distribution(trs_dense)
+
+    else:
+        raise Exception('unknown method "{}"'.format(method))
+
+    p_0 = np.clip(np.real(p_0), 0, None)
+    p_0 /= p_0.sum()
+
+    if cache:
+        _STATIONARY_DISTRIBUTIONS[key] = p_0.copy()
+        while len(_STATIONARY_DISTRIBUTIONS) > STATIONARY_DISTRIBUTION_CACHE_SIZE:
+            _STATIONARY_DISTRIBUTIONS.popitem(last=False)
+
+    return p_0
+
+
 def sample_markov_chain(p_0, trs, l):
     """
     Sample a sequence from a Markov chain.
@@ -86,3 +336,197 @@ def sample_markov_chain(p_0, trs, l):
 
     return seq
 
+
+class MarkovChainSampler(object):
+    """
+    Sample many sequences from a Markov chain at once. Cumulative transition
+    tables are built once per transition matrix (using only its nonzero entries),
+    and all sequences are then advanced one step at a time with a single vectorized
+    lookup per step.
+
+    :param p_0: initial state distribution
+    :param trs: transition matrix (dense array or scipy sparse matrix) whose columns
+        are the transition probabilities from each state
+    """
+
+    def __init__(self, p_0, trs):
+
+        trs = sparse.csc_matrix(trs, dtype=float)
+        trs.eliminate_zeros()
+        trs.sort_indices()
+
+        n_states = trs.shape[0]
+        counts = np.diff(trs.indptr)
+        totals = np.asarray(trs.sum(axis=0)).flatten()
+
+        if np.any(totals <= 0):
+            raise Exception('all columns of transition matrix must have nonzero sum')
+
+        # cumulative probabilities within each column, shifted so that column j
+        # occupies the interval (j, j + 1]
+        cols = np.repeat(np.arange(n_states), counts)
+        cumsums = np.cumsum(trs.data)
+        col_starts = np.concatenate([[0.], cumsums])[trs.indptr[:-1]]
+
+        self.table = cols + np.minimum((cumsums - col_starts[cols]) / totals[cols], 1)
+        self.table[trs.indptr[1:] - 1] = np.arange(1, n_states + 1)
+        self.targs = trs.indices
+
+        self.p_0_cumsum = np.cumsum(p_0) / np.sum(p_0)
+        self.n_states = n_states
+
+    def sample(self, n_seqs, l, rng=None):
+        """
+        Sample a batch of sequences.
+        :param n_seqs: number of sequences
+        :param l: sequence length
+        :param rng: random number generator with a "random" method (numpy RandomState
+            or Generator); defaults to numpy's global random state
+        :return: (n_seqs, l) integer array of sequences
+        """
+        rng = np.random if rng is None else rng
+
+        seqs = np.zeros((n_seqs, l), dtype=int)
+
+        idxs = np.searchsorted(self.p_0_cumsum, rng.random(n_seqs), side='right')
+        seqs[:, 0] = np.minimum(idxs, self.n_states - 1)
+
+        for ctr in range(1, l):
+
+            idxs = np.searchsorted(
+                self.table, seqs[:, ctr - 1] + rng.random(n_seqs), side='right')
+            seqs[:, ctr] = self.targs[idxs]
+
+        return seqs
+
+
+_NOISE_REALIZATIONS = OrderedDict()
+NOISE_REALIZATION_CACHE_SIZE = 256
+
+
+class CommonNoise(object):
+    """
+    Standardized (zero-mean, unit-variance) gaussian noise realizations to be
+    shared by all parameter points of a sweep ("common random numbers"), so that
+    differences between points are not swamped by differences in their noise.
+    Scale by the noise standard deviation before use.
+
+    Each realization is generated from its own random stream spawned from seed,
+    so that only the seed needs to be passed to workers and the same trial always
+    gets the same noise, e.g., noise_std * common_noise[trial] or
+    noise_std * common_noise[start:stop]. The most recently used realizations
+    (NOISE_REALIZATION_CACHE_SIZE) are kept by each process as read-only arrays,
+    so that parameter points run by the same worker do not regenerate them.
+
+    :param seed: random seed for noise
+    :param n_trials: number of realizations (one per trial)
+    :param shape: shape of each realization
+    """
+
+    def __init__(self, seed, n_trials, shape):
+
+        self.seed = seed
+        self.n_trials = n_trials
+        self.shape = tuple(shape)
+
+    def __len__(self):
+
+        return self.n_trials
+
+    def realization(self, trial):
+        """
+        Return the (read-only) noise realization of a trial.
+        """
+        if not 0 <= trial < self.n_trials:
+            raise IndexError('Trial {} out of range.'.format(trial))
+
+        key = make_key(self.seed, self.shape, trial)
+
+        if key in _NOISE_REALIZATIONS:
+            _NOISE_REALIZATIONS[key] = _NOISE_REALIZATIONS.pop(key)
+            return _NOISE_REALIZATIONS[key]
+
+        # same stream as the trial-th child of np.random.SeedSequence(seed).spawn
+        seed_seq = np.random.SeedSequence(self.seed, spawn_key=(trial,))
+
+        noise = np.random.default_rng(seed_seq).standard_normal(self.shape)
+        noise.flags.writeable = False
+
+        _NOISE_REALIZATIONS[key] = noise
+        while len(_NOISE_REALIZATIONS) > NOISE_REALIZATION_CACHE_SIZE:
+            _NOISE_REALIZATIONS.popitem(last=False)
+
+        return noise
+
+    def __getitem__(self, idx):
+
+        if isinstance(idx, slice):
+
+            trials = range(*idx.indices(self.n_trials))
+
+            noise = np.empty((len(trials),) + self.shape)
+            for ctr, trial in enumerate(trials):
+                noise[ctr] = self.realization(trial)
+
+            return noise
+
+        return self.realization(idx)
+
+
+def wilson_interval(n_successes, n_trials, confidence=0.95):
+    """
+    Return Wilson score confidence interval for a binomial success probability.
+    :param n_successes: number of successes
+    :param n_trials: number of trials
+    :param confidence: confidence level
+    :return: (lower bound, upper bound)
+    """
+    if n_trials == 0: return 0., 1.
+
+    z = stats.norm.ppf(.5 + confidence / 2)
+    p = n_successes / n_trials
+
+    center = (p + z**2 / (2 * n_trials)) / (1 + z**2 / n_trials)
+    half_width = (z / (1 + z**2 / n_trials)) * \
+        np.sqrt(p * (1 - p) / n_trials + z**2 / (4 * n_trials**2))
+
+    return max(0., center - half_width), min(1., center + half_width)
+
+
+def run_trials_adaptively(
+        run_block, block_size, max_trials,
+        ci_width=None, low_threshold=None, confidence=0.95, min_trials=0):
+    """
+    Run blocks of Bernoulli trials until the confidence interval on the success
+    probability is narrower than ci_width, lies entirely below low_threshold, or
+    max_trials have been run.
+
+    :param run_block: function that takes a number of trials, runs them, and returns
+        a sequence of booleans indicating success
+    :param block_size: number of trials per block
+    :param max_trials: maximum total number of trials
+    :param ci_width: target width of confidence interval
+    :param low_threshold: stop once upper bound of confidence interval is below this
+    :param confidence: confidence level of interval
+    :param min_trials: minimum number of trials before stopping early
+    :return: estimated probability, number of trials run, lower bound, upper bound
+    """
+    n_successes = 0
+    n_trials = 0
+
+    while n_trials < max_trials:
+
+        successes = run_block(min(block_size, max_trials - n_trials))
+        n_successes += int(np.sum(successes))
+        n_trials += len(successes)
+
+        lower, upper = wilson_interval(n_successes, n_trials, confidence)
+
+        if n_trials < min_trials: continue
+
+        if ci_width is not None and upper - lower <= ci_width: break
+        if low_threshold is not None and upper < low_threshold: break
+
+    lower, upper = wilson_interval(n_successes, n_trials, confidence)
+
+    return n_successes / max(n_trials, 1), n_trials, lower, upper
@@ -0,0 +1,244 @@
+"""
+Engine for running parameter sweeps and storing their results in the database.
+
+An experiment is declared as a parameter grid, a function that simulates a single
+parameter point, and a function that turns a point's simulation output into a
+database row. The engine takes care of seeding each point, skipping points that
+are already stored, running points on a process pool, retrying failed points, and
+writing results to the database in batches on a background thread as they become
+available. When points run on a process pool, the numpy arrays in the shared
+context are placed in shared memory and mapped read-only by the workers rather
+than copied into each. Simulations can time their phases and count their trials
+and steps via the metrics module; these are collected from every point and
+reported periodically along with an ETA.
+"""
+from __future__ import division, print_function
+import logging
+import multiprocessing
+import traceback
+import numpy as np
+
+import db
+import metrics
+from metrics import ProgressMonitor
+from shared import attach, SharedArrays, split_arrays
+from shortcuts import param_key, point_seed
+
+
+# per-process state set by _init_worker
+_WORKER = {}
+
+
+def _init_worker(simulate, context, shared_handles=None):
+
+    if shared_handles: context = dict(context, **attach(shared_handles))
+
+    _WORKER['simulate'] = simulate
+    _WORKER['context'] = context
+
+
+def current_key():
+    """
+    Return the key of the parameter point being simulated by this process, e.g.,
+    for simulations that store partial results of a point as they go.
+    """
+    return _WORKER.get('key')
+
+
+def _run_point(task):
+    """
+    Run the simulation for a single parameter point, retrying on failure.
+    :return: (point idx, key, params, result, error message, metrics of all attempts)
+    """
+    idx, key, params, seed, max_retries = task
+
+    _WORKER['key'] = key
+
+    error = None
+    metrics.TIMER.reset()
+
+    for _ in range(1 + max_retries):
+
+        # reseed before every attempt so retries are reproducible
+        np.random.seed(point_seed(seed, key))
+
+        try:
+            result = _WORKER['simulate'](params, _WORKER['context'])
+            return idx, key, params, result, None, metrics.TIMER.as_dict()
+        except Exception:
+            error = traceback.format_exc()
+
+    return idx, key, params, None, error, metrics.TIMER.as_dict()
+
+
+class Sweep(object):
+    """
+    Parameter sweep whose results are stored as one row per parameter point.
+
+    :param grid: parameter grid (or shard of one) with params(idx) method, e.g.,
+        shortcuts.ParameterGrid
+    :param simulate: function simulate(params, context) that runs the simulation for
+        a dict of parameters and returns its result; it should draw random numbers
+        from numpy's global random state, which is seeded per point, and must be
+        defined at module level if the sweep is run on multiple workers
+    :param make_row: function make_row(params, result) that returns an (unsaved) ORM
+        object for the model; group and param_key are filled in by the engine
+    :param model: ORM model with group and param_key columns
+    :param group: name of record group
+    :param seed: base random seed
+    :param context: dict of data shared by all points (weight matrices, drives, etc.),
+        passed to each worker once rather than with every point; numpy arrays in it
+        are read-only when run on multiple workers
+    :param fixed_params: dict of parameters that are the same for all points (these
+        are included in the point keys, so changing them invalidates stored points)
+    :param n_workers: number of worker processes (1 runs points in this process)
+    :param max_retries: number of times to retry a point whose simulation raises
+    :param metrics_file: path of file to which progress metrics are appended as json
+        lines
+    :param report_interval: minimum number of seconds between progress reports
+    :param write_batch_size: maximum number of results held before they are written
+        to the database
+    :param write_interval: maximum number of seconds results are held before they
+        are written to the database
+    """
+
+    def __init__(
+            self, grid, simulate, make_row, model, group, seed,
+            context=None, fixed_params=None, n_workers=1, max_retries=0,
+            metrics_file=None, report_interval=60., write_batch_size=100,
+            write_interval=30.):
+
+        self.grid = grid
+        self.simulate = simulate
+        self.make_row = make_row
+        self.model = model
+        self.group = group
+        self.seed = seed
+        self.context = context or {}
+        self.fixed_params = fixed_params or {}
+        self.n_workers = n_workers
+        self.max_retries = max_retries
+        self.metrics_file = metrics_file
+        self.report_interval = report_interval
+        self.write_batch_size = write_batch_size
+        self.write_interval = write_interval
+
+    def key(self, idx):
+        """
+        Return key of a grid point (including fixed parameters).
+        """
+        return param_key(dict(self.fixed_params, **self.grid.params(idx)))
+
+    def pending(self, completed):
+        """
+        Return tasks for all grid points whose keys are not in completed.
+        """
+        tasks = []
+
+        for idx in range(len(self.grid)):
+
+            key = self.key(idx)
+            if key in completed: continue
+
+            tasks.append((idx, key, self.grid.params(idx), self.seed, self.max_retries))
+
+        return tasks
+
+    def results(self, tasks):
+        """
+        Yield results of tasks as they complete.
+        """
+        if self.n_workers > 1:
+
+            arrays, others = split_arrays(self.context)
+            shared = SharedArrays(arrays)
+
+            try:
+                pool = multiprocessing.Pool(
+                    self.n_workers, initializer=_init_worker,
+                    initargs=(self.simulate, others, shared.handles))
+
+                try:
+                    for result in pool.imap_unordered(_run_point, tasks):
+                        yield result
+                finally:
+                    pool.terminate()
+                    pool.join()
+
+            finally:
+                shared.close()
+
+        else:
+
+            _init_worker(self.simulate, self.context)
+
+            for task in tasks:
+                yield _run_point(task)
+
+    def run(self, session, resume=True):
+        """
+        Run all points of the sweep that are not yet stored, handing results to
+        a writer thread as they become available (see db.BackgroundWriter).
+        :param session: database session
+        :param resume: if True, skip points already stored in the group; otherwise
+            delete the group first
+        :return: list of grid indexes of points that failed
+        """
+        if resume:
+            completed = db.get_param_keys(session, self.model.group, self.group)
+        else:
+            db.delete_record_group(session, self.model.group, self.group)
+            completed = set()
+
+        tasks = self.pending(completed)
+
+        logging.info('Running {} of {} parameter points on {} worker(s).'.format(
+            len(tasks), len(self.grid), self.n_workers))
+
+        progress = ProgressMonitor(
+            len(tasks), name=self.group, metrics_file=self.metrics_file,
+            interval=self.report_interval)
+
+        # the writer thread is started once the first result arrives, i.e., after
+        # the worker processes have been forked
+        writer = None
+
+        failed = []
+
+        try:
+            for ctr, (idx, key, params, result, error, stats) in enumerate(
+                    self.results(tasks)):
+
+                if error is not None:
+                    logging.error(
+                        'Parameter point {} ({}) failed:\n{}'.format(idx, params, error))
+                    failed.append(idx)
+                    progress.update(stats=stats)
+                    continue
+
+                with progress.timer.phase('db_write'):
+
+                    row = self.make_row(params, result)
+                    row.group = self.group
+                    row.param_key = key
+
+                    if writer is None:
+                        writer = db.BackgroundWriter(
+                            session, batch_size=self.write_batch_size,
+                            flush_interval=self.write_interval)
+
+                    writer.add(row)
+
+                progress.update(stats=stats)
+
+                logging.info('Parameter point {} completed ({} of {}).'.format(
+                    idx, ctr + 1, len(tasks)))
+
+        finally:
+            if writer is not None:
+                with progress.timer.phase('db_write'):
+                    writer.close()
+
+        progress.report()
+
+        return sorted(failed)
@@ -0,0 +1,88 @@
+from __future__ import division, print_function
+import numpy as np
+
+
+def _has_replay(r, seq, onset, max_lag):
+    """
+    Brute-force check for a replay of seq starting at onset.
+    """
+    if not r[onset, seq[0]]: return False
+    if len(seq) == 1: return True
+
+    return any(
+        _has_replay(r, seq[1:], t, max_lag)
+        for t in range(onset + 1, min(onset + 1 + max_lag, len(r))))
+
+
+def test_replay_detection_matches_brute_force_search():
+
+    from analysis import detect_replays
+
+    np.random.seed(0)
+
+    for _ in range(100):
+
+        n_steps, n_nodes = np.random.randint(3, 20), np.random.randint(2, 6)
+        rs = np.random.rand(3, n_steps, n_nodes) < np.random.choice([.2, .4, .6])
+        seqs = [
+            list(np.random.randint(0, n_nodes, np.random.randint(1, 5)))
+            for _ in range(3)]
+        max_lag = np.random.randint(1, 4)
+        exclusive = np.random.rand() < .5
+
+        replays = detect_replays(rs, seqs, max_lag=max_lag, exclusive=exclusive)
+
+        if exclusive: rs = rs & (rs.sum(axis=2, keepdims=True) == 1)
+
+        for direction in ['forward', 'reverse']:
+            for trial_ctr, r in enumerate(rs):
+                for seq_ctr, seq in enumerate(seqs):
+
+                    seq = seq if direction == 'forward' else seq[::-1]
+                    onsets = [
+                        t for t in range(n_steps) if _has_replay(r, seq, t, max_lag)]
+
+                    assert list(replays[direction]['onsets'][trial_ctr][seq_ctr]) == onsets
+                    assert replays[direction]['counts'][trial_ctr, seq_ctr] == len(onsets)
+
+
+def test_exclusive_replay_detection_reproduces_single_trial_sequence_comparison():
+
+    from analysis import detect_replays
+
+    seq = [2, 0, 3]
+    rs = np.zeros((10, 5), dtype=int)
+    rs[[1, 2, 3], seq] = 1  # clean replay
+    rs[[5, 6, 7], seq] = 1  # replay with extra active node
+    rs[6, 4] = 1
+
+    replays = detect_replays(rs, seq)
+
+    assert list(replays['forward']['onsets'][0]) == [1]
+    assert replays['reverse']['counts'][0] == 0
+    assert list(detect_replays(rs, seq, exclusive=False)['forward']['onsets'][0]) == [1, 5]
+
+
+def test_spike_replay_detection_tolerates_jitter():
+
+    from analysis import detect_spike_replays
+
+    # trial 0: forward replay with jittered intervals; trial 1: reverse replay
+    spike_times = [np.array([.010, .0132, .0151, .030]), np.array([.020, .021, .0235])]
+    spike_cells = [np.array([0, 1, 2, 2]), np.array([2, 1, 0])]
+
+    replays = detect_spike_replays(
+        spike_times, spike_cells, [0, 1, 2], n_cells=3, bin_size=.001, max_lag=.0035,
+        duration=.05)
+
+    assert list(replays['forward']['counts'][:, 0]) == [1, 0]
+    assert list(replays['reverse']['counts'][:, 0]) == [0, 1]
+    assert np.allclose(replays['forward']['onsets'][0][0], [.010])
+    assert np.allclose(replays['reverse']['onsets'][1][0], [.020])
+
+    # a lag longer than the tolerance breaks the sequence
+    replays = detect_spike_replays(
+        spike_times[0], spike_cells[0], [0, 1, 2], n_cells=3, bin_size=.001,
+        max_lag=.002, duration=.05)
+
+    assert replays['forward']['counts'][0] == 0
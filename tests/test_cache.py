@@ -0,0 +1,155 @@
+from __future__ import division, print_function
+import os
+import numpy as np
+
+
+def test_disk_cache_round_trips_arrays_and_evicts_least_recently_used_entries(tmpdir):
+
+    from cache import DiskCache, make_key
+
+    disk_cache = DiskCache(str(tmpdir), max_bytes=20000)
+
+    x = np.arange(1000, dtype=float)
+    keys = [make_key('x', ctr) for ctr in range(3)]
+
+    assert len(set(keys)) == 3
+    assert make_key('x', 0) == keys[0]
+    assert make_key(np.zeros(3)) != make_key(np.zeros(3, dtype=int))
+
+    disk_cache.save(keys[0], {'x': x}, {'ctr': 0})
+    arrays, meta = disk_cache.load(keys[0])
+
+    assert isinstance(arrays['x'], np.memmap)
+    assert np.all(arrays['x'] == x)
+    assert meta == {'ctr': 0}
+
+    # make first entry look old, then add two more entries to force eviction
+    old = os.path.join(disk_cache.path(keys[0]), 'meta.json')
+    os.utime(old, (0, 0))
+
+    disk_cache.save(keys[1], {'x': x})
+    disk_cache.save(keys[2], {'x': x})
+
+    assert keys[0] not in disk_cache
+    assert keys[1] in disk_cache and keys[2] in disk_cache
+    assert disk_cache.load(keys[0]) is None
+
+
+def test_memoized_simulations_return_stored_outputs_for_repeated_runs(tmpdir):
+
+    from cache import DiskCache, SimulationCache
+    from connectivity import adlib_lif
+    from network import BasicWithAthAndTwoLevelStdp, LIFExponentialSynapsesModel
+
+    # discrete-time network
+    cache = SimulationCache(max_items=2)
+    ntwk = BasicWithAthAndTwoLevelStdp(
+        th=1.5, w=2 * np.eye(6, k=-1), g_x=1, t_x=5, rp=2, stdp_params=None, cache=cache)
+
+    drives = np.zeros((10, 6))
+    drives[1, 0] = 2
+
+    rs_0, xcs_0 = ntwk.run(np.zeros((6,)), np.zeros((6,)), drives)
+    rs_0[:] = -1  # outputs handed out must not alias stored ones
+    rs_1, xcs_1 = ntwk.run(np.zeros((6,)), np.zeros((6,)), drives)
+
+    assert ntwk.run_stats['cached'] and (cache.hits, cache.misses) == (1, 1)
+    assert np.all(rs_1 == BasicWithAthAndTwoLevelStdp(
+        th=1.5, w=2 * np.eye(6, k=-1), g_x=1, t_x=5, rp=2, stdp_params=None).run(
+        np.zeros((6,)), np.zeros((6,)), drives)[0])
+
+    # different drives are not confused with stored ones
+    ntwk.run(np.zeros((6,)), np.zeros((6,)), 2 * drives)
+    assert not ntwk.run_stats['cached']
+
+    # LIF network, stored on disk and reloaded by a new in-memory cache
+    n_steps = 200
+    ws = adlib_lif(np.eye(3, k=-1), w_pp=.5, w_mp=2, w_pm=.3, w_mm=.3, w_pi=1, w_ip=.5)
+    drives = {syn: np.zeros((n_steps, 7)) for syn in ws}
+    drives['ampa'][10:20, 0] = 2
+
+    measurements = []
+
+    for _ in range(2):
+
+        cache = SimulationCache(disk_cache=DiskCache(str(tmpdir)))
+        ntwk = LIFExponentialSynapsesModel(
+            v_rests=-.07 * np.ones((7,)), taus_m=.05 * np.ones((7,)),
+            taus_syn={'ampa': .002, 'nmda': .08, 'gaba': .005},
+            v_revs_syn={'ampa': 0., 'nmda': 0., 'gaba': -.08},
+            v_ths=-.05 * np.ones((7,)), v_resets=-.07 * np.ones((7,)),
+            refrac_pers=.002 * np.ones((7,)), ws=ws, cache=cache)
+
+        measurements.append(ntwk.run(
+            initial_conditions={
+                'voltages': -.07 * np.ones((7,)),
+                'conductances': {syn: np.zeros((7,)) for syn in ws},
+                'refrac_ctrs': np.zeros((7,)),
+            },
+            drives=drives, dt=.0005, record=('spikes', 'conductances')))
+
+    assert ntwk.run_stats['cached']
+    assert np.all(measurements[0]['spikes'] == measurements[1]['spikes'])
+    assert sorted(measurements[1]['conductances']) == ['ampa', 'gaba', 'nmda']
+    assert np.all(
+        measurements[0]['conductances']['nmda'] == measurements[1]['conductances']['nmda'])
+
+
+def test_functions_are_keyed_by_code_defaults_and_closures():
+
+    import functools
+    from cache import make_key
+
+    assert make_key(lambda x: x + 1) != make_key(lambda x: x * 100)
+    assert make_key(lambda x: x + 1) == make_key(lambda x: x + 1)
+
+    def make_builder(scale, offset=0):
+        def builder(x, shift=offset):
+            return scale * x + shift
+        return builder
+
+    assert make_key(make_builder(1)) == make_key(make_builder(1))
+    assert make_key(make_builder(1)) != make_key(make_builder(2))
+    assert make_key(make_builder(1)) != make_key(make_builder(1, offset=1))
+
+    # a function redefined with a different body gets a different key
+    def f(x):
+        return x
+    key = make_key(f)
+
+    def f(x):
+        return -x
+    assert make_key(f) != key
+
+    assert make_key(functools.partial(f, 1)) != make_key(functools.partial(f, 2))
+
+    # recursive closures terminate
+    def outer():
+        def fib(n):
+            return n if n < 2 else fib(n - 1) + fib(n - 2)
+        return fib
+
+    assert make_key(outer()) == make_key(outer())
+    assert make_key(np.sum) == make_key(np.sum)
+
+
+def test_networks_share_one_simulation_cache_per_process(tmpdir):
+
+    from cache import shared_simulation_cache
+    from network import BasicWithAthAndTwoLevelStdp
+
+    cache = shared_simulation_cache(str(tmpdir))
+    assert shared_simulation_cache(str(tmpdir)) is cache
+    assert cache.disk_cache.directory == str(tmpdir)
+
+    drives = np.zeros((10, 6))
+    drives[1, 0] = 2
+
+    for _ in range(2):
+        ntwk = BasicWithAthAndTwoLevelStdp(
+            th=1.5, w=2 * np.eye(6, k=-1), g_x=1, t_x=5, rp=2, stdp_params=None,
+            cache=shared_simulation_cache(str(tmpdir)))
+        ntwk.run(np.zeros((6,)), np.zeros((6,)), drives)
+
+    assert ntwk.run_stats['cached'] and (cache.hits, cache.misses) == (1, 1)
+    assert len(cache.disk_cache.entries()) == 1
@@ -62,3 +62,120 @@ def test_hexagonal_lattice_is_created_correctly():
 
         assert nodes == nodes_correct
         assert np.all(w == w.T)
+
+
+def test_cached_connectivity_matches_builder_and_skips_construction(tmpdir):
+
+    import connectivity
+    from cache import DiskCache
+
+    disk_cache = DiskCache(str(tmpdir))
+
+    w, nodes = connectivity.hexagonal_lattice(3)
+    w_cached, nodes_cached = connectivity.cached(
+        connectivity.hexagonal_lattice, 3, cache=disk_cache)
+
+    assert np.all(w_cached == w)
+    assert nodes_cached == nodes
+
+    # a second call should load from disk instead of calling the builder (calls
+    # are recorded in an attribute, since closure values are part of the key)
+    def builder(d):
+        builder.calls.append(d)
+        return connectivity.hexagonal_lattice(d)
+
+    builder.calls = []
+
+    connectivity.cached(builder, 3, cache=disk_cache)
+    w_sparse, nodes_cached = connectivity.cached(builder, 3, cache=disk_cache, sparse=True)
+
+    assert builder.calls == [3]
+    assert np.all(w_sparse.toarray() == w)
+    assert nodes_cached == nodes
+
+    # seeded stochastic builders are reproducible and leave global random state intact
+    np.random.seed(0)
+    w_0 = connectivity.cached(
+        connectivity.er_directed_nary, 20, .3, [1, 2], [.5, .5], seed=5, cache=disk_cache)
+    x_0 = np.random.rand()
+
+    np.random.seed(0)
+    w_1 = connectivity.cached(
+        connectivity.er_directed_nary, 20, .3, [1, 2], [.5, .5], seed=5, cache=disk_cache)
+    x_1 = np.random.rand()
+
+    assert np.all(w_0 == w_1)
+    assert x_0 == x_1
+
+
+def test_block_sparse_builders_match_dense_assembly():
+
+    from scipy import sparse
+    import connectivity
+
+    np.random.seed(0)
+    n = 6
+    mask = np.random.rand(n, n) < .4
+
+    # basic adlib network
+    w = connectivity.basic_adlib(mask, 2., 3., 4., 5., sparse=True)
+    assert sparse.issparse(w)
+    assert w.nnz == mask.sum() + 3*n
+
+    w_correct = np.zeros((2*n, 2*n))
+    w_correct[:n, :n] = 2 * mask
+    w_correct[n:, :n] = 3 * np.eye(n)
+    w_correct[:n, n:] = 4 * np.eye(n)
+    w_correct[n:, n:] = 5 * np.eye(n)
+
+    assert np.all(w.toarray() == w_correct)
+    assert np.all(connectivity.basic_adlib(mask, 2., 3., 4., 5.) == w_correct)
+
+    # lif network with principal, memory, and inhibitory populations
+    ws = connectivity.adlib_lif(
+        mask, w_pp=1, w_mp=2, w_pm=3, w_mm=4, w_pi=5, w_ip=6, sparse=True)
+
+    ampa_correct = np.zeros((2*n + 1, 2*n + 1))
+    nmda_correct = np.zeros((2*n + 1, 2*n + 1))
+    gaba_correct = np.zeros((2*n + 1, 2*n + 1))
+
+    ampa_correct[n:2*n, :n] = 2 * np.eye(n)
+    ampa_correct[-1, :n] = 6
+    nmda_correct[:n, :n] = mask
+    nmda_correct[:n, n:2*n] = 3 * np.eye(n)
+    nmda_correct[n:2*n, n:2*n] = 4 * np.eye(n)
+    gaba_correct[:n, -1] = 5
+
+    assert np.all(ws['ampa'].toarray() == ampa_correct)
+    assert np.all(ws['nmda'].toarray() == nmda_correct)
+    assert np.all(ws['gaba'].toarray() == gaba_correct)
+
+    # dense arrays by default, as the figures have always passed to the network
+    ws_dense = connectivity.adlib_lif(mask, w_pp=1, w_mp=2, w_pm=3, w_mm=4, w_pi=5, w_ip=6)
+
+    for syn, w_correct in zip(
+            ['ampa', 'nmda', 'gaba'], [ampa_correct, nmda_correct, gaba_correct]):
+        assert type(ws_dense[syn]) is np.ndarray
+        assert np.all(ws_dense[syn] == w_correct)
+
+
+def test_random_transition_masks_are_cached_by_seed(tmpdir):
+
+    import connectivity
+    from cache import DiskCache
+
+    disk_cache = DiskCache(str(tmpdir))
+
+    w = connectivity.cached(
+        connectivity.random_transition_mask, 10, .1, seed=3, cache=disk_cache)
+
+    assert np.all(np.diag(w) == 0) and np.all(w.sum(axis=0) > 0)
+    assert len(disk_cache.entries()) == 1
+
+    w_again = connectivity.cached(
+        connectivity.random_transition_mask, 10, .1, seed=3, cache=disk_cache)
+    w_other = connectivity.cached(
+        connectivity.random_transition_mask, 10, .1, seed=4, cache=disk_cache)
+
+    assert np.all(w_again == w) and not np.all(w_other == w)
+    assert len(disk_cache.entries()) == 2
@@ -0,0 +1,635 @@
+from __future__ import division, print_function
+import numpy as np
+
+
+def test_sqlite_backend_stores_array_columns_of_real_models_in_wal_mode(tmpdir, monkeypatch):
+
+    from sqlalchemy import text
+    import db
+    from db import _models
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir))
+    session = db.connect_and_make_session('test', backend='sqlite')
+
+    assert session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+
+    m = _models.SpontaneousReplayExtensionResult
+
+    session.add(m(
+        group='test', param_key='a', sequence=[0, 1, 2],
+        noise_stds=np.array([.1, .2]), probed_replay_probs=[np.float64(.5), -1]))
+    session.commit()
+
+    sper = session.query(m).filter(m.group == 'test').one()
+
+    assert sper.sequence == [0, 1, 2]
+    assert sper.noise_stds == [.1, .2]
+    assert np.array_equal(sper.probed_replay_probs, [.5, -1])
+    assert db.get_param_keys(session, m.group, 'test') == {'a'}
+    assert tmpdir.join('test.db').check()
+
+
+def test_postgres_credentials_are_read_from_environment_or_asked(monkeypatch):
+
+    import builtins
+    import db
+
+    monkeypatch.setenv('MUSHROOM_MUSHROOM_USER', 'user')
+    monkeypatch.setenv('MUSHROOM_MUSHROOM_PASS', 'pass')
+    assert db.make_url('test', 'postgres') == 'postgresql://user:pass@/test'
+
+    monkeypatch.delenv('MUSHROOM_MUSHROOM_USER')
+    monkeypatch.setattr(builtins, 'input', lambda prompt: 'asked')
+    monkeypatch.setattr(db, 'getpass', lambda prompt: 'secret')
+    assert db.make_url('test', 'postgres') == 'postgresql://asked:secret@/test'
+
+
+def test_engines_are_shared_and_session_scope_commits_or_rolls_back(tmpdir, monkeypatch):
+
+    from sqlalchemy import event
+    import db
+    from db import _models
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir))
+
+    engine = db.get_engine('test', backend='sqlite')
+
+    connects = []
+    event.listen(engine, 'connect', lambda *args: connects.append(1))
+
+    m = _models.ReplayPlusStdpResult
+
+    for ctr in range(5):
+        with db.session_scope('test', backend='sqlite') as session:
+            session.add(m(group='test', param_key=str(ctr)))
+
+    # every session reuses the same engine and its pooled connection
+    assert db.get_engine('test', backend='sqlite') is engine
+    assert len(connects) == 0
+
+    try:
+        with db.session_scope('test', backend='sqlite') as session:
+            session.add(m(group='test', param_key='failed'))
+            raise ValueError
+    except ValueError:
+        pass
+
+    with db.session_scope('test', backend='sqlite') as session:
+        assert db.get_param_keys(session, m.group, 'test') == {str(ctr) for ctr in range(5)}
+
+    db.dispose_engines()
+    assert db.get_engine('test', backend='sqlite') is not engine
+    db.dispose_engines()
+
+
+def test_result_writer_inserts_orm_rows_and_dicts_in_batches(tmpdir, monkeypatch):
+
+    from sqlalchemy import event
+    import db
+    from db import _models
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir))
+
+    engine = db.get_engine('test', backend='sqlite')
+    statements = []
+    event.listen(
+        engine, 'before_cursor_execute',
+        lambda conn, cursor, statement, *args: statements.append(statement))
+
+    m = _models.SpontaneousReplayExtensionResult
+    session = db.connect_and_make_session('test', backend='sqlite')
+
+    with db.ResultWriter(session, batch_size=4, flush_interval=3600) as writer:
+
+        for ctr in range(5):
+            writer.add(m(group='test', param_key=str(ctr), noise_stds=[.1 * ctr]))
+        writer.add({'group': 'test', 'param_key': 'dict', 'noise_stds': [1.]}, model=m)
+
+        # first batch written, remaining rows still buffered
+        assert writer.n_written == 4 and len(writer.buffer) == 2
+
+    assert writer.n_written == 6
+
+    inserts = [statement for statement in statements if statement.startswith('INSERT')]
+    assert len(inserts) <= 3
+
+    srers = session.query(m).filter(m.group == 'test').order_by(m.id).all()
+
+    assert [srer.param_key for srer in srers] == ['0', '1', '2', '3', '4', 'dict']
+    assert srers[2].noise_stds == [.2]
+
+    session.close()
+    db.dispose_engines()
+
+
+def test_background_writer_writes_rows_and_reraises_errors(tmpdir, monkeypatch):
+
+    import threading
+    import pytest
+    import db
+    from db import _models
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir))
+
+    m = _models.ReplayPlusStdpResult
+    session = db.connect_and_make_session('test', backend='sqlite')
+
+    with db.BackgroundWriter(session, batch_size=3, max_queue=2) as writer:
+        for ctr in range(10):
+            writer.add(m(group='test', param_key=str(ctr), w_scores=[[.1 * ctr]]))
+
+    assert writer.n_written == 10
+    assert not writer.thread.is_alive()
+    assert db.get_param_keys(session, m.group, 'test') == {str(ctr) for ctr in range(10)}
+
+    # rows that can't be written raise in the calling thread
+    writer = db.BackgroundWriter(session)
+    writer.add({'group': object()}, model=m)
+
+    with pytest.raises(Exception):
+        writer.close()
+
+    assert threading.active_count() == 1
+
+    session.close()
+    db.dispose_engines()
+
+
+def test_numpy_array_columns_round_trip_dtype_shape_and_compressed_data(tmpdir, monkeypatch):
+
+    from sqlalchemy import Column, Integer, MetaData, Table, select
+    import pytest
+    import db
+    from db._models import NumpyArray
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir))
+    engine = db.get_engine('test', backend='sqlite')
+
+    table = Table(
+        'arrays', MetaData(), Column('id', Integer, primary_key=True),
+        Column('raw', NumpyArray()), Column('compressed', NumpyArray(compress=True)),
+        Column('floats', NumpyArray(dtype=float)))
+    table.metadata.create_all(engine)
+
+    arrays = [
+        np.arange(24, dtype='>i4').reshape(2, 3, 4),
+        np.zeros((1000, 50)),
+        np.float32(3.5),
+        np.zeros((0, 3), dtype=bool),
+    ]
+
+    with engine.begin() as conn:
+        for array in arrays:
+            conn.execute(
+                table.insert(), {'raw': array, 'compressed': array, 'floats': [[1, 2]]})
+        conn.execute(table.insert(), {'raw': None})
+
+    with engine.connect() as conn:
+        rows = conn.execute(select(table).order_by(table.c.id)).all()
+        n_bytes = conn.exec_driver_sql('SELECT length(compressed) FROM arrays').all()
+
+    for row, array in zip(rows, arrays):
+        for loaded in (row.raw, row.compressed):
+            assert loaded.dtype == array.dtype and loaded.shape == array.shape
+            assert np.array_equal(loaded, array)
+        assert row.floats.dtype == float and row.floats.tolist() == [[1., 2.]]
+
+    assert rows[-1].raw is None
+    assert n_bytes[1][0] < 1000
+
+    with pytest.raises(ValueError):
+        rows[0].raw[0, 0, 0] = 1
+
+    db.dispose_engines()
+
+
+def test_legacy_array_columns_are_read_and_migrated_to_binary(tmpdir, monkeypatch):
+
+    from sqlalchemy import JSON, Column, MetaData, Table, create_engine, inspect
+    import db
+    from db import _models
+    from db._models import NumpyArray
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir))
+
+    assert NumpyArray().process_result_value([0.1, 0.2], None).tolist() == [0.1, 0.2]
+
+    # table made when array columns were stored as json lists
+    m = _models.ReplayPlusStdpResult
+    legacy = Table(m.__tablename__, MetaData(), *[
+        Column(
+            column.name, JSON if isinstance(column.type, NumpyArray) else column.type,
+            primary_key=column.primary_key)
+        for column in m.__table__.columns])
+
+    engine = create_engine(db.make_url('test', 'sqlite'))
+    legacy.create(engine)
+    with engine.begin() as conn:
+        conn.execute(legacy.insert(), [
+            {'group': 'test', 'param_key': str(ctr), 'w_scores': [[ctr, .5], [ctr, 1.5]]}
+            for ctr in range(5)])
+    engine.dispose()
+
+    engine = db.get_engine('test', backend='sqlite')
+    session = db.connect_and_make_session('test', backend='sqlite')
+
+    w_scores = [row[0] for row in session.query(m.w_scores).order_by(m.id)]
+    assert [w.tolist() for w in w_scores] == [[[ctr, .5], [ctr, 1.5]] for ctr in range(5)]
+    session.close()
+
+    converted = db.migrate_arrays(engine, batch_size=2)
+
+    assert ('replay_plus_stdp_result', 'w_scores') in converted
+    assert db.migrate_arrays(engine) == []
+
+    types = {
+        column['name']: type(column['type']).__name__
+        for column in inspect(engine).get_columns(m.__tablename__)}
+    assert types['w_scores'] == 'BLOB'
+
+    with db.session_scope('test', backend='sqlite') as session:
+
+        w_scores = [row[0] for row in session.query(m.w_scores).order_by(m.id)]
+        assert [w.tolist() for w in w_scores] == [
+            [[ctr, .5], [ctr, 1.5]] for ctr in range(5)]
+
+        session.add(m(group='test', param_key='new', w_scores=np.ones((2, 2))))
+
+    with db.session_scope('test', backend='sqlite') as session:
+        record = db.get_record(session, m.group, 'test', 'new')
+        assert np.array_equal(record.w_score_means, [1, 1])
+
+    db.dispose_engines()
+
+
+def test_load_group_exports_columns_once_and_refreshes_when_group_changes(
+        tmpdir, monkeypatch):
+
+    import os
+    import db
+    from db import _models
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir))
+    export_dir = str(tmpdir.join('export'))
+
+    m = _models.ReplayPlusStdpResult
+    session = db.connect_and_make_session('test', backend='sqlite')
+
+    for ctr, (g_x, beta_1) in enumerate([(.5, .1), (.5, .2), (.5001, .1), (1., .1)]):
+        session.add(m(
+            group='test', param_key=str(ctr), g_x=g_x, beta_1=beta_1,
+            trigger_interval=10 - ctr, sequence_novel=[0, 1, ctr],
+            w_scores=np.full((3, 2), ctr, dtype=float)))
+    session.add(m(group='other', param_key='x', g_x=.5, beta_1=.1))
+    session.commit()
+
+    rpsrs = db.load_group(session, m, 'test', directory=export_dir)
+
+    assert rpsrs['param_key'].tolist() == ['0', '1', '2', '3']
+    assert rpsrs['w_scores'].shape == (4, 3, 2)
+    assert rpsrs['sequence_novel'].tolist() == [[0, 1, 0], [0, 1, 1], [0, 1, 2], [0, 1, 3]]
+
+    idxs = db.select_rows(rpsrs, order_by='trigger_interval', g_x=.5, beta_1=.1, rtol=.01)
+    assert idxs.tolist() == [2, 0]
+    assert db.select_rows(rpsrs, g_x=.5).tolist() == [0, 1]
+
+    # reloading an unchanged group reads the export file
+    path = db.export.group_path(session, m, 'test', export_dir)
+    mtime = os.path.getmtime(path)
+    db.export._LOADED.clear()
+
+    reloaded = db.load_group(session, m, 'test', directory=export_dir)
+
+    assert np.array_equal(reloaded['w_scores'], rpsrs['w_scores'])
+    assert os.path.getmtime(path) == mtime
+
+    # adding a row to the group makes it be exported again
+    session.add(m(group='test', param_key='4', g_x=.5, w_scores=np.zeros((5, 2))))
+    session.commit()
+
+    rpsrs = db.load_group(session, m, 'test', directory=export_dir)
+
+    assert rpsrs['param_key'].tolist() == ['0', '1', '2', '3', '4']
+    assert rpsrs['w_scores'].dtype == object and rpsrs['w_scores'][4].shape == (5, 2)
+
+    # object columns are stored without pickling
+    db.export._LOADED.clear()
+    reloaded = db.load_group(session, m, 'test', directory=export_dir)
+
+    with np.load(path) as f:
+        assert all(f[key].dtype != object for key in f.files)
+
+    assert reloaded['beta_1'][4] is None
+    assert reloaded['w_scores'][4].shape == (5, 2)
+    assert np.array_equal(reloaded['w_scores'][0], rpsrs['w_scores'][0])
+
+    # updating a row makes the group be exported again
+    session.query(m).filter(m.param_key == '0').update({'g_x': .9})
+    session.commit()
+
+    rpsrs = db.load_group(session, m, 'test', directory=export_dir)
+    assert rpsrs['g_x'][0] == .9
+
+    db.export._LOADED.clear()
+    assert db.load_group(session, m, 'test', directory=export_dir)['g_x'][0] == .9
+
+    # groups of the same name in another database have their own files
+    other = db.connect_and_make_session('other', backend='sqlite')
+    other.add(m(group='test', param_key='a', g_x=.1))
+    other.commit()
+
+    assert db.export.group_path(other, m, 'test', export_dir) != path
+    assert db.load_group(other, m, 'test', directory=export_dir)['g_x'].tolist() == [.1]
+    assert len(db.load_group(session, m, 'test', directory=export_dir)['g_x']) == 5
+
+    other.close()
+    session.close()
+    db.dispose_engines()
+
+
+def test_indexes_are_added_to_existing_tables_and_records_looked_up_by_key(
+        tmpdir, monkeypatch):
+
+    from sqlalchemy import create_engine, inspect, text
+    import db
+    from db import _models
+    from shortcuts import param_key
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir))
+
+    # table made before indexes were declared
+    engine = create_engine(db.make_url('test', 'sqlite'))
+    _models.ReplayPlusStdpResult.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(text('DROP INDEX ix_replay_plus_stdp_result_group_param_key'))
+    engine.dispose()
+
+    engine = db.get_engine('test', backend='sqlite')
+    indexes = {
+        index['name']: index['column_names']
+        for index in inspect(engine).get_indexes('replay_plus_stdp_result')}
+
+    assert indexes['ix_replay_plus_stdp_result_group_param_key'] == ['group', 'param_key']
+    assert indexes['ix_replay_plus_stdp_result_group_g_x_beta_1'] == \
+        ['group', 'g_x', 'beta_1']
+
+    car_indexes = inspect(engine).get_indexes('connectivity_analysis_result')
+    assert 'ix_connectivity_analysis_result_group_l_q' in [
+        index['name'] for index in car_indexes]
+
+    m = _models.ReplayPlusStdpResult
+    keys = [param_key({'g_x': g_x, 'beta_1': .1}) for g_x in np.arange(0, 1, .1)]
+
+    with db.session_scope('test', backend='sqlite') as session:
+        for key, g_x in zip(keys, np.arange(0, 1, .1)):
+            session.add(m(group='test', param_key=key, g_x=g_x, beta_1=.1))
+
+    with db.session_scope('test', backend='sqlite') as session:
+
+        # keys are canonical, so floats that differ by rounding error find the record
+        key = param_key({'g_x': .1 + .2, 'beta_1': .1})
+        record = db.get_record(session, m.group, 'test', key)
+        assert np.isclose(record.g_x, .3)
+
+        assert db.get_record(session, m.group, 'other', keys[0]) is None
+
+        records = db.get_records(
+            session, m.group, 'test', keys[::2] + ['missing'], chunk_size=2)
+        assert sorted(records) == sorted(keys[::2])
+
+    db.dispose_engines()
+
+
+def test_columns_missing_from_existing_tables_are_added(tmpdir, monkeypatch):
+
+    from sqlalchemy import Column, MetaData, Table, create_engine, inspect
+    import db
+    from db import _models
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir))
+
+    # tables made before parameter keys, bounds and summaries were added
+    m = _models.ConnectivityAnalysisResult
+    s = _models.SpontaneousReplayExtensionResult
+    added = {
+        m: ['param_key', 'replay_prob_means', 'replay_prob_sems'],
+        s: ['param_key', 'ci_width', 'confidence', 'replay_prob_lower_bounds'],
+    }
+
+    engine = create_engine(db.make_url('test', 'sqlite'))
+    old_tables = {}
+    for model, names in added.items():
+        old_tables[model] = Table(model.__tablename__, MetaData(), *[
+            Column(column.name, column.type, primary_key=column.primary_key)
+            for column in model.__table__.columns if column.name not in names])
+        old_tables[model].create(engine)
+    with engine.begin() as conn:
+        conn.execute(old_tables[m].insert(), [
+            {'group': 'old', 'l': 3, 'q': .5, 'replay_probs': np.ones((4, 2))}])
+    engine.dispose()
+
+    engine = db.get_engine('test', backend='sqlite')
+
+    for model, names in added.items():
+        columns = inspect(engine).get_columns(model.__tablename__)
+        assert set(names) <= set(column['name'] for column in columns)
+
+    indexes = [index['name'] for index in inspect(engine).get_indexes(m.__tablename__)]
+    assert 'ix_connectivity_analysis_result_group_param_key' in indexes
+
+    with db.session_scope('test', backend='sqlite') as session:
+
+        assert db.get_param_keys(session, m.group, 'old') == {None}
+
+        session.add(m(group='new', param_key='a', replay_probs=np.ones((4, 2))))
+        session.add(s(group='new', param_key='b', ci_width=.1))
+
+    with db.session_scope('test', backend='sqlite') as session:
+
+        record = db.get_record(session, m.group, 'new', 'a')
+        assert np.array_equal(record.replay_prob_means, [1, 1])
+        assert db.get_record(session, s.group, 'new', 'b').ci_width == .1
+
+    # summaries of old records are computed by migrating
+    assert db.migrate('test', backend='sqlite')[m.__tablename__] == 1
+
+    with db.session_scope('test', backend='sqlite') as session:
+        db.check_summaries_complete(session, m.group, 'old')
+        record = session.query(m).filter(m.group == 'old').one()
+        assert np.array_equal(record.replay_prob_sems, [0, 0])
+
+    db.dispose_engines()
+
+
+def test_summaries_are_computed_on_insert_backfilled_and_aggregated(tmpdir, monkeypatch):
+
+    import os
+    import pytest
+    from scipy import stats
+    import db
+    from db import _models
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir))
+
+    m = _models.ReplayPlusStdpResult
+    session = db.connect_and_make_session('test', backend='sqlite')
+
+    rng = np.random.RandomState(0)
+    w_scores = [rng.rand(5, 2) for _ in range(6)]
+
+    # bulk insert
+    with db.ResultWriter(session) as writer:
+        for ctr, w in enumerate(w_scores[:4]):
+            writer.add(m(
+                group='test', param_key=str(ctr), g_x=ctr % 2, alpha=ctr, w_scores=w))
+
+    # orm insert, and a row stored without summaries
+    session.add(m(group='test', param_key='4', g_x=0, alpha=4, w_scores=w_scores[4]))
+    session.add(m(
+        group='test', param_key='5', g_x=1, alpha=5, w_scores=w_scores[5],
+        w_score_means=np.zeros(2)))
+    session.commit()
+    session.query(m).filter(m.param_key == '5').update({'w_score_means': None})
+    session.commit()
+
+    monkeypatch.setattr(db.export, 'DEFAULT_EXPORT_DIR', str(tmpdir.join('export')))
+    columns = ['alpha', 'w_score_sems', 'w_score_means']
+
+    assert db.load_group(session, m, 'test', columns=columns)['w_score_means'][5] is None
+    path = db.export.group_path(session, m, 'test', columns=columns)
+
+    with pytest.raises(Exception):
+        db.check_summaries_complete(session, m.group, 'test')
+
+    # backfilling removes the group's export files
+    assert db.update_summaries(session, m.group, 'test') == 1
+    assert not os.path.exists(path)
+    db.check_summaries_complete(session, m.group, 'test')
+
+    rpsrs = db.load_group(session, m, 'test', columns=columns)
+
+    assert sorted(rpsrs) == ['alpha', 'w_score_means', 'w_score_sems']
+    assert np.allclose(rpsrs['w_score_means'], [w.mean(axis=0) for w in w_scores])
+    assert np.allclose(rpsrs['w_score_sems'], [stats.sem(w, axis=0) for w in w_scores])
+
+    summaries = db.summarize(session, m.group, 'test', ['g_x'], ['alpha'])
+
+    assert summaries['g_x'].tolist() == [0, 1]
+    assert summaries['alpha_n'].tolist() == [3, 3]
+    assert np.allclose(summaries['alpha_mean'], [2, 3])
+    assert np.allclose(summaries['alpha_sem'], [stats.sem([0, 2, 4]), stats.sem([1, 3, 5])])
+
+    session.close()
+    db.dispose_engines()
+
+
+def test_trials_are_unique_per_point(tmpdir, monkeypatch):
+
+    import pytest
+    from sqlalchemy.exc import IntegrityError
+    import db
+    from db import _models
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir))
+
+    m = _models.ReplayPlusStdpTrial
+    session = db.connect_and_make_session('test', backend='sqlite')
+
+    with db.ResultWriter(session) as writer:
+        for key in ['a', 'b']:
+            for trial in range(3):
+                writer.add(m(group='test', param_key=key, trial=trial, w_score=[trial, 0.]))
+
+    w_scores = session.query(m.w_score).filter(
+        m.group == 'test', m.param_key == 'b').order_by(m.trial).all()
+    assert np.array([row[0] for row in w_scores]).tolist() == [[0, 0], [1, 0], [2, 0]]
+
+    with pytest.raises(IntegrityError):
+        with db.ResultWriter(session) as writer:
+            writer.add(m(group='test', param_key='a', trial=1, w_score=[0., 0.]))
+
+    session.close()
+    db.dispose_engines()
+
+
+def test_merge_shards_deduplicates_by_key_and_is_idempotent(tmpdir, monkeypatch):
+
+    import os
+    import db
+    from db import _models
+
+    m = _models.ReplayPlusStdpResult
+    t = _models.ReplayPlusStdpTrial
+
+    def make_shard(name, keys, trials=()):
+
+        monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir.mkdir(name)))
+
+        with db.session_scope('shard', backend='sqlite') as session:
+            for key in keys:
+                session.add(m(
+                    group='test', param_key=key, g_x=.5, beta_1=.1,
+                    sequence_novel=[0, 1, 2], w_scores=np.ones((3, 2)) * len(key or '')))
+            for key, trial in trials:
+                session.add(t(group='test', param_key=key, trial=trial, w_score=[trial, 0.]))
+
+        return str(tmpdir.join(name, 'shard.db'))
+
+    shard_a = make_shard('a', ['a', 'b', None], [('a', 0), ('a', 1)])
+    shard_b = make_shard('b', ['b', 'cc'], [('a', 1), ('a', 2)])
+
+    # a group exported from a third shard
+    make_shard('c', ['ddd'])
+    with db.session_scope('shard', backend='sqlite') as session:
+        shard_c = str(tmpdir.mkdir(m.__tablename__).join('c.npz'))
+        db.export_group(session, m, 'test', path=shard_c)
+
+    monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir.mkdir('central')))
+
+    with db.session_scope('central', backend='sqlite') as session:
+        session.add(m(group='test', param_key='a', g_x=.5))
+
+    with db.session_scope('central', backend='sqlite') as session:
+
+        counts = db.merge_shards(session, [shard_a, shard_b, shard_c], batch_size=2)
+
+        assert counts[m.__tablename__] == {'inserted': 4, 'duplicate': 2, 'unkeyed': 1}
+        assert counts[t.__tablename__] == {'inserted': 3, 'duplicate': 1, 'unkeyed': 0}
+
+        records = db.get_records(session, m.group, 'test', ['a', 'b', 'cc', 'ddd'])
+
+        assert records['a'].w_scores is None
+
+        # a record stored without a parameter key is kept
+        unkeyed = session.query(m).filter(m.param_key.is_(None)).one()
+        assert np.array_equal(unkeyed.w_scores, np.zeros((3, 2)))
+        assert records['cc'].sequence_novel == [0, 1, 2]
+        assert np.array_equal(records['ddd'].w_scores, 3 * np.ones((3, 2)))
+        assert np.array_equal(records['ddd'].w_score_means, [3, 3])
+
+        trials = session.query(t.trial).filter(t.param_key == 'a').order_by(t.trial).all()
+        assert [trial[0] for trial in trials] == [0, 1, 2]
+
+    # merging again changes nothing
+    with db.session_scope('central', backend='sqlite') as session:
+
+        counts = db.merge_shards(session, [shard_a, shard_b, shard_c])
+
+        assert counts[m.__tablename__] == {'inserted': 0, 'duplicate': 6, 'unkeyed': 1}
+        assert counts[t.__tablename__]['inserted'] == 0
+        assert session.query(m).count() == 5
+
+    # exports of merged groups are removed
+    with db.session_scope('central', backend='sqlite') as session:
+
+        monkeypatch.setattr(db.export, 'DEFAULT_EXPORT_DIR', str(tmpdir.join('export')))
+        assert len(db.load_group(session, m, 'test')['param_key']) == 5
+
+        shard_d = make_shard('d', ['eeee'])
+        monkeypatch.setenv('NPR_SQLITE_DIR', str(tmpdir.join('central')))
+
+        db.merge_shards(session, [shard_d])
+        assert not os.path.exists(db.export.group_path(session, m, 'test'))
+        assert len(db.load_group(session, m, 'test')['param_key']) == 6
+
+    db.dispose_engines()
@@ -251,3 +251,106 @@ def test_wta_network_wta_rule_is_input_dependent():
             np.sum(rs.nonzero()[1] == actives))
 
     assert 0 < np.mean(same_as_nonzero_wta_factor) < 6
+
+
+def test_lif_network_gives_same_results_with_sparse_and_dense_weights():
+
+    from connectivity import adlib_lif
+    from network import LIFExponentialSynapsesModel
+
+    np.random.seed(0)
+    n = 5
+    mask = np.eye(n, k=-1)
+    dt = .0005
+    n_steps = 2000
+
+    taus_syn = {'ampa': .002, 'nmda': .08, 'gaba': .005}
+    v_revs_syn = {'ampa': 0., 'nmda': 0., 'gaba': -.08}
+
+    drives = {syn: np.zeros((n_steps, 2*n + 1)) for syn in taus_syn}
+    drives['ampa'][:, :n] = 2 * (np.random.rand(n_steps, n) < 100 * dt)
+
+    measurements = []
+
+    for sparse in [False, True]:
+
+        ws = adlib_lif(
+            mask, w_pp=.5, w_mp=2, w_pm=.3, w_mm=.3, w_pi=1, w_ip=.5, sparse=sparse)
+
+        ntwk = LIFExponentialSynapsesModel(
+            v_rests=-.07 * np.ones((2*n + 1,)), taus_m=.05 * np.ones((2*n + 1,)),
+            taus_syn=taus_syn, v_revs_syn=v_revs_syn,
+            v_ths=-.05 * np.ones((2*n + 1,)), v_resets=-.07 * np.ones((2*n + 1,)),
+            refrac_pers=.002 * np.ones((2*n + 1,)), ws=ws)
+
+        initial_conditions = {
+            'voltages': -.07 * np.ones((2*n + 1,)),
+            'conductances': {syn: np.zeros((2*n + 1,)) for syn in taus_syn},
+            'refrac_ctrs': np.zeros((2*n + 1,)),
+        }
+
+        measurements.append(ntwk.run(
+            initial_conditions=initial_conditions, drives=drives, dt=dt,
+            record=('spikes', 'voltages')))
+
+    assert measurements[0]['spikes'].sum() > 0
+    assert np.all(measurements[0]['spikes'] == measurements[1]['spikes'])
+    assert np.allclose(measurements[0]['voltages'], measurements[1]['voltages'])
+
+
+def test_trajectory_check_agrees_with_simulation_in_random_networks():
+
+    from network import BasicWithAthAndTwoLevelStdp as Network
+
+    np.random.seed(0)
+
+    for _ in range(100):
+
+        n_nodes = np.random.randint(3, 15)
+        n_steps = np.random.randint(3, 20)
+
+        w = (np.random.rand(n_nodes, n_nodes) < .3) * np.random.choice([.5, 1, 1.5])
+        ntwk = Network(
+            th=1.5, w=w, g_x=np.random.choice([0, .5, 1]),
+            t_x=np.random.randint(1, 5), rp=np.random.randint(1, 4), stdp_params=None)
+
+        drives = 2 * (np.random.rand(4, n_steps, n_nodes) < .1)
+        xc_0 = np.zeros((n_nodes,))
+
+        rs = np.array([
+            ntwk.run(np.zeros((n_nodes,)), xc_0, drives_)[0] for drives_ in drives])
+
+        # actual trajectories are consistent throughout
+        assert np.all(ntwk.first_inconsistent_steps(rs, drives, xc_0) == n_steps)
+
+        # perturbed trajectories are inconsistent at or before the perturbation,
+        # and the actual trajectory agrees with them up to the inconsistent step
+        rs_perturbed = rs.copy()
+        t_perturbed = np.random.randint(1, n_steps, len(rs))
+
+        for rs_, t in zip(rs_perturbed, t_perturbed):
+            node = np.random.randint(n_nodes)
+            rs_[t, node] = 1 - rs_[t, node]
+
+        first_inconsistent = ntwk.first_inconsistent_steps(rs_perturbed, drives, xc_0)
+
+        assert np.all(first_inconsistent <= t_perturbed)
+
+        for r, r_perturbed, t_first in zip(rs, rs_perturbed, first_inconsistent):
+
+            assert np.all(r[:t_first] == r_perturbed[:t_first])
+            if t_first < n_steps: assert np.any(r[t_first] != r_perturbed[t_first])
+
+
+def test_trajectory_check_leaves_stochastic_wta_trajectories_undecided():
+
+    from network import LocalWtaWithAthAndStdp
+
+    w = np.eye(6, k=-1)
+    ntwk = LocalWtaWithAthAndStdp(
+        th=.5, w=w, g_x=0, t_x=0, rp=2, stdp_params=None, wta_dist=2, wta_factor=0)
+
+    rs = np.zeros((3, 8, 6))
+    rs[:, np.arange(6), np.arange(6)] = 1
+
+    assert np.all(ntwk.first_inconsistent_steps(rs, rs) == 0)
@@ -0,0 +1,63 @@
+from __future__ import division, print_function
+import json
+import os
+import numpy as np
+
+
+def test_phase_timer_accumulates_and_merges_times_and_counts():
+
+    from metrics import PhaseTimer
+
+    timer = PhaseTimer()
+
+    for _ in range(3):
+        with timer.phase('simulation'):
+            pass
+        timer.count('trials')
+        timer.count('steps', 10)
+
+    assert timer.counts == {'trials': 3, 'steps': 30}
+    assert set(timer.times) == {'simulation'}
+
+    other = PhaseTimer()
+    other.merge(timer.as_dict())
+    other.merge(timer.as_dict())
+
+    assert other.counts == {'trials': 6, 'steps': 60}
+    assert np.isclose(other.times['simulation'], 2 * timer.times['simulation'])
+
+
+def test_progress_monitor_writes_metrics_with_rates_and_eta(tmpdir):
+
+    import network
+    from metrics import ProgressMonitor
+
+    metrics_file = os.path.join(str(tmpdir), 'metrics.jsonl')
+
+    ntwk = network.BasicWithAthAndTwoLevelStdp(
+        th=0.5, w=np.eye(5, k=-1), g_x=0, t_x=2, rp=2, stdp_params=None)
+    drives = np.zeros((20, 5))
+    drives[1, 0] = 1
+
+    progress = ProgressMonitor(4, name='test', metrics_file=metrics_file, interval=0)
+
+    for _ in range(2):
+        ntwk.run(np.zeros((5,)), np.zeros((5,)), drives)
+        progress.update(stats={
+            'times': {'simulation': ntwk.run_stats['wall_time']},
+            'counts': {'trials': 1, 'steps': ntwk.run_stats['n_steps']}})
+
+    progress.report()
+
+    with open(metrics_file) as f:
+        lines = [json.loads(line) for line in f]
+
+    # one report per update (interval is zero) plus the final one
+    assert len(lines) == 3
+
+    summary = lines[-1]
+
+    assert summary['completed'] == 2 and summary['total'] == 4
+    assert summary['counts'] == {'trials': 2, 'steps': 40}
+    assert summary['steps_per_sec'] > 0 and summary['eta'] > 0
+    assert 'simulation' in summary['phase_times']
@@ -0,0 +1,60 @@
+from __future__ import division, print_function
+import multiprocessing
+import numpy as np
+
+
+def _sum_and_try_to_write(args):
+
+    from shared import attach
+
+    handles, name = args
+    array = attach(handles)[name]
+
+    try:
+        array[0] = -1
+        writeable = True
+    except ValueError:
+        writeable = False
+
+    return array.sum(), writeable
+
+
+def test_shared_arrays_are_read_only_views_in_workers():
+
+    from shared import SharedArrays
+
+    arrays = {'w': np.arange(12.).reshape(3, 4), 'mask': np.eye(3, dtype=bool)}
+
+    with SharedArrays(arrays) as shared:
+
+        pool = multiprocessing.Pool(2)
+        results = pool.map(
+            _sum_and_try_to_write, [(shared.handles, 'w'), (shared.handles, 'mask')])
+        pool.close()
+        pool.join()
+
+    assert results == [(66., False), (3, False)]
+
+
+def test_networks_run_over_read_only_weights_and_copy_them_only_for_stdp():
+
+    from network import BasicWithAthAndTwoLevelStdp as Network
+
+    w = 2 * np.eye(6, k=-1) + np.eye(6, k=1)
+    w.flags.writeable = False
+
+    drives = np.zeros((10, 6))
+    drives[1, 0] = 2
+
+    rs, _ = Network(th=1.5, w=w, g_x=1, t_x=5, rp=2, stdp_params=None).run(
+        np.zeros((6,)), np.zeros((6,)), drives)
+
+    assert np.all(rs[1:7].nonzero()[1] == np.arange(6))
+
+    stdp_params = {'w_0': .5, 'w_1': 3, 'beta_0': .5, 'beta_1': .5}
+    ntwk = Network(th=1.5, w=w, g_x=1, t_x=5, rp=2, stdp_params=stdp_params)
+    _, _, w_measurements = ntwk.run(
+        np.zeros((6,)), np.zeros((6,)), drives, measure_w=lambda w_: w_.copy())
+
+    assert not np.all(w_measurements[-1] == w)
+    assert np.all(w == 2 * np.eye(6, k=-1) + np.eye(6, k=1))
@@ -66,3 +66,182 @@ def test_zip_cproduct_works_on_examples():
 
     assert zip_cproduct(
         z=z, c=c, order=['y', 'z1', 'x', 'z0'], kwargs=kwargs) == correct
+
+
+def test_markov_chain_sampler_reproduces_transition_statistics():
+    import numpy as np
+    from scipy import sparse
+    from shortcuts import MarkovChainSampler
+
+    np.random.seed(0)
+
+    trs = np.array([
+        [0, .5, 0, 1],
+        [.2, 0, 0, 0],
+        [.8, .5, 0, 0],
+        [0, 0, 1, 0],
+    ])
+    p_0 = np.array([.1, .2, .3, .4])
+
+    for trs_ in [trs, sparse.csr_matrix(trs)]:
+
+        seqs = MarkovChainSampler(p_0, trs_).sample(20000, 5)
+
+        assert seqs.shape == (20000, 5)
+
+        # initial states are distributed according to p_0
+        assert np.allclose(np.bincount(seqs[:, 0], minlength=4) / 20000., p_0, atol=.02)
+
+        # empirical transition probabilities match transition matrix
+        counts = np.zeros((4, 4))
+        np.add.at(counts, (seqs[:, 1:].flatten(), seqs[:, :-1].flatten()), 1)
+
+        assert np.all(counts[trs == 0] == 0)
+        assert np.allclose(counts / counts.sum(axis=0), trs, atol=.02)
+
+
+def test_stationary_distribution_solvers_agree_with_eigendecomposition():
+    import numpy as np
+    from scipy import sparse
+    from shortcuts import get_stationary_distribution, stationary_distribution
+
+    np.random.seed(0)
+
+    trs = (np.random.rand(30, 30) < .2).astype(float)
+    np.fill_diagonal(trs, 0)
+    trs[(np.arange(30) + 1) % 30, np.arange(30)] = 1  # guarantee irreducibility
+    trs /= trs.sum(axis=0)
+
+    p_0_correct = get_stationary_distribution(trs)
+
+    for trs_ in [trs, sparse.csr_matrix(trs)]:
+        for method in ['solve', 'power', 'eig']:
+
+            p_0 = stationary_distribution(trs_, method=method)
+            assert np.allclose(p_0, p_0_correct, atol=1e-8)
+
+            # cached results are returned as copies
+            p_0[:] = 0
+            assert np.allclose(stationary_distribution(trs_, method=method), p_0_correct)
+
+    # periodic chain (power iteration must still converge)
+    trs = np.array([[0, 1.], [1., 0]])
+    assert np.allclose(stationary_distribution(trs, method='power'), [.5, .5])
+
+    # reducible chain of two disconnected 2-cycles (singular linear system)
+    trs = np.zeros((4, 4))
+    trs[[1, 0, 3, 2], [0, 1, 2, 3]] = 1
+
+    for trs_ in [trs, sparse.csr_matrix(trs)]:
+
+        p_0 = stationary_distribution(trs_, cache=False)
+
+        assert np.all(np.isfinite(p_0)) and np.all(p_0 >= 0)
+        assert np.isclose(p_0.sum(), 1)
+        assert np.allclose(trs.dot(p_0), p_0)
+
+
+def test_parameter_grid_supports_random_access_sharding_and_stable_ids():
+    from shortcuts import ParameterGrid, zip_cproduct
+
+    kwargs = {'x': [1, 2, 3], 'y': [4, 5, 6], 'z0': [.1, .2], 'z1': ['a', 'b', 'c']}
+    args = (['x', 'y'], ['z0', 'z1'], ['z1', 'x', 'z0', 'y'], kwargs)
+
+    grid = ParameterGrid(*args)
+    points = zip_cproduct(*args)
+
+    assert len(grid) == len(points) == 18
+    assert [grid[idx] for idx in range(len(grid))] == points
+    assert grid[-1] == points[-1]
+    assert grid.params(0) == {'z1': 'a', 'x': 1, 'z0': .1, 'y': 4}
+
+    # shards are disjoint and cover the grid
+    shards = [grid.shard(i, 4) for i in range(4)]
+    assert sum(len(shard) for shard in shards) == len(grid)
+    assert sorted(point for shard in shards for point in shard) == sorted(points)
+
+    # ids are unique and unchanged when grid is extended
+    ids = [grid.point_id(idx) for idx in range(len(grid))]
+    assert len(set(ids)) == len(ids)
+
+    kwargs_extended = dict(kwargs, z0=[.05, .1, .2])
+    grid_extended = ParameterGrid(['x', 'y'], ['z0', 'z1'], ['z1', 'x', 'z0', 'y'], kwargs_extended)
+    ids_extended = [grid_extended.point_id(idx) for idx in range(len(grid_extended))]
+
+    assert set(ids) < set(ids_extended)
+    assert shards[1].point_id(0) == grid.point_id(1)
+
+
+def test_param_key_is_insensitive_to_numeric_type_and_container_type():
+    import numpy as np
+    from shortcuts import param_key
+
+    key = param_key({'g_x': .3, 'l': 5, 'seq': [(0, 1), (1, 2)]})
+
+    assert param_key({'l': np.int64(5), 'g_x': np.float64(.1 + .2), 'seq': [[0, 1], [1, 2]]}) == key
+    assert param_key({'g_x': .31, 'l': 5, 'seq': [(0, 1), (1, 2)]}) != key
+
+
+def test_adaptive_trials_stop_early_only_when_answer_is_certain():
+    import numpy as np
+    from shortcuts import run_trials_adaptively, wilson_interval
+
+    lower, upper = wilson_interval(50, 100)
+    assert lower < .5 < upper
+    assert np.isclose(.5 - lower, upper - .5)
+
+    np.random.seed(0)
+
+    def make_run_block(p):
+        return lambda n: np.random.rand(n) < p
+
+    # certain outcomes stop quickly
+    p, n_trials, lower, upper = run_trials_adaptively(
+        make_run_block(1.), block_size=10, max_trials=1000, ci_width=.1)
+    assert p == 1 and n_trials < 1000 and upper - lower <= .1
+
+    p, n_trials, lower, upper = run_trials_adaptively(
+        make_run_block(0.), block_size=10, max_trials=1000, low_threshold=.05, min_trials=20)
+    assert p == 0 and 20 <= n_trials < 1000 and upper < .05
+
+    # uncertain outcomes use more trials
+    p, n_trials_uncertain, lower, upper = run_trials_adaptively(
+        make_run_block(.5), block_size=10, max_trials=1000, ci_width=.1)
+    assert n_trials_uncertain > n_trials
+    assert lower < p < upper
+
+
+def test_point_seeds_depend_on_base_seed_and_key():
+    from shortcuts import param_key, point_seed
+
+    key_0 = param_key({'g_x': .3})
+    key_1 = param_key({'g_x': .4})
+
+    assert point_seed(0, key_0) == point_seed(0, key_0)
+    assert len(set([point_seed(0, key_0), point_seed(0, key_1), point_seed(1, key_0)])) == 3
+    assert 0 <= point_seed(0, key_0) < 2**32
+
+
+def test_common_noise_is_reproducible_and_standardized():
+    import pickle
+    import numpy as np
+    from shortcuts import CommonNoise
+
+    common_noise = CommonNoise(0, 200, (50, 10))
+    noise = common_noise[:]
+
+    assert len(common_noise) == 200 and noise.shape == (200, 50, 10)
+    assert np.all(noise == CommonNoise(0, 200, (50, 10))[:])
+    assert np.abs(noise.mean()) < .01 and np.abs(noise.std() - 1) < .01
+
+    # realizations are generated per trial, from streams spawned from the seed
+    rng = np.random.default_rng(np.random.SeedSequence(0).spawn(200)[7])
+    assert np.all(common_noise[7] == rng.standard_normal((50, 10)))
+    assert np.all(common_noise[5:8] == noise[5:8])
+    assert np.all(pickle.loads(pickle.dumps(common_noise))[3] == noise[3])
+    assert len(pickle.dumps(common_noise)) < 1000
+
+    # realizations are kept by the process and cannot be modified through callers
+    assert common_noise[7] is CommonNoise(0, 200, (50, 10))[7]
+    assert not common_noise[7].flags.writeable
+    assert CommonNoise(1, 200, (50, 10))[7] is not common_noise[7]
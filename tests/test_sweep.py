@@ -0,0 +1,112 @@
+from __future__ import division, print_function
+import numpy as np
+from sqlalchemy import Column, Float, Integer, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+Base = declarative_base()
+
+
+class SweepTestResult(Base):
+
+    __tablename__ = 'sweep_test_result'
+
+    id = Column(Integer, primary_key=True)
+    group = Column(String)
+    param_key = Column(String)
+
+    x = Column(Float)
+    y = Column(Float)
+    value = Column(Float)
+
+
+def _simulate(params, context):
+
+    if params['x'] < 0: raise ValueError('negative x')
+
+    # weights are in shared memory (and read-only) when run on multiple workers
+    return params['x'] * params['y'] * context['scale'] + context['w'].sum() + np.random.rand()
+
+
+def _simulate_key(params, context):
+
+    from sweep import current_key
+
+    # simulations can store partial results under the key of their point
+    return float(int(current_key()[:8], 16))
+
+
+def _make_row(params, result):
+
+    return SweepTestResult(x=params['x'], y=params['y'], value=result)
+
+
+def _make_session():
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+
+    return sessionmaker(bind=engine)()
+
+
+def _run_sweep(session, xs, n_workers, resume=True):
+
+    from shortcuts import ParameterGrid
+    from sweep import Sweep
+
+    grid = ParameterGrid([], ['x', 'y'], ['x', 'y'], {'x': xs, 'y': [1., 2., 3.]})
+
+    return Sweep(
+        grid=grid, simulate=_simulate, make_row=_make_row, model=SweepTestResult,
+        group='test', seed=0, context={'scale': 10, 'w': np.eye(3)}, fixed_params={'n': 1},
+        n_workers=n_workers, max_retries=1).run(session, resume=resume)
+
+
+def _values(session):
+
+    rows = session.query(SweepTestResult).all()
+    return {(row.x, row.y): row.value for row in rows}
+
+
+def test_sweep_results_are_independent_of_worker_count_and_resumable():
+
+    sessions = [_make_session() for _ in range(2)]
+
+    for session, n_workers in zip(sessions, [1, 2]):
+        assert _run_sweep(session, [-1., 1., 2.], n_workers) == [0, 1, 2]
+
+    # failed points are reported and not stored
+    values = [_values(session) for session in sessions]
+    assert len(values[0]) == 6
+    assert values[0] == values[1]
+
+    # resuming an extended sweep only runs new points, which match a full run
+    _run_sweep(sessions[0], [-1., 1., 2., 3.], 1)
+    assert sessions[0].query(SweepTestResult).count() == 9
+
+    session_full = _make_session()
+    _run_sweep(session_full, [1., 2., 3.], 1)
+    assert _values(sessions[0]) == _values(session_full)
+
+    # rerunning without resuming replaces the group
+    _run_sweep(sessions[0], [1.], 1, resume=False)
+    assert sessions[0].query(SweepTestResult).count() == 3
+
+
+def test_simulations_see_key_of_their_point():
+
+    from shortcuts import ParameterGrid
+    from sweep import Sweep
+
+    session = _make_session()
+    grid = ParameterGrid([], ['x', 'y'], ['x', 'y'], {'x': [1., 2.], 'y': [1., 2.]})
+
+    for n_workers in [1, 2]:
+        Sweep(
+            grid=grid, simulate=_simulate_key, make_row=_make_row, model=SweepTestResult,
+            group=str(n_workers), seed=0, n_workers=n_workers).run(session)
+
+    rows = session.query(SweepTestResult).all()
+
+    assert len(rows) == 8
+    assert all(row.value == int(row.param_key[:8], 16) for row in rows)